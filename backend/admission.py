@@ -0,0 +1,254 @@
+import asyncio
+import contextvars
+import hashlib
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Iterable, List, Tuple
+
+from metrics import admission_active, admission_queue_depth, admission_rejected, admission_wait_seconds, record_timing
+from tracing import record_span
+
+# backpressure in front of the expensive stages:
+#   download - .osz downloads from osu!
+#   cpu      - conversion / parsing jobs handed to the cpu executor
+#   calc     - native minacalc calls (one at a time anyway, the queue is what matters)
+# each pool has an in-flight limit and a bounded wait queue. a request is admitted up front,
+# if any pool it needs already has a full queue it gets a 503 with Retry-After instead of piling on.
+# work that was admitted waits for its slot rather than failing halfway through a batch, anything
+# that wasn't (background rating calcs, listing fallbacks) is held to the bound on every acquire.
+#
+# the wait queue isn't fifo, a freed slot goes to (in order):
+#   1. the interactive lane (single map requests) before the bulk lane (batches, rating backfill),
+#      bulk jobs waiting longer than BULK_PROMOTE_AFTER are treated as interactive so they can't starve
+#   2. the owner (user token) that got the fewest slots from this pool so far
+#   3. the cheapest job, cost is the chart's hit object count
+RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+MAX_RETRY_AFTER = 120
+BULK_PROMOTE_AFTER = float(os.getenv("BULK_PROMOTE_AFTER", "30"))
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+# (lane, owner) of the request doing the work, cost of the chart being worked on
+_current_job: contextvars.ContextVar[Tuple[str, str]] = contextvars.ContextVar("admission_job", default=(INTERACTIVE, "anonymous"))
+_current_cost: contextvars.ContextVar[int] = contextvars.ContextVar("admission_cost", default=0)
+# pools the current request was admitted to
+_admitted: contextvars.ContextVar[frozenset] = contextvars.ContextVar("admission_admitted", default=frozenset())
+
+
+def owner_key(secret: str) -> str:
+    #tokens never end up in metrics or memory longer than needed
+    return hashlib.sha256(secret.encode()).hexdigest()[:12]
+
+@contextmanager
+def job_scope(lane: str, owner: str):
+    token = _current_job.set((lane, owner))
+    try:
+        yield
+    finally:
+        _current_job.reset(token)
+
+@contextmanager
+def job_cost(cost: int):
+    token = _current_cost.set(max(0, int(cost or 0)))
+    try:
+        yield
+    finally:
+        _current_cost.reset(token)
+
+
+class Overloaded(Exception):
+    def __init__(self, pool: str, retry_after: int):
+        super().__init__(f"Server busy ({pool} queue full), retry in {retry_after}s")
+        self.pool = pool
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("lane", "owner", "cost", "seq", "enqueued", "future")
+
+    def __init__(self, lane: str, owner: str, cost: int, seq: int, future: asyncio.Future):
+        self.lane = lane
+        self.owner = owner
+        self.cost = cost
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.future = future
+
+
+class AdmissionPool:
+    def __init__(self, name: str, limit: int, max_queue: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.active = 0
+        self.rejected = 0
+        # smoothed slot hold time, used to guess a Retry-After
+        self.avg_hold = 0.0
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        # owner -> slots granted, and owner -> waiting + active. owners drop out once idle
+        self._served: Dict[str, int] = {}
+        self._load: Dict[str, int] = {}
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def full(self) -> bool:
+        return self.waiting >= self.max_queue
+
+    def retry_after(self) -> int:
+        #roughly how long until the queue ahead drains below the limit
+        estimate = math.ceil((self.waiting + 1) / self.limit * self.avg_hold)
+        return min(MAX_RETRY_AFTER, max(RETRY_AFTER, estimate))
+
+    def reject(self):
+        self.rejected += 1
+        admission_rejected.inc(pool=self.name)
+        raise Overloaded(self.name, self.retry_after())
+
+    def _join(self, owner: str):
+        if owner not in self._load:
+            # a new owner starts level with the least served one present, not at 0,
+            # otherwise it would get every slot until it caught up with long running batches
+            self._served[owner] = min(self._served.values(), default=0)
+        self._load[owner] = self._load.get(owner, 0) + 1
+
+    def _leave(self, owner: str):
+        self._load[owner] -= 1
+        if self._load[owner] == 0:
+            del self._load[owner]
+            del self._served[owner]
+
+    def _priority(self, waiter: _Waiter, now: float) -> tuple:
+        lane = waiter.lane
+        if lane == BULK and now - waiter.enqueued > BULK_PROMOTE_AFTER:
+            lane = INTERACTIVE
+        return (LANES.index(lane), self._served[waiter.owner], waiter.cost, waiter.seq)
+
+    def _grant(self, owner: str):
+        self.active += 1
+        self._served[owner] += 1
+
+    def _release(self):
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        # waiters cancelled while queued are dropped by their own task, skip them here
+        now = time.monotonic()
+        while self.active < self.limit:
+            candidates = [w for w in self._waiters if not w.future.done()]
+            if not candidates:
+                break
+            waiter = min(candidates, key=lambda w: self._priority(w, now))
+            self._waiters.remove(waiter)
+            self._grant(waiter.owner)
+            waiter.future.set_result(None)
+        self._update_gauges()
+
+    def _update_gauges(self):
+        admission_active.set(self.active, pool=self.name)
+        for lane in LANES:
+            admission_queue_depth.set(sum(1 for w in self._waiters if w.lane == lane), pool=self.name, lane=lane)
+
+    async def _acquire(self, lane: str, owner: str, cost: int):
+        self._join(owner)
+        if self.active < self.limit and not self._waiters:
+            self._grant(owner)
+            self._update_gauges()
+            return
+
+        if self.full and self.name not in _admitted.get():
+            self._leave(owner)
+            self.reject()
+
+        waiter = _Waiter(lane, owner, cost, next(self._seq), asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self._update_gauges()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._update_gauges()
+            elif waiter.future.done() and not waiter.future.cancelled():
+                # granted and cancelled in the same tick, hand the slot on
+                self._release()
+            self._leave(owner)
+            raise
+
+    @asynccontextmanager
+    async def slot(self):
+        lane, owner = _current_job.get()
+        submitted = time.time()
+        started = time.perf_counter()
+        await self._acquire(lane, owner, _current_cost.get())
+
+        waited = time.perf_counter() - started
+        admission_wait_seconds.observe(waited, pool=self.name, lane=lane)
+        record_timing(f"{self.name}_admission", waited)
+        if waited > 0.001:
+            record_span(f"{self.name}_admission", submitted, submitted + waited, category="queue")
+
+        held_from = time.perf_counter()
+        try:
+            yield
+        finally:
+            held = time.perf_counter() - held_from
+            self.avg_hold = held if self.avg_hold == 0.0 else 0.8 * self.avg_hold + 0.2 * held
+            self._leave(owner)
+            self._release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": {lane: sum(1 for w in self._waiters if w.lane == lane) for lane in LANES},
+            "owners": len(self._load),
+            "rejected": self.rejected,
+            "avg_hold_ms": round(self.avg_hold * 1000, 2),
+        }
+
+
+class AdmissionController:
+    def __init__(self, pools: Iterable[AdmissionPool]):
+        self.pools: Dict[str, AdmissionPool] = {pool.name: pool for pool in pools}
+
+    def __getitem__(self, name: str) -> AdmissionPool:
+        return self.pools[name]
+
+    def admit(self, *names: str):
+        #raises Overloaded for the first pool with a full queue. otherwise the calling task (and tasks it
+        #starts from here on) may queue on these pools past the bound
+        names = names or tuple(self.pools)
+        for name in names:
+            pool = self.pools[name]
+            if pool.full:
+                pool.reject()
+        _admitted.set(_admitted.get() | frozenset(names))
+
+    def stats(self) -> dict:
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+
+def _pool_from_env(name: str, default_limit: int, default_queue: int) -> AdmissionPool:
+    prefix = f"ADMIT_{name.upper()}"
+    return AdmissionPool(name, int(os.getenv(f"{prefix}_LIMIT", str(default_limit))),
+                         int(os.getenv(f"{prefix}_QUEUE", str(default_queue))))
+
+def build_controller(cpu_workers: int) -> AdmissionController:
+    return AdmissionController([
+        _pool_from_env("download", 4, 32),
+        # no more cpu jobs than workers, anything beyond that would wait in the executor's fifo
+        # instead of here where it gets scheduled
+        _pool_from_env("cpu", cpu_workers, 256),
+        _pool_from_env("calc", 1, 256),
+    ])
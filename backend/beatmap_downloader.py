@@ -1,28 +1,50 @@
 import aiohttp
+import asyncio
 import zipfile
 import os
 from pathlib import Path
-from typing import List
+from typing import List, Optional, Tuple, Union
+
+from ttl_cache import TTLCache
+from executors import admission, run_io
+from metrics import stage_timer
+from osu_to_sm import OsuBeatmap
+
+# beatmapset metadata barely changes, keyed by beatmapset id
+beatmapset_info_cache = TTLCache(
+    "beatmapset_info",
+    ttl=float(os.getenv("BEATMAPSET_CACHE_TTL", "3600")),
+    max_size=int(os.getenv("BEATMAPSET_CACHE_SIZE", "2048"))
+)
+FALLBACK_INFO_TTL = 60.0
+
+# overridable so load tests can point at a local stand-in server
+OSU_BASE_URL = os.getenv("OSU_BASE_URL", "https://osu.ppy.sh").rstrip("/")
 
 class BeatmapDownloader:
-    def __init__(self, access_token, client_id=None, client_secret=None, user_cookie=None):
+    def __init__(self, access_token, client_id=None, client_secret=None, user_cookie=None, osu_cache_dir=None):
         self.access_token = access_token
         self.client_id = client_id
         self.client_secret = client_secret
         self.cookie_header = user_cookie or os.getenv("OSU_SESSION_COOKIE")
+        # local .osu cache, checked before falling back to a full .osz download
+        self.osu_cache_dir = osu_cache_dir
 
     async def download_and_extract_beatmapset(self, beatmap_id: int, temp_dir: str) -> str:
         if not self.cookie_header:
             raise Exception("No osu! session cookie provided. Please add your cookie in settings.")
 
-        osz_path = await self._download_osz(beatmap_id, temp_dir)
+        async with admission["download"].slot():
+            with stage_timer("download"):
+                osz_path = await self._download_osz(beatmap_id, temp_dir)
         extracted_dir = os.path.join(temp_dir, "extracted")
-        self._extract_osz(osz_path, extracted_dir)
+        with stage_timer("extract"):
+            await run_io(self._extract_osz, osz_path, extracted_dir)
         return extracted_dir
 
     async def _download_osz(self, beatmap_id: int, temp_dir: str) -> str:
         osz_path = os.path.join(temp_dir, f"{beatmap_id}.osz")
-        url = f"https://osu.ppy.sh/beatmapsets/{beatmap_id}/download"
+        url = f"{OSU_BASE_URL}/beatmapsets/{beatmap_id}/download"
 
         cookie_value = self.cookie_header
         if cookie_value and not cookie_value.strip().startswith("osu_session="):
@@ -34,7 +56,7 @@ class BeatmapDownloader:
             "Accept-Language": "en-US,en;q=0.5",
             "Accept-Encoding": "gzip, deflate, br, zstd",
             "Connection": "keep-alive",
-            "Referer": f"https://osu.ppy.sh/beatmapsets/{beatmap_id}",
+            "Referer": f"{OSU_BASE_URL}/beatmapsets/{beatmap_id}",
             "Cookie": cookie_value,
             "Upgrade-Insecure-Requests": "1",
         }
@@ -57,6 +79,10 @@ class BeatmapDownloader:
                     async for chunk in resp.content.iter_chunked(8192):
                         f.write(chunk)
 
+        await run_io(self._validate_osz, osz_path)
+        return osz_path
+
+    def _validate_osz(self, osz_path: str):
         try:
             with zipfile.ZipFile(osz_path, "r") as z:
                 if not z.namelist():
@@ -64,126 +90,164 @@ class BeatmapDownloader:
         except zipfile.BadZipFile:
             raise Exception("Corrupted OSZ")
 
-        return osz_path
-
     def _extract_osz(self, osz_path: str, extract_dir: str):
         os.makedirs(extract_dir, exist_ok=True)
         with zipfile.ZipFile(osz_path, 'r') as zip_ref:
             zip_ref.extractall(extract_dir)
 
-    def find_mania_osu_files(self, directory: str) -> List[str]:
-        mania_files = []
+    def find_mania_charts(self, directory: str) -> List[Tuple[str, OsuBeatmap]]:
+        #each .osu is read once, non-mania files stop after [General]. the parsed chart is shared with
+        #metadata and conversion downstream
+        charts = []
         for file in Path(directory).rglob("*.osu"):
-            if self._is_mania_map(str(file)):
-                mania_files.append(str(file))
-        return mania_files
-
-    def _is_mania_map(self, osu_file_path: str) -> bool:
-        try:
-            with open(osu_file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                for line in f:
-                    if line.strip().startswith('Mode:'):
-                        return line.split(':')[1].strip() == '3'
-                return False
-        except Exception:
-            return False
-
-    def parse_osu_metadata(self, osu_file_path: str) -> dict:
-        metadata = {}
-        hit_objects = 0
-        star_rating = 0.0
+            beatmap = self._read_chart(str(file))
+            if beatmap is not None and beatmap.is_mania:
+                charts.append((str(file), beatmap))
+        return charts
 
+    def _read_chart(self, osu_file_path: str) -> Optional[OsuBeatmap]:
         try:
-            with open(osu_file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                current_section = None
-
-                for line in f:
-                    line = line.strip()
-
-                    if line.startswith('[') and line.endswith(']'):
-                        current_section = line[1:-1]
-                    elif ':' in line and current_section in ['General', 'Metadata', 'Difficulty']:
-                        key, value = line.split(':', 1)
-                        key, value = key.strip(), value.strip()
-
-                        if key == 'Title': metadata['title'] = value
-                        elif key == 'Artist': metadata['artist'] = value
-                        elif key == 'Creator': metadata['creator'] = value
-                        elif key == 'Version': metadata['version'] = value
-                        elif key == 'CircleSize': metadata['key_count'] = int(float(value))
-                        elif key == 'OverallDifficulty': star_rating = float(value)
-                    elif current_section == 'HitObjects' and line and not line.startswith('//'):
-                        hit_objects += 1
-
-            metadata['hit_objects'] = hit_objects
-            metadata['star_rating'] = star_rating
+            return OsuBeatmap.from_file(osu_file_path, mania_only=True)
         except Exception as e:
             print(f"Error parsing {osu_file_path}: {e}")
+            return None
 
-        return metadata
+    async def get_beatmapset_info(self, beatmap_id: int, session: Optional[aiohttp.ClientSession] = None):
+        # fallback listings can be partial, retry the api again soon. only decided when the entry is
+        # fetched, a hit must not push the expiry out or a listing that keeps being read never gets retried
+        return await beatmapset_info_cache.get_or_fetch(
+            beatmap_id, lambda: self._fetch_beatmapset_info(beatmap_id, session),
+            ttl_for=lambda info: None if info.get('source') == 'api' else FALLBACK_INFO_TTL
+        )
 
-    async def get_beatmapset_info(self, beatmap_id: int):
+    async def get_beatmapsets_info(self, beatmap_ids: List[int], max_concurrency: int = 8) -> List[Union[dict, Exception]]:
+        #resolves a whole request at once, results (or the exception) come back in input order
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async with aiohttp.ClientSession() as session:
+            async def fetch_one(beatmap_id: int):
+                async with semaphore:
+                    return await self.get_beatmapset_info(beatmap_id, session)
+
+            return await asyncio.gather(*(fetch_one(beatmap_id) for beatmap_id in beatmap_ids), return_exceptions=True)
+
+    async def _fetch_beatmapset_info(self, beatmap_id: int, session: Optional[aiohttp.ClientSession] = None):
         try:
-            async with aiohttp.ClientSession() as session:
-                headers = {"Authorization": f"Bearer {self.access_token}"}
-                url = f"https://osu.ppy.sh/api/v2/beatmapsets/{beatmap_id}"
-
-                async with session.get(url, headers=headers) as response:
-                    if response.status != 200:
-                        raise Exception(f"API request failed: {response.status}")
-
-                    data = await response.json()
-                    mania_beatmaps = [bm for bm in data['beatmaps'] if bm['mode_int'] == 3]
-
-                    if not mania_beatmaps:
-                        raise Exception("No osu!mania maps found")
-
-                    difficulties = []
-                    for bm in mania_beatmaps:
-                        difficulties.append({
-                            'filename': f"{data['artist']} - {data['title']} ({data['creator']}) [{bm['version']}].osu",
-                            'difficulty_name': bm['version'],
-                            'creator': data['creator'],
-                            'key_count': int(bm['cs']),
-                            'hit_objects': bm['count_circles'] + bm['count_sliders'] + bm['count_spinners'],
-                            'star_rating': bm['difficulty_rating']
-                        })
-
-                    return {
-                        'beatmapset_id': beatmap_id,
-                        'title': data['title'],
-                        'artist': data['artist'],
-                        'creator': data['creator'],
-                        'difficulties': difficulties
-                    }
-
-        except Exception:
+            with stage_timer("metadata_api"):
+                if session is None:
+                    async with aiohttp.ClientSession() as own_session:
+                        return await self._fetch_beatmapset_info_api(beatmap_id, own_session)
+                return await self._fetch_beatmapset_info_api(beatmap_id, session)
+
+        except Exception as e:
+            print(f"Beatmapset API lookup failed for {beatmap_id}: {e}")
+
+            # cheap fallback first: difficulties we already have on disk
+            cached_info = await run_io(self._beatmapset_info_from_cache, beatmap_id)
+            if cached_info:
+                return cached_info
+
             import tempfile
             with tempfile.TemporaryDirectory() as temp_dir:
                 extracted_dir = await self.download_and_extract_beatmapset(beatmap_id, temp_dir)
-                mania_files = self.find_mania_osu_files(extracted_dir)
+                charts = await run_io(self.find_mania_charts, extracted_dir)
 
-                if not mania_files:
+                if not charts:
                     raise Exception("No osu!mania maps found")
 
-                difficulties = []
-                first_meta = self.parse_osu_metadata(mania_files[0])
-
-                for osu_file in mania_files:
-                    meta = self.parse_osu_metadata(osu_file)
-                    difficulties.append({
-                        'filename': os.path.basename(osu_file),
-                        'difficulty_name': meta.get('version', 'Unknown'),
-                        'creator': meta.get('creator', 'Unknown'),
-                        'key_count': meta.get('key_count', 4),
-                        'hit_objects': meta.get('hit_objects', 0),
-                        'star_rating': meta.get('star_rating', 0.0)
-                    })
-
-                return {
-                    'beatmapset_id': beatmap_id,
-                    'title': first_meta.get('title', 'Unknown'),
-                    'artist': first_meta.get('artist', 'Unknown'),
-                    'creator': first_meta.get('creator', 'Unknown'),
-                    'difficulties': difficulties
-                }
+                return self._beatmapset_info_from_charts(beatmap_id, charts)
+
+    async def _fetch_beatmapset_info_api(self, beatmap_id: int, session: aiohttp.ClientSession) -> dict:
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        url = f"{OSU_BASE_URL}/api/v2/beatmapsets/{beatmap_id}"
+
+        async with session.get(url, headers=headers) as response:
+            if response.status != 200:
+                raise Exception(f"API request failed: {response.status}")
+
+            data = await response.json()
+            mania_beatmaps = [bm for bm in data['beatmaps'] if bm['mode_int'] == 3]
+
+            if not mania_beatmaps:
+                raise Exception("No osu!mania maps found")
+
+            difficulties = []
+            for bm in mania_beatmaps:
+                difficulties.append({
+                    'filename': f"{data['artist']} - {data['title']} ({data['creator']}) [{bm['version']}].osu",
+                    'difficulty_name': bm['version'],
+                    'creator': data['creator'],
+                    'key_count': int(bm['cs']),
+                    'hit_objects': bm['count_circles'] + bm['count_sliders'] + bm['count_spinners'],
+                    'star_rating': bm['difficulty_rating']
+                })
+
+            return {
+                'beatmapset_id': beatmap_id,
+                'title': data['title'],
+                'artist': data['artist'],
+                'creator': data['creator'],
+                'difficulties': difficulties,
+                'source': 'api'
+            }
+
+    def _beatmapset_info_from_cache(self, beatmap_id: int) -> Optional[dict]:
+        #cached files are named {beatmapset_id}_{difficulty}_{hash}.osu, only covers diffs analyzed before
+        if not self.osu_cache_dir or not os.path.isdir(self.osu_cache_dir):
+            return None
+
+        prefix = f"{beatmap_id}_"
+        cached_files = [
+            os.path.join(self.osu_cache_dir, filename)
+            for filename in os.listdir(self.osu_cache_dir)
+            if filename.startswith(prefix) and filename.endswith(".osu")
+        ]
+
+        # newest file wins when a difficulty was cached under several hashes
+        cached_files.sort(key=os.path.getmtime, reverse=True)
+        charts = []
+        seen_versions = set()
+        for osu_file in cached_files:
+            beatmap = self._read_chart(osu_file)
+            if beatmap is None or not beatmap.is_mania:
+                continue
+            if beatmap.metadata.version in seen_versions:
+                continue
+            seen_versions.add(beatmap.metadata.version)
+            charts.append((osu_file, beatmap))
+
+        if not charts:
+            return None
+
+        print(f"Using {len(charts)} cached .osu files for beatmapset {beatmap_id}")
+        return self._beatmapset_info_from_charts(beatmap_id, charts, from_cache=True)
+
+    def _beatmapset_info_from_charts(self, beatmap_id: int, charts: List[Tuple[str, OsuBeatmap]], from_cache: bool = False) -> dict:
+        difficulties = []
+        first_meta = charts[0][1].metadata_dict()
+
+        for osu_file, beatmap in charts:
+            meta = beatmap.metadata_dict()
+            if from_cache:
+                # cache filenames are ours, report the name osu! would use
+                filename = f"{meta['artist']} - {meta['title']} ({meta['creator']}) [{meta['version']}].osu"
+            else:
+                filename = os.path.basename(osu_file)
+
+            difficulties.append({
+                'filename': filename,
+                'difficulty_name': meta['version'],
+                'creator': meta['creator'],
+                'key_count': meta['key_count'],
+                'hit_objects': meta['hit_objects'],
+                'star_rating': meta['star_rating']
+            })
+
+        return {
+            'beatmapset_id': beatmap_id,
+            'title': first_meta['title'],
+            'artist': first_meta['artist'],
+            'creator': first_meta['creator'],
+            'difficulties': difficulties,
+            'source': 'cache' if from_cache else 'download'
+        }
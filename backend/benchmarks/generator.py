@@ -0,0 +1,194 @@
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+
+# deterministic synthetic osu!mania charts for benchmarking
+# same (pattern, keys, seed, duration) always gives byte identical output
+
+PATTERNS = ["stream", "jumpstream", "chordjack", "ln_heavy", "bpm_changes", "marathon"]
+KEY_MODES = [4, 7]
+
+DEFAULT_DURATION = 120.0
+MARATHON_DURATION = 20 * 60.0
+
+# (time ms, column, end time ms or None)
+Note = Tuple[float, int, Optional[float]]
+# (time ms, beat length ms)
+TimingPoint = Tuple[float, float]
+
+
+def column_x(column: int, keys: int) -> int:
+    return int((column + 0.5) * 512 / keys)
+
+def _pick_columns(rng: random.Random, keys: int, count: int, avoid: List[int]) -> List[int]:
+    candidates = [c for c in range(keys) if c not in avoid]
+    if len(candidates) < count:
+        candidates = list(range(keys))
+    return sorted(rng.sample(candidates, count))
+
+def _rows(start: float, end: float, beat_length: float, snap: int):
+    step = beat_length / snap
+    time = start
+    while time < end:
+        yield time
+        time += step
+
+def _stream(rng: random.Random, keys: int, timing: List[TimingPoint], duration_ms: float) -> List[Note]:
+    notes = []
+    previous: List[int] = []
+    for time in _rows_for_timing(timing, duration_ms, snap=4):
+        previous = _pick_columns(rng, keys, 1, previous)
+        notes.extend((time, c, None) for c in previous)
+    return notes
+
+def _jumpstream(rng: random.Random, keys: int, timing: List[TimingPoint], duration_ms: float) -> List[Note]:
+    notes = []
+    previous: List[int] = []
+    for i, time in enumerate(_rows_for_timing(timing, duration_ms, snap=4)):
+        size = 2 if i % 2 == 0 else 1
+        if keys >= 7 and i % 4 == 0:
+            size = 3
+        previous = _pick_columns(rng, keys, size, previous)
+        notes.extend((time, c, None) for c in previous)
+    return notes
+
+def _chordjack(rng: random.Random, keys: int, timing: List[TimingPoint], duration_ms: float) -> List[Note]:
+    notes = []
+    previous: List[int] = []
+    for time in _rows_for_timing(timing, duration_ms, snap=4):
+        size = rng.randint(2, max(2, keys - 1))
+        # keep one column of the previous chord to build jacks
+        anchor = [rng.choice(previous)] if previous else []
+        rest = _pick_columns(rng, keys, max(0, size - len(anchor)), anchor)
+        previous = sorted(set(anchor + rest))
+        notes.extend((time, c, None) for c in previous)
+    return notes
+
+def _ln_heavy(rng: random.Random, keys: int, timing: List[TimingPoint], duration_ms: float) -> List[Note]:
+    notes = []
+    beat_length = timing[0][1]
+    free_at = [0.0] * keys
+    for time in _rows_for_timing(timing, duration_ms, snap=2):
+        available = [c for c in range(keys) if free_at[c] <= time]
+        if not available:
+            continue
+        for c in rng.sample(available, min(len(available), rng.randint(1, 2))):
+            if rng.random() < 0.75:
+                end = time + beat_length * rng.choice([0.5, 1.0, 1.5, 2.0, 3.0])
+                notes.append((time, c, end))
+                free_at[c] = end + beat_length / 4
+            else:
+                notes.append((time, c, None))
+                free_at[c] = time + beat_length / 4
+    return notes
+
+def _rows_for_timing(timing: List[TimingPoint], duration_ms: float, snap: int) -> List[float]:
+    rows = []
+    for i, (start, beat_length) in enumerate(timing):
+        end = timing[i + 1][0] if i + 1 < len(timing) else duration_ms
+        rows.extend(_rows(start, end, beat_length, snap))
+    return rows
+
+def _timing_for(pattern: str, rng: random.Random, duration_ms: float) -> List[TimingPoint]:
+    bpm = {"stream": 180.0, "jumpstream": 170.0, "chordjack": 160.0, "ln_heavy": 150.0, "marathon": 165.0}.get(pattern, 150.0)
+    if pattern != "bpm_changes":
+        return [(0.0, 60000.0 / bpm)]
+
+    # new bpm every 4 measures
+    timing = []
+    time = 0.0
+    while time < duration_ms:
+        beat_length = 60000.0 / rng.choice([120.0, 135.0, 150.0, 165.0, 180.0, 200.0, 220.0, 240.0])
+        timing.append((round(time, 3), beat_length))
+        time += beat_length * 16
+    return timing
+
+def generate_notes(pattern: str, keys: int, seed: int, duration: float) -> Tuple[List[TimingPoint], List[Note]]:
+    rng = random.Random(f"{pattern}-{keys}-{seed}")
+    duration_ms = duration * 1000.0
+    timing = _timing_for(pattern, rng, duration_ms)
+
+    if pattern in ("stream", "bpm_changes"):
+        notes = _stream(rng, keys, timing, duration_ms)
+    elif pattern == "jumpstream":
+        notes = _jumpstream(rng, keys, timing, duration_ms)
+    elif pattern == "chordjack":
+        notes = _chordjack(rng, keys, timing, duration_ms)
+    elif pattern == "ln_heavy":
+        notes = _ln_heavy(rng, keys, timing, duration_ms)
+    elif pattern == "marathon":
+        # alternate stream and jumpstream sections every 30s
+        notes = []
+        for section_start in range(0, int(duration_ms), 30000):
+            section_end = min(duration_ms, section_start + 30000)
+            section_timing = [(float(section_start), timing[0][1])]
+            section = _stream if (section_start // 30000) % 2 == 0 else _jumpstream
+            notes.extend(section(rng, keys, section_timing, section_end))
+    else:
+        raise ValueError(f"Unknown pattern: {pattern}")
+
+    return timing, notes
+
+def generate_osu(pattern: str, keys: int = 4, seed: int = 0, duration: Optional[float] = None) -> str:
+    if duration is None:
+        duration = MARATHON_DURATION if pattern == "marathon" else DEFAULT_DURATION
+
+    timing, notes = generate_notes(pattern, keys, seed, duration)
+
+    lines = [
+        "osu file format v14",
+        "",
+        "[General]",
+        "AudioFilename: audio.mp3",
+        "PreviewTime: -1",
+        "Mode: 3",
+        "",
+        "[Metadata]",
+        f"Title:Synthetic {pattern}",
+        "Artist:maniatool benchmarks",
+        "Creator:maniatool",
+        f"Version:{keys}K {pattern}",
+        "",
+        "[Difficulty]",
+        f"CircleSize:{keys}",
+        "OverallDifficulty:8",
+        "",
+        "[TimingPoints]",
+    ]
+    lines.extend(f"{time:.3f},{beat_length:.6f},4,1,0,100,1,0" for time, beat_length in timing)
+    lines.extend(["", "[HitObjects]"])
+
+    for time, column, end in sorted(notes, key=lambda n: (n[0], n[1])):
+        x = column_x(column, keys)
+        if end is None:
+            lines.append(f"{x},192,{int(round(time))},1,0,0:0:0:0:")
+        else:
+            lines.append(f"{x},192,{int(round(time))},128,0,{int(round(end))}:0:0:0:0:")
+
+    return "\n".join(lines) + "\n"
+
+def write_suite(directory: str, seed: int = 0, patterns: Optional[List[str]] = None, keys: Optional[List[int]] = None,
+                duration_scale: float = 1.0) -> Dict[str, str]:
+    #writes every pattern x key mode, returns {chart name: path}
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for pattern in patterns or PATTERNS:
+        for key_count in keys or KEY_MODES:
+            duration = (MARATHON_DURATION if pattern == "marathon" else DEFAULT_DURATION) * duration_scale
+            name = f"{key_count}k_{pattern}"
+            path = os.path.join(directory, f"{name}.osu")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(generate_osu(pattern, key_count, seed, duration))
+            paths[name] = path
+    return paths
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        print("Usage: python -m benchmarks.generator <output_dir> [seed]")
+        sys.exit(1)
+
+    written = write_suite(sys.argv[1], seed=int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    for name, path in written.items():
+        print(f"{name}: {path}")
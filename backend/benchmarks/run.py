@@ -0,0 +1,192 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+# run from backend/: python -m benchmarks.run [--save-baseline] [--quick]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from osu_to_sm import OsuBeatmap, StepManiaConverter
+from minacalc_bindings import MinaCalc, marshal_notes, parse_sm_file
+from note_cache import NoteCache
+import compressed_cache
+from benchmarks.generator import write_suite
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_TOLERANCE = 0.25
+
+
+def time_call(func: Callable, repeat: int, warmup: int = 1) -> Dict[str, float]:
+    #the code under test prints a lot, keep that out of the timings' terminal output
+    sink = io.StringIO()
+    samples = []
+    with contextlib.redirect_stdout(sink):
+        for _ in range(warmup):
+            func()
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - started)
+            sink.seek(0)
+            sink.truncate()
+
+    return {
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "max": max(samples),
+        "repeat": repeat,
+    }
+
+def run_benchmarks(work_dir: str, repeat: int, duration_scale: float, only: Optional[List[str]] = None) -> Dict[str, dict]:
+    charts = write_suite(os.path.join(work_dir, "charts"), duration_scale=duration_scale)
+    if only:
+        charts = {name: path for name, path in charts.items() if any(o in name for o in only)}
+
+    try:
+        calc = MinaCalc()
+    except Exception as e:
+        print(f"MinaCalc unavailable, skipping calc benchmarks: {e}")
+        calc = None
+
+    converter = StepManiaConverter()
+    note_cache = NoteCache(os.path.join(work_dir, "notes"))
+    results = {}
+
+    # compressed cache copies of every chart, plain codec and codec + a dictionary trained on the suite
+    packed_dir = os.path.join(work_dir, "packed")
+    packed_dict_dir = os.path.join(work_dir, "packed_dict")
+    for directory in (packed_dir, packed_dict_dir):
+        os.makedirs(directory)
+        for name, osu_path in charts.items():
+            sm_path = os.path.join(work_dir, f"{name}.sm")
+            if not os.path.exists(sm_path):
+                converter.convert(OsuBeatmap.from_file(osu_path), sm_path)
+            compressed_cache.write_file(osu_path, os.path.join(directory, f"{name}.osu"))
+            compressed_cache.write_file(sm_path, os.path.join(directory, f"{name}.sm"))
+    compressed_cache.train_dictionary(packed_dict_dir)
+    compressed_cache.compact(packed_dict_dir)
+
+    for name, osu_path in charts.items():
+        sm_path = os.path.join(work_dir, f"{name}.sm")
+        beatmap = OsuBeatmap.from_file(osu_path)
+        packed_sm = os.path.join(packed_dir, f"{name}.sm")
+        packed_dict_sm = os.path.join(packed_dict_dir, f"{name}.sm")
+        packed_osu = os.path.join(packed_dict_dir, f"{name}.osu")
+        with contextlib.redirect_stdout(io.StringIO()):
+            note_data = parse_sm_file(sm_path)
+        note_cache.put(name, marshal_notes(note_data), int(beatmap.circle_size))
+
+        cases = {
+            "osu_parse": lambda: OsuBeatmap.from_file(osu_path),
+            "convert": lambda: converter.convert(beatmap, sm_path),
+            "sm_parse": lambda: parse_sm_file(sm_path),
+            # cold-ish reads of the compressed cache, what the smaller files cost in latency
+            "sm_parse_packed": lambda: parse_sm_file(packed_sm),
+            "sm_parse_packed_dict": lambda: parse_sm_file(packed_dict_sm),
+            "osu_parse_packed_dict": lambda: OsuBeatmap.from_file(packed_osu),
+            # warm binary cache hit, what replaces convert + sm_parse
+            "notes_load": lambda: note_cache.get(name)["rowTime"].sum(),
+        }
+        if calc is not None:
+            cases["calc_ssr"] = lambda: calc.calculate_ssr(note_data, music_rate=1.0, score_goal=0.93)
+            # what a user with many scores on one chart costs, compare against 8x calc_ssr
+            cases["calc_ssr_batch8"] = lambda: calc.calculate_ssr_batch(
+                note_data, [(rate, goal) for rate in (1.0, 1.1, 1.2, 1.3) for goal in (0.93, 0.965)])
+
+        # bytes on disk behind each read case
+        sizes = {
+            "osu_parse": os.path.getsize(osu_path),
+            "sm_parse": os.path.getsize(sm_path),
+            "sm_parse_packed": os.path.getsize(packed_sm),
+            "sm_parse_packed_dict": os.path.getsize(packed_dict_sm),
+            "osu_parse_packed_dict": os.path.getsize(packed_osu),
+        }
+
+        for case, func in cases.items():
+            key = f"{case}/{name}"
+            results[key] = time_call(func, repeat)
+            results[key]["hit_objects"] = len(beatmap.hit_objects)
+            size = ""
+            if case in sizes:
+                results[key]["bytes"] = sizes[case]
+                size = f", {sizes[case] / 1024:.1f}KB on disk"
+            print(f"{key:<32} median {results[key]['median'] * 1000:9.2f}ms  ({len(beatmap.hit_objects)} objects{size})")
+
+    return results
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    regressions = []
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            continue
+        before = baseline[key]["median"]
+        after = result["median"]
+        change = (after - before) / before if before > 0 else 0.0
+        marker = ""
+        if change > tolerance:
+            marker = "  <-- REGRESSION"
+            regressions.append(key)
+        print(f"{key:<32} {before * 1000:9.2f}ms -> {after * 1000:9.2f}ms ({change * 100:+.1f}%){marker}")
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="maniatool backend micro-benchmarks")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline json path")
+    parser.add_argument("--save-baseline", action="store_true", help="write this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="shorter charts, for a fast sanity run")
+    parser.add_argument("--only", nargs="*", help="only charts whose name contains one of these")
+    parser.add_argument("--output", help="also write this run's results to a json file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = run_benchmarks(work_dir, args.repeat, 0.1 if args.quick else 1.0, args.only)
+
+    run = {
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "quick": args.quick,
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline first")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    if baseline.get("quick") != args.quick:
+        print("Warning: baseline and this run used different chart lengths, comparison is meaningless")
+
+    print(f"\nCompared to baseline from {baseline.get('created_at', 'unknown')} (tolerance {args.tolerance * 100:.0f}%):")
+    regressions = compare(results, baseline["results"], args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+
+    print("\nNo regressions")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+import argparse
+import hashlib
+import io
+import os
+import random
+import struct
+import tempfile
+import zlib
+from typing import BinaryIO, Dict, List, Optional, TextIO
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# transparent compression for the downloads/osu and downloads/sm caches
+# cached files keep their names (.osu / .sm), a compressed one starts with a small header:
+#   magic, codec, dictionary id (zero bytes when none)
+# readers open any cache path through open_binary / open_text and get plain bytes / text back,
+# files without the header (older caches, temp dirs, extracted sets) are read as they are.
+# decompression streams in chunks, a reader never holds the whole compressed file.
+#
+# dictionaries live next to the files they were trained on, <cache dir>/.dicts/<id>.dict,
+# and are never overwritten: a file names the dictionary it was written with, a retrain
+# only changes which one new writes use (.dicts/current)
+MAGIC = b"MCZ1"
+HEADER = struct.Struct("<4sB16s")
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_NAMES = {"zlib": CODEC_ZLIB, "zstd": CODEC_ZSTD}
+
+# auto = zstd when the zstandard package is installed, zlib otherwise. none writes plain files
+COMPRESSION = os.getenv("CACHE_COMPRESSION", "auto")
+ZLIB_LEVEL = int(os.getenv("CACHE_ZLIB_LEVEL", "6"))
+ZSTD_LEVEL = int(os.getenv("CACHE_ZSTD_LEVEL", "9"))
+
+CHUNK_SIZE = 64 * 1024
+DICT_DIR = ".dicts"
+# zlib can only look back 32KB, a bigger preset dictionary is wasted
+ZLIB_DICT_SIZE = 32 * 1024
+DEFAULT_DICT_SIZE = 112 * 1024
+
+_dictionaries: Dict[str, bytes] = {}
+
+
+def write_codec() -> Optional[int]:
+    if COMPRESSION == "none":
+        return None
+    if COMPRESSION == "zstd" and zstandard is None:
+        raise RuntimeError("CACHE_COMPRESSION=zstd but the zstandard package isn't installed")
+    if COMPRESSION in ("auto", "zstd") and zstandard is not None:
+        return CODEC_ZSTD
+    return CODEC_ZLIB
+
+def dictionary_id(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:16]
+
+def load_dictionary(directory: str, dict_id: str) -> bytes:
+    key = os.path.join(os.path.abspath(directory), dict_id)
+    if key not in _dictionaries:
+        with open(os.path.join(directory, DICT_DIR, f"{dict_id}.dict"), "rb") as f:
+            _dictionaries[key] = f.read()
+    return _dictionaries[key]
+
+def current_dictionary(directory: str, codec: int) -> Optional[str]:
+    #id of the dictionary new writes in this directory use, if one was trained for this codec
+    try:
+        with open(os.path.join(directory, DICT_DIR, "current"), "r", encoding="ascii") as f:
+            codec_name, dict_id = f.read().split()
+    except (OSError, ValueError):
+        return None
+    return dict_id if CODEC_NAMES.get(codec_name) == codec else None
+
+
+def _compressor(codec: int, dictionary: Optional[bytes]):
+    if codec == CODEC_ZSTD:
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dict_data).compressobj()
+    if dictionary:
+        return zlib.compressobj(ZLIB_LEVEL, zdict=dictionary)
+    return zlib.compressobj(ZLIB_LEVEL)
+
+def _decompressor(codec: int, dictionary: Optional[bytes]):
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("cache file is zstd compressed but the zstandard package isn't installed")
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompressobj()
+    if dictionary:
+        return zlib.decompressobj(zdict=dictionary)
+    return zlib.decompressobj()
+
+
+class _DecompressingReader(io.RawIOBase):
+    def __init__(self, raw: BinaryIO, decompressor):
+        self._raw = raw
+        self._decompressor = decompressor
+        self._pending = b""
+        self._offset = 0
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self._offset >= len(self._pending) and not self._eof:
+            chunk = self._raw.read(CHUNK_SIZE)
+            if chunk:
+                self._pending = self._decompressor.decompress(chunk)
+            else:
+                self._pending = self._decompressor.flush() if hasattr(self._decompressor, "flush") else b""
+                self._eof = True
+            self._offset = 0
+
+        count = min(len(buffer), len(self._pending) - self._offset)
+        buffer[:count] = self._pending[self._offset:self._offset + count]
+        self._offset += count
+        return count
+
+    def close(self):
+        if not self.closed:
+            self._raw.close()
+        super().close()
+
+
+def open_binary(path: str) -> BinaryIO:
+    f = open(path, "rb")
+    try:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size or not header.startswith(MAGIC):
+            f.seek(0)
+            return f
+
+        _, codec, raw_id = HEADER.unpack(header)
+        dict_id = raw_id.rstrip(b"\0").decode("ascii")
+        dictionary = load_dictionary(os.path.dirname(path), dict_id) if dict_id else None
+        return io.BufferedReader(_DecompressingReader(f, _decompressor(codec, dictionary)), CHUNK_SIZE)
+    except BaseException:
+        f.close()
+        raise
+
+def open_text(path: str) -> TextIO:
+    return io.TextIOWrapper(open_binary(path), encoding="utf-8", errors="ignore")
+
+def write_file(source_path: str, target_path: str):
+    #streams source_path (plain or already compressed) into target_path with the configured codec,
+    #temp file + rename so nothing ever reads a half written cache entry
+    directory = os.path.dirname(target_path) or "."
+    codec = write_codec()
+    dict_id = current_dictionary(directory, codec) if codec else None
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as target, open_binary(source_path) as source:
+            if codec is None:
+                while chunk := source.read(CHUNK_SIZE):
+                    target.write(chunk)
+            else:
+                dictionary = load_dictionary(directory, dict_id) if dict_id else None
+                compressor = _compressor(codec, dictionary)
+                target.write(HEADER.pack(MAGIC, codec, (dict_id or "").encode("ascii")))
+                while chunk := source.read(CHUNK_SIZE):
+                    target.write(compressor.compress(chunk))
+                target.write(compressor.flush())
+        os.replace(temp_path, target_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _cache_files(directory: str) -> List[str]:
+    return [
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.endswith((".osu", ".sm")) and os.path.isfile(os.path.join(directory, name))
+    ]
+
+def train_dictionary(directory: str, size: int = DEFAULT_DICT_SIZE, samples: int = 2000) -> str:
+    files = _cache_files(directory)
+    if not files:
+        raise ValueError(f"no .osu / .sm files in {directory} to train on")
+    random.Random(0).shuffle(files)
+
+    contents = []
+    for path in files[:samples]:
+        with open_binary(path) as f:
+            contents.append(f.read())
+
+    codec = write_codec() or CODEC_ZLIB
+    if codec == CODEC_ZSTD:
+        data = zstandard.train_dictionary(size, contents).as_bytes()
+    else:
+        # zlib has no trainer, a preset dictionary is just text it can refer back to.
+        # file heads (headers, metadata, timing) are what repeats across charts,
+        # and the most common material goes last where it's closest to the data
+        heads = [content[:2048] for content in contents]
+        data = b"".join(heads)[-min(size, ZLIB_DICT_SIZE):]
+
+    dict_id = dictionary_id(data)
+    dict_dir = os.path.join(directory, DICT_DIR)
+    os.makedirs(dict_dir, exist_ok=True)
+    with open(os.path.join(dict_dir, f"{dict_id}.dict"), "wb") as f:
+        f.write(data)
+
+    codec_name = next(name for name, value in CODEC_NAMES.items() if value == codec)
+    fd, temp_path = tempfile.mkstemp(dir=dict_dir, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="ascii") as f:
+        f.write(f"{codec_name} {dict_id}\n")
+    os.replace(temp_path, os.path.join(dict_dir, "current"))
+    return dict_id
+
+def compact(directory: str) -> Dict[str, int]:
+    #rewrites every cache file with the current codec + dictionary
+    stats = {"files": 0, "bytes_before": 0, "bytes_after": 0}
+    for path in _cache_files(directory):
+        stats["files"] += 1
+        stats["bytes_before"] += os.path.getsize(path)
+        write_file(path, path)
+        stats["bytes_after"] += os.path.getsize(path)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compressed .osu / .sm cache maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    train = commands.add_parser("train", help="train a dictionary on a cache dir, new writes there use it")
+    train.add_argument("directory")
+    train.add_argument("--size", type=int, default=DEFAULT_DICT_SIZE)
+    train.add_argument("--samples", type=int, default=2000)
+    compact_cmd = commands.add_parser("compact", help="recompress every file in a cache dir")
+    compact_cmd.add_argument("directory")
+    args = parser.parse_args()
+
+    if args.command == "train":
+        print(f"Dictionary {train_dictionary(args.directory, args.size, args.samples)} is now current for {args.directory}")
+    else:
+        stats = compact(args.directory)
+        print(f"{stats['files']} files, {stats['bytes_before']} -> {stats['bytes_after']} bytes")
@@ -0,0 +1,161 @@
+import asyncio
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:
+    # no flock on windows, locks then only cover coroutines of this process
+    fcntl = None
+
+# coordination between uvicorn workers sharing one downloads/ dir:
+#   - files are written to a temp file and renamed into place, a reader never sees half a file
+#   - expensive per chart work runs under an flock'd lock file, so two workers that get the same chart
+#     at the same time do it once: the second one waits and then finds the result in the store
+#   - long running jobs (imports, analyses with a job id) hold a lock for their whole run, any worker
+#     can tell they're running and ask them to cancel
+# flock locks belong to the open file, so they also serialize coroutines inside one process
+LOCK_POLL_MIN = 0.02
+LOCK_POLL_MAX = 0.5
+
+_local_locks = {}
+
+
+def atomic_write_text(target_path: str, text: str):
+    directory = os.path.dirname(target_path) or "."
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temp_path, target_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class LockDir:
+    #a lock file exists only while its lock is held, it's removed on release so the directory
+    #doesn't keep one file per chart / rate ever locked
+    def __init__(self, lock_dir: str):
+        self.lock_dir = lock_dir
+        self.waits = 0
+        # keys held by this process, only used without fcntl
+        self._held = set()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.lock_dir, f"{key}.lock")
+
+    def _try_lock(self, key: str) -> Optional[int]:
+        #fd holding the lock, None if someone else has it
+        path = self.path_for(key)
+        os.makedirs(self.lock_dir, exist_ok=True)
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return None
+            # the previous holder may have unlinked the file between our open and flock, that lock
+            # protects nothing anymore. only a lock on the file that's still at path counts
+            try:
+                if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def _unlock(self, key: str, fd: int):
+        # unlinked while still locked, so nobody can lock the old file and think they hold the key
+        try:
+            os.remove(self.path_for(key))
+        except FileNotFoundError:
+            pass
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        #polls a non blocking flock instead of blocking an io thread while another worker holds it
+        if fcntl is None:
+            lock = _local_locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                yield
+            return
+
+        delay = LOCK_POLL_MIN
+        waited = False
+        while (fd := self._try_lock(key)) is None:
+            waited = True
+            await asyncio.sleep(delay)
+            delay = min(LOCK_POLL_MAX, delay * 2)
+        if waited:
+            self.waits += 1
+        try:
+            yield
+        finally:
+            self._unlock(key, fd)
+
+    def acquire_nowait(self, key: str) -> Optional[int]:
+        #for locks held across a whole job (an import thread, a running analysis): a handle to pass
+        #to release(), or None when the key is already held by this or another worker
+        if fcntl is None:
+            if key in self._held:
+                return None
+            self._held.add(key)
+            handle = -1
+        else:
+            handle = self._try_lock(key)
+            if handle is None:
+                return None
+        # left behind by a holder that was killed before release()
+        self._clear_cancel(key)
+        return handle
+
+    def release(self, key: str, handle: int):
+        self._clear_cancel(key)
+        if fcntl is None:
+            self._held.discard(key)
+            return
+        self._unlock(key, handle)
+
+    def is_held(self, key: str) -> bool:
+        if fcntl is None:
+            return key in self._held
+        try:
+            fd = os.open(self.path_for(key), os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+        # a leftover from a killed process, nobody holds it
+        return False
+
+    # cancelling a job another worker runs: the cancel request leaves a marker next to the job's lock,
+    # the worker running it polls cancel_requested(). release() clears it
+    def cancel_path(self, key: str) -> str:
+        return os.path.join(self.lock_dir, f"{key}.cancel")
+
+    def request_cancel(self, key: str):
+        atomic_write_text(self.cancel_path(key), str(os.getpid()))
+
+    def _clear_cancel(self, key: str):
+        try:
+            os.remove(self.cancel_path(key))
+        except FileNotFoundError:
+            pass
+
+    def cancel_requested(self, key: str) -> bool:
+        return os.path.exists(self.cancel_path(key))
+
+    def stats(self) -> dict:
+        return {"backend": "flock" if fcntl else "process", "waits": self.waits, "pid": os.getpid()}
@@ -0,0 +1,146 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from admission import build_controller
+from metrics import executor_wait_seconds, inflight, record_timing
+from tracing import record_span
+
+# blocking work never runs on the event loop:
+#   io   - file copies, hashing, zip extraction, cache scans, blocking http (requests)
+#   cpu  - .osu -> .sm conversion and .sm parsing (pure python, so processes by default)
+#   calc - native minacalc, one handle per process and it isn't thread safe
+IO_WORKERS = int(os.getenv("IO_WORKERS", "8"))
+# per uvicorn worker, the cpus are split between WEB_CONCURRENCY workers unless set explicitly
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(max(1, ((os.cpu_count() or 2) - 1) // WEB_CONCURRENCY))))
+CPU_EXECUTOR = os.getenv("CPU_EXECUTOR", "process")
+
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", "0.1"))
+
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+calc_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="calc")
+_cpu_executor: Optional[Executor] = None
+# forking a process that already runs the loop and the io threads can copy a held lock into the child,
+# so workers start from a clean forkserver (spawn where there is none)
+_mp_context = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+# in-flight limits and wait queues in front of the cpu / calc executors (and downloads, see beatmap_downloader)
+admission = build_controller(CPU_WORKERS)
+
+def get_cpu_executor() -> Executor:
+    #created lazily so importing main doesn't fork a pool
+    global _cpu_executor
+    if _cpu_executor is None:
+        if CPU_EXECUTOR == "thread":
+            _cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+        else:
+            _cpu_executor = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=_mp_context)
+    return _cpu_executor
+
+def _timed_call(func: Callable, *args):
+    #wall clock on purpose, this may run in another process
+    started = time.time()
+    result = func(*args)
+    worker = (os.getpid(), threading.get_ident(), threading.current_thread().name)
+    return started, time.time(), worker, result
+
+async def _run(executor: Executor, pool: str, func: Callable, *args) -> Any:
+    submitted = time.time()
+    with inflight.track(kind=f"{pool}_jobs"):
+        started, finished, worker, result = await asyncio.get_running_loop().run_in_executor(executor, _timed_call, func, *args)
+
+    waited = max(0.0, started - submitted)
+    executor_wait_seconds.observe(waited, pool=pool)
+    record_timing(f"{pool}_queue", waited)
+
+    pid, tid, thread_name = worker
+    if pid != os.getpid():
+        thread_name = f"{pool} worker"
+    record_span(f"{pool}_queue", submitted, started, category="queue")
+    record_span(getattr(func, "__name__", pool), started, finished, category=pool, pid=pid, tid=tid, thread_name=thread_name)
+    return result
+
+async def run_io(func: Callable, *args) -> Any:
+    return await _run(io_executor, "io", func, *args)
+
+async def run_io_shielded(func: Callable, *args) -> Any:
+    #cache writes for work that's already done, they finish even if the request awaiting them is cancelled
+    return await asyncio.shield(run_io(func, *args))
+
+async def run_io_to_completion(func: Callable, *args) -> Any:
+    #like run_io_shielded, but a cancel isn't passed on until the write is done. for writes that read from
+    #something the caller cleans up while unwinding (a request's temp dir), which would otherwise race the write
+    job = asyncio.ensure_future(run_io(func, *args))
+    cancelled = False
+    while not job.done():
+        try:
+            await asyncio.shield(job)
+        except asyncio.CancelledError:
+            cancelled = True
+    if cancelled:
+        raise asyncio.CancelledError()
+    return job.result()
+
+async def run_cpu(func: Callable, *args) -> Any:
+    #func and args have to be picklable when the process pool is used
+    async with admission["cpu"].slot():
+        return await _run(get_cpu_executor(), "cpu", func, *args)
+
+async def run_calc(func: Callable, *args) -> Any:
+    async with admission["calc"].slot():
+        return await _run(calc_executor, "calc", func, *args)
+
+def shutdown_executors():
+    global _cpu_executor
+    io_executor.shutdown(wait=False, cancel_futures=True)
+    calc_executor.shutdown(wait=False, cancel_futures=True)
+    if _cpu_executor is not None:
+        _cpu_executor.shutdown(wait=False, cancel_futures=True)
+        _cpu_executor = None
+
+
+class LoopLagMonitor:
+    """warns when something holds the event loop longer than the threshold"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_LAG_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.slow_ticks = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - started - self.interval
+
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.threshold:
+                self.slow_ticks += 1
+                print(f"⚠️ Event loop blocked for {lag * 1000:.0f}ms (threshold {self.threshold * 1000:.0f}ms)")
+
+    def stats(self) -> dict:
+        return {
+            "last_lag_ms": round(self.last_lag * 1000, 2),
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "slow_ticks": self.slow_ticks,
+            "threshold_ms": round(self.threshold * 1000, 2),
+        }
@@ -0,0 +1,240 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from result_store import COLUMNS, ResultStore, rate_key
+
+# columnar dumps of the result store and saved user scores for offline analysis
+# parquet when pyarrow is installed, otherwise an .npz with one array per column (np.load reads it as is)
+# rows are pulled and written a batch at a time, memory stays flat however many rows match.
+# missing values: NaN for floats, -1 for ints, '' for strings, NaT for timestamps (same in both formats)
+BATCH_SIZE = 50000
+FORMATS = ("parquet", "npz")
+
+# (column, kind), kinds: str, int, float, bool, datetime. analyses follow the store's COLUMNS, floats unless listed
+ANALYSIS_KINDS = {
+    'file_hash': 'str', 'beatmap_id': 'int', 'title': 'str', 'artist': 'str', 'difficulty_name': 'str', 'creator': 'str',
+    'key_count': 'int', 'hit_objects': 'int', 'source': 'str', 'analyzed_at': 'datetime', 'fingerprint': 'str',
+}
+ANALYSIS_FIELDS: List[Tuple[str, str]] = [(name, ANALYSIS_KINDS.get(name, 'float')) for name in COLUMNS]
+
+SCORE_FIELDS: List[Tuple[str, str]] = [
+    ('user_id', 'int'), ('username', 'str'), ('list', 'str'),
+    ('beatmap_id', 'int'), ('beatmapset_id', 'int'), ('difficulty_name', 'str'), ('title', 'str'), ('artist', 'str'),
+    ('creator', 'str'), ('key_count', 'int'), ('star_rating', 'float'), ('mods', 'str'), ('rate', 'float'),
+    ('pp', 'float'), ('accuracy', 'float'), ('accuracyV2', 'float'), ('score', 'int'), ('max_combo', 'int'),
+    ('perfect', 'bool'), ('rank', 'str'), ('created_at', 'datetime'), ('statistics', 'str'),
+]
+
+MISSING = {'int': -1, 'float': np.nan, 'str': '', 'bool': False}
+DTYPES = {'int': np.dtype(np.int64), 'float': np.dtype(np.float64), 'bool': np.dtype(np.bool_),
+          'str': np.dtype('<U1'), 'datetime': np.dtype('datetime64[us]')}
+
+
+def default_format() -> str:
+    return "parquet" if pa is not None else "npz"
+
+def _timestamps(values: Iterable) -> np.ndarray:
+    # '2026-01-02T03:04:05.123456', osu! uses a trailing Z. numpy wants naive utc
+    cleaned = []
+    for value in values:
+        if not value:
+            cleaned.append('NaT')
+            continue
+        value = value[:-1] if value.endswith('Z') else value
+        cleaned.append(value[:-6] if value.endswith('+00:00') else value)
+    try:
+        return np.array(cleaned, dtype='datetime64[us]')
+    except ValueError:
+        return np.array([_timestamp_or_nat(value) for value in cleaned], dtype='datetime64[us]')
+
+def _timestamp_or_nat(value: str) -> np.datetime64:
+    try:
+        return np.datetime64(value, 'us')
+    except ValueError:
+        return np.datetime64('NaT', 'us')
+
+def to_columns(rows: List[Tuple], fields: List[Tuple[str, str]]) -> Dict[str, np.ndarray]:
+    #row tuples (in fields order) -> one numpy array per column
+    count = len(rows)
+    columns = {}
+    for (name, kind), values in zip(fields, zip(*rows)):
+        if kind == 'datetime':
+            columns[name] = _timestamps(values)
+        elif kind == 'str':
+            columns[name] = np.array(['' if v is None else str(v) for v in values], dtype=str)
+        else:
+            missing = MISSING[kind]
+            columns[name] = np.fromiter((missing if v is None else v for v in values), dtype=DTYPES[kind], count=count)
+    return columns
+
+
+class NpzWriter:
+    #a column's final length and string width are only known at the end, so batches are spooled
+    #per column to temp files first and stitched into one array per column on close
+    def __init__(self, path: str, fields: List[Tuple[str, str]]):
+        self.path = path
+        self.fields = fields
+        self.rows = 0
+        self._spool_dir = tempfile.mkdtemp(prefix="export-", dir=os.path.dirname(os.path.abspath(path)))
+        self._spools = {name: open(os.path.join(self._spool_dir, name), "wb") for name, _ in fields}
+        self._dtypes: Dict[str, np.dtype] = {}
+
+    def write(self, columns: Dict[str, np.ndarray]):
+        for name, _ in self.fields:
+            array = columns[name]
+            np.save(self._spools[name], array, allow_pickle=False)
+            # widest string seen so far decides the final '<U' width
+            previous = self._dtypes.get(name)
+            self._dtypes[name] = array.dtype if previous is None else np.promote_types(previous, array.dtype)
+        self.rows += len(columns[self.fields[0][0]])
+
+    def close(self):
+        try:
+            for spool in self._spools.values():
+                spool.close()
+            with zipfile.ZipFile(self.path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as bundle:
+                for name, kind in self.fields:
+                    self._write_column(bundle, name, kind)
+        finally:
+            shutil.rmtree(self._spool_dir, ignore_errors=True)
+
+    def _write_column(self, bundle: zipfile.ZipFile, name: str, kind: str):
+        dtype = self._dtypes.get(name, DTYPES[kind])
+        header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (self.rows,)}
+        spool_path = os.path.join(self._spool_dir, name)
+        size = os.path.getsize(spool_path)
+        with bundle.open(f"{name}.npy", "w", force_zip64=True) as entry, open(spool_path, "rb") as spool:
+            np.lib.format.write_array_header_2_0(entry, header)
+            # np.load on an open file reads one array and stops right after it
+            while spool.tell() < size:
+                entry.write(np.load(spool, allow_pickle=False).astype(dtype, copy=False).tobytes())
+
+
+class ParquetWriter:
+    def __init__(self, path: str, fields: List[Tuple[str, str]]):
+        self.path = path
+        self.fields = fields
+        self.rows = 0
+        self._writer = None
+
+    def write(self, columns: Dict[str, np.ndarray]):
+        table = pa.table({name: columns[name] for name, _ in self.fields})
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, table.schema, compression="zstd")
+        else:
+            table = table.cast(self._writer.schema)
+        self._writer.write_table(table)
+        self.rows += table.num_rows
+
+    def close(self):
+        if self._writer is None:
+            # nothing matched, still leave a valid (empty) file behind
+            pq.write_table(pa.table({name: np.array([], dtype=DTYPES[kind]) for name, kind in self.fields}), self.path)
+        else:
+            self._writer.close()
+
+
+def open_writer(path: str, fields: List[Tuple[str, str]], fmt: str):
+    if fmt == "parquet":
+        if pa is None:
+            raise RuntimeError("parquet export needs pyarrow, use format npz")
+        return ParquetWriter(path, fields)
+    return NpzWriter(path, fields)
+
+def write_batches(path: str, fields: List[Tuple[str, str]], batches: Iterator[List[Tuple]], fmt: str) -> int:
+    writer = open_writer(path, fields, fmt)
+    try:
+        for rows in batches:
+            writer.write(to_columns(rows, fields))
+    except BaseException:
+        # no half export left behind looking like a complete one
+        writer.close()
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    writer.close()
+    return writer.rows
+
+
+def iter_score_batches(scores_dir: str, rate: Optional[float] = None, key_count: Optional[int] = None,
+                       since: Optional[str] = None, until: Optional[str] = None,
+                       batch_size: int = BATCH_SIZE) -> Iterator[List[Tuple]]:
+    #saved user_scores_*.json files, one file in memory at a time, filters match export_batches
+    batch = []
+    for path in sorted(glob.glob(os.path.join(scores_dir, "user_scores_*.json"))):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Skipping unreadable {path}: {e}")
+            continue
+
+        for list_name in ("best", "recent"):
+            for score in data.get(f"{list_name}_scores", []):
+                if rate is not None and rate_key(score.get('rate', 1.0)) != rate_key(rate):
+                    continue
+                if key_count is not None and score.get('key_count') != key_count:
+                    continue
+                created_at = score.get('created_at') or ''
+                if (since and created_at < since) or (until and created_at >= until):
+                    continue
+
+                row = {**score, 'user_id': data.get('user_id'), 'username': data.get('username'), 'list': list_name,
+                       'statistics': json.dumps(score.get('statistics') or {}, sort_keys=True)}
+                batch.append(tuple(row.get(name) for name, _ in SCORE_FIELDS))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+def export_analyses(store: ResultStore, path: str, fmt: str, rate: Optional[float] = None, key_count: Optional[int] = None,
+                    score_goal: Optional[float] = None, since: Optional[str] = None, until: Optional[str] = None) -> int:
+    batches = store.export_batches(rate, key_count, score_goal, since, until, BATCH_SIZE)
+    return write_batches(path, ANALYSIS_FIELDS, batches, fmt)
+
+def export_scores(scores_dir: str, path: str, fmt: str, rate: Optional[float] = None, key_count: Optional[int] = None,
+                  since: Optional[str] = None, until: Optional[str] = None) -> int:
+    return write_batches(path, SCORE_FIELDS, iter_score_batches(scores_dir, rate, key_count, since, until), fmt)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export stored analyses or saved user scores to parquet / npz")
+    parser.add_argument("dataset", choices=("analyses", "scores"))
+    parser.add_argument("output", help="output file, .parquet or .npz picks the format")
+    parser.add_argument("--format", choices=FORMATS, help="defaults to the output extension, then parquet if pyarrow is installed")
+    parser.add_argument("--db", default=os.path.join("downloads", "results.sqlite3"))
+    parser.add_argument("--scores-dir", default=os.path.join("downloads", "user_scores"))
+    parser.add_argument("--rate", type=float)
+    parser.add_argument("--key-count", type=int)
+    parser.add_argument("--score-goal", type=float, help="analyses only, all goals by default")
+    parser.add_argument("--since", help="iso date/time, inclusive")
+    parser.add_argument("--until", help="iso date/time, exclusive")
+    args = parser.parse_args()
+
+    extension = os.path.splitext(args.output)[1].lstrip(".").lower()
+    fmt = args.format or (extension if extension in FORMATS else default_format())
+
+    started = time.perf_counter()
+    if args.dataset == "analyses":
+        rows = export_analyses(ResultStore(args.db), args.output, fmt, args.rate, args.key_count, args.score_goal,
+                               args.since, args.until)
+    else:
+        rows = export_scores(args.scores_dir, args.output, fmt, args.rate, args.key_count, args.since, args.until)
+    print(f"Exported {rows} rows to {args.output} ({fmt}) in {time.perf_counter() - started:.1f}s")
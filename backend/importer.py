@@ -0,0 +1,290 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from osu_to_sm import OsuBeatmap, StepManiaConverter
+from minacalc_bindings import MinaCalc, parse_sm_file
+from result_store import DEFAULT_SCORE_GOAL, ResultStore, analysis_row
+
+# offline bulk import: walk a Songs folder / .osz collection, analyze every mania chart
+# in a process pool and write the results into the result store
+# progress is checkpointed as json lines, rerunning with the same checkpoint skips finished charts
+
+HEADER_SCAN_BYTES = 8192
+
+# (path, zip member or None)
+ChartRef = Tuple[str, Optional[str]]
+
+
+def chart_key(ref: ChartRef) -> str:
+    path, member = ref
+    return f"{os.path.abspath(path)}::{member}" if member else os.path.abspath(path)
+
+def header_mode(head: str) -> Optional[int]:
+    #only looks at [General], Mode is always in there
+    in_general = False
+    for line in head.splitlines():
+        line = line.strip()
+        if line.startswith('[') and line.endswith(']'):
+            if in_general:
+                return 0
+            in_general = line == '[General]'
+            continue
+        if in_general and line.startswith('Mode:'):
+            try:
+                return int(line.split(':', 1)[1].strip())
+            except ValueError:
+                return None
+    # no Mode line in a complete [General] section means osu!standard
+    return 0 if in_general else None
+
+def is_mania_head(head: bytes) -> bool:
+    mode = header_mode(head.decode('utf-8', errors='ignore'))
+    return mode == 3
+
+def iter_charts(root: str) -> Iterator[ChartRef]:
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            lower = filename.lower()
+            if lower.endswith('.osu'):
+                try:
+                    with open(path, 'rb') as f:
+                        if is_mania_head(f.read(HEADER_SCAN_BYTES)):
+                            yield (path, None)
+                except OSError as e:
+                    print(f"Skipping unreadable {path}: {e}")
+            elif lower.endswith('.osz'):
+                try:
+                    with zipfile.ZipFile(path) as z:
+                        for member in z.namelist():
+                            if member.lower().endswith('.osu'):
+                                with z.open(member) as f:
+                                    if is_mania_head(f.read(HEADER_SCAN_BYTES)):
+                                        yield (path, member)
+                except (OSError, zipfile.BadZipFile) as e:
+                    print(f"Skipping broken archive {path}: {e}")
+
+def read_chart(ref: ChartRef) -> bytes:
+    path, member = ref
+    if member is None:
+        with open(path, 'rb') as f:
+            return f.read()
+    with zipfile.ZipFile(path) as z:
+        return z.read(member)
+
+
+class Checkpoint:
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # a torn last line from an interrupted run, that chart just gets redone
+                        continue
+                    # failed charts are retried on the next run
+                    if record.get('status') == 'ok':
+                        self.done.add(record['key'])
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def mark(self, key: str, status: str, **extra):
+        self._file.write(json.dumps({'key': key, 'status': status, **extra}) + '\n')
+        self.done.add(key)
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+_worker_calc: Optional[MinaCalc] = None
+
+def _init_worker(quiet: bool):
+    #one native handle per worker process
+    global _worker_calc
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+    try:
+        _worker_calc = MinaCalc()
+    except Exception as e:
+        print(f"MinaCalc unavailable in worker: {e}", file=sys.stderr)
+
+def analyze_chart(ref: ChartRef, rates: List[float]) -> List[Dict]:
+    if _worker_calc is None:
+        raise RuntimeError("MinaCalc not initialized in worker")
+
+    raw = read_chart(ref)
+    file_hash = hashlib.sha256(raw).hexdigest()[:12]
+    beatmap = OsuBeatmap.from_text(raw.decode('utf-8', errors='ignore'))
+    if not beatmap.is_mania:
+        return []
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        sm_path = os.path.join(temp_dir, 'chart.sm')
+        conversion = StepManiaConverter().convert(beatmap, sm_path)
+        if not conversion['success']:
+            raise RuntimeError(conversion.get('error', 'Conversion failed'))
+        note_data = parse_sm_file(sm_path)
+
+    if not note_data:
+        raise RuntimeError("No note data found in converted SM file")
+
+    metadata = {
+        'title': beatmap.metadata.title,
+        'artist': beatmap.metadata.artist,
+        'creator': beatmap.metadata.creator,
+        'version': beatmap.metadata.version,
+        'key_count': int(beatmap.circle_size),
+        'hit_objects': len(beatmap.hit_objects),
+        'star_rating': beatmap.overall_difficulty,
+    }
+    beatmapset_id = beatmap.metadata.beatmapset_id if beatmap.metadata.beatmapset_id > 0 else None
+    fingerprint = beatmap.fingerprint()
+    analyzed_at = datetime.now().isoformat()
+
+    ssrs = _worker_calc.calculate_ssr_batch(note_data, [(rate, DEFAULT_SCORE_GOAL) for rate in rates])
+    return [
+        analysis_row(file_hash, rate, metadata, difficulty_data, analyzed_at, source='import', beatmap_id=beatmapset_id,
+                     fingerprint=fingerprint)
+        for rate, difficulty_data in zip(rates, ssrs)
+    ]
+
+
+class ImportProgress:
+    def __init__(self):
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.scanned = 0
+        self.skipped = 0
+        self.imported = 0
+        self.failed = 0
+        self.rows_written = 0
+        self.running = False
+        self.error: Optional[str] = None
+        self.cancel_event = threading.Event()
+
+    def snapshot(self) -> Dict:
+        return {k: v for k, v in vars(self).items() if k != 'cancel_event'}
+
+
+def run_import(root: str, store: ResultStore, checkpoint_path: str, rates: List[float], workers: int = 0,
+               quiet: bool = True, progress: Optional[ImportProgress] = None) -> ImportProgress:
+    progress = progress or ImportProgress()
+    progress.started_at = datetime.now().isoformat()
+    progress.running = True
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    max_pending = workers * 4
+
+    checkpoint = Checkpoint(checkpoint_path)
+    pending: Dict = {}
+    batch: List[Dict] = []
+    # checkpoint lines for the charts in batch, (key, status, extra)
+    marks: List[Tuple[str, str, Dict]] = []
+    last_report = time.monotonic()
+
+    def flush_batch():
+        if batch:
+            store.put_many(batch)
+            progress.rows_written += len(batch)
+            batch.clear()
+        # only once their rows are committed: a crash before this point redoes those charts
+        # on the next run instead of skipping charts that were never stored
+        for key, status, extra in marks:
+            checkpoint.mark(key, status, **extra)
+        marks.clear()
+        checkpoint.flush()
+
+    def collect(done_futures):
+        for future in done_futures:
+            key = pending.pop(future)
+            try:
+                rows = future.result()
+                batch.extend(rows)
+                marks.append((key, 'ok', {'rows': len(rows)}))
+                progress.imported += 1
+            except Exception as e:
+                marks.append((key, 'error', {'error': str(e)[:200]}))
+                progress.failed += 1
+
+    try:
+        # not fork: the server starts imports from a thread, and a forked child can inherit a held lock
+        context = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(quiet,), mp_context=context) as pool:
+            for ref in iter_charts(root):
+                if progress.cancel_event.is_set():
+                    break
+                progress.scanned += 1
+                key = chart_key(ref)
+                if key in checkpoint.done:
+                    progress.skipped += 1
+                    continue
+
+                # bounded in-flight work so 100k charts don't all sit in the queue
+                while len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+                pending[pool.submit(analyze_chart, ref, rates)] = key
+
+                if len(batch) >= 200:
+                    flush_batch()
+                if time.monotonic() - last_report > 5:
+                    last_report = time.monotonic()
+                    print(f"Import: {progress.scanned} scanned, {progress.imported} imported, "
+                          f"{progress.failed} failed, {progress.skipped} already done")
+
+            if progress.cancel_event.is_set():
+                for future in pending:
+                    future.cancel()
+            done, _ = wait(pending)
+            collect([f for f in done if not f.cancelled()])
+            flush_batch()
+
+    except Exception as e:
+        progress.error = str(e)
+        raise
+    finally:
+        try:
+            flush_batch()
+        finally:
+            checkpoint.close()
+            progress.running = False
+            progress.finished_at = datetime.now().isoformat()
+
+    print(f"Import finished: {progress.imported} charts imported, {progress.failed} failed, "
+          f"{progress.skipped} skipped from checkpoint, {progress.rows_written} rows written")
+    return progress
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a local osu! Songs folder or .osz collection into the result store")
+    parser.add_argument("root", help="directory to walk for .osz / .osu files")
+    parser.add_argument("--db", default=os.path.join("downloads", "results.sqlite3"))
+    parser.add_argument("--checkpoint", help="progress file, defaults to <db>.import-<dir name>.jsonl")
+    parser.add_argument("--rates", type=float, nargs="+", default=[1.0])
+    parser.add_argument("--workers", type=int, default=0, help="worker processes, 0 = cpu count - 1")
+    parser.add_argument("--verbose", action="store_true", help="keep per chart parser output")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    checkpoint_path = args.checkpoint or f"{args.db}.import-{os.path.basename(os.path.abspath(args.root))}.jsonl"
+
+    with contextlib.suppress(KeyboardInterrupt):
+        run_import(args.root, ResultStore(args.db), checkpoint_path, args.rates, args.workers, quiet=not args.verbose)
@@ -0,0 +1,201 @@
+import argparse
+import asyncio
+import io
+import os
+import random
+import sys
+import zipfile
+from functools import lru_cache
+from typing import Dict, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# local stand-in for osu.ppy.sh, start the backend with OSU_BASE_URL=http://127.0.0.1:<port>
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.generator import generate_osu, PATTERNS
+
+
+class FakeOsuConfig:
+    def __init__(self, latency_ms: float = 50.0, jitter_ms: float = 20.0, bandwidth_kbps: float = 0.0,
+                 rate_limit_probability: float = 0.0, retry_after: int = 1, diffs_per_set: int = 3,
+                 chart_duration: float = 120.0, score_count: int = 100, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        # 0 = unlimited
+        self.bandwidth_kbps = bandwidth_kbps
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.diffs_per_set = diffs_per_set
+        self.chart_duration = chart_duration
+        self.score_count = score_count
+        self.seed = seed
+
+config = FakeOsuConfig()
+app = FastAPI(title="fake osu!", description="Canned osu! API responses for load testing")
+_rng = random.Random(0)
+
+def _set_layout(beatmapset_id: int):
+    #each set gets a deterministic mix of patterns and key modes
+    rng = random.Random(f"{config.seed}-{beatmapset_id}")
+    return [(rng.choice(PATTERNS[:-1]), rng.choice([4, 4, 4, 7])) for _ in range(config.diffs_per_set)]
+
+def _version(index: int, pattern: str, keys: int) -> str:
+    return f"[{keys}K] {pattern} {index + 1}"
+
+@lru_cache(maxsize=256)
+def build_osz(beatmapset_id: int) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as z:
+        for index, (pattern, keys) in enumerate(_set_layout(beatmapset_id)):
+            content = generate_osu(pattern, keys, seed=beatmapset_id * 100 + index, duration=config.chart_duration)
+            content = content.replace(f"Version:{keys}K {pattern}", f"Version:{_version(index, pattern, keys)}")
+            content = content.replace("Creator:maniatool", f"Creator:fake{beatmapset_id}")
+            z.writestr(f"fake - set {beatmapset_id} (fake{beatmapset_id}) [{_version(index, pattern, keys)}].osu", content)
+        # stand-in audio so archive sizes look a bit like real ones
+        z.writestr("audio.mp3", random.Random(beatmapset_id).randbytes(512 * 1024), compress_type=zipfile.ZIP_STORED)
+    return buffer.getvalue()
+
+def beatmapset_json(beatmapset_id: int) -> Dict:
+    beatmaps = []
+    for index, (pattern, keys) in enumerate(_set_layout(beatmapset_id)):
+        beatmaps.append({
+            "id": beatmapset_id * 100 + index,
+            "mode_int": 3,
+            "version": _version(index, pattern, keys),
+            "cs": keys,
+            "count_circles": 800 + index * 150,
+            "count_sliders": 50,
+            "count_spinners": 0,
+            "difficulty_rating": round(2.5 + index * 1.3, 2),
+        })
+    return {
+        "id": beatmapset_id,
+        "title": f"set {beatmapset_id}",
+        "artist": "fake",
+        "creator": f"fake{beatmapset_id}",
+        "beatmaps": beatmaps,
+    }
+
+def score_json(user_id: int, index: int) -> Dict:
+    rng = random.Random(f"{user_id}-{index}")
+    beatmapset_id = 1000 + rng.randint(0, 200)
+    pattern, _ = _set_layout(beatmapset_id)[0]
+    mods = rng.choice([[], [], [], ["DT"], ["HT"]])
+    return {
+        "pp": round(rng.uniform(100, 600), 2),
+        "mods": mods,
+        "score": rng.randint(700000, 1000000),
+        "max_combo": rng.randint(500, 3000),
+        "perfect": False,
+        "created_at": "2024-01-01T00:00:00+00:00",
+        "rank": rng.choice(["S", "A", "SS"]),
+        "statistics": {
+            "count_geki": rng.randint(500, 2000), "count_300": rng.randint(200, 800), "count_katu": rng.randint(0, 200),
+            "count_100": rng.randint(0, 50), "count_50": rng.randint(0, 10), "count_miss": rng.randint(0, 10),
+        },
+        "beatmap": {
+            "id": beatmapset_id * 100, "mode_int": 3, "cs": 4,
+            "version": _version(0, pattern, 4), "difficulty_rating": round(rng.uniform(3, 7), 2),
+        },
+        "beatmapset": {"id": beatmapset_id, "title": f"set {beatmapset_id}", "artist": "fake", "creator": f"fake{beatmapset_id}"},
+    }
+
+async def _simulate_upstream() -> Tuple[bool, float]:
+    delay = max(0.0, config.latency_ms + _rng.uniform(-config.jitter_ms, config.jitter_ms)) / 1000
+    await asyncio.sleep(delay)
+    return _rng.random() < config.rate_limit_probability, delay
+
+def _rate_limited() -> JSONResponse:
+    return JSONResponse({"error": "Too Many Attempts."}, status_code=429, headers={"Retry-After": str(config.retry_after)})
+
+@app.middleware("http")
+async def upstream_behaviour(request: Request, call_next):
+    if request.url.path.startswith("/_fake"):
+        return await call_next(request)
+    limited, _ = await _simulate_upstream()
+    if limited:
+        return _rate_limited()
+    return await call_next(request)
+
+@app.get("/beatmapsets/{beatmapset_id}/download")
+async def download(beatmapset_id: int):
+    data = await asyncio.to_thread(build_osz, beatmapset_id)
+
+    async def body():
+        chunk_size = 64 * 1024
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            if config.bandwidth_kbps > 0:
+                await asyncio.sleep(len(chunk) / (config.bandwidth_kbps * 1024))
+            yield chunk
+
+    return StreamingResponse(body(), media_type="application/x-osu-beatmap-archive",
+                             headers={"Content-Length": str(len(data))})
+
+@app.get("/api/v2/beatmapsets/{beatmapset_id}")
+async def beatmapset(beatmapset_id: int):
+    return beatmapset_json(beatmapset_id)
+
+@app.get("/api/v2/me")
+async def me(request: Request):
+    return {"id": _user_id(request), "username": f"loadtest{_user_id(request)}", "country_code": "XX"}
+
+@app.get("/api/v2/me/mania")
+async def me_mania(request: Request):
+    return {"id": _user_id(request), "statistics": {"pp": 5000.0, "global_rank": 1000}}
+
+@app.get("/api/v2/users/{user_id}/mania")
+async def user_mania(user_id: int):
+    return {
+        "id": user_id,
+        "username": f"loadtest{user_id}",
+        "country_code": "XX",
+        "statistics": {"global_rank": 1000, "country_rank": 10, "pp": 5000.0, "hit_accuracy": 97.5, "play_count": 10000},
+    }
+
+@app.get("/api/v2/users/{user_id}/scores/{score_type}")
+async def user_scores(user_id: int, score_type: str, limit: int = 50, offset: int = 0):
+    end = min(config.score_count, offset + limit)
+    return [score_json(user_id, i + (0 if score_type == "best" else 10000)) for i in range(offset, end)]
+
+@app.post("/oauth/token")
+async def token():
+    return {"token_type": "Bearer", "expires_in": 86400, "access_token": "fake-access", "refresh_token": "fake-refresh"}
+
+@app.get("/_fake/config")
+async def get_config():
+    return vars(config)
+
+@app.post("/_fake/config")
+async def update_config(changes: Dict[str, float]):
+    #tweak latency / 429 rate mid-run without restarting
+    for key, value in changes.items():
+        if hasattr(config, key):
+            setattr(config, key, type(getattr(config, key))(value))
+    build_osz.cache_clear()
+    return vars(config)
+
+def _user_id(request: Request) -> int:
+    # different tokens look like different users
+    token = request.headers.get("Authorization", "")
+    return 1 + (sum(token.encode()) % 10000)
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local stand-in osu! server for load tests")
+    parser.add_argument("--port", type=int, default=9700)
+    parser.add_argument("--latency-ms", type=float, default=config.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=config.jitter_ms)
+    parser.add_argument("--bandwidth-kbps", type=float, default=config.bandwidth_kbps, help="per download, 0 = unlimited")
+    parser.add_argument("--rate-limit-probability", type=float, default=config.rate_limit_probability, help="chance of a 429 per request")
+    parser.add_argument("--diffs-per-set", type=int, default=config.diffs_per_set)
+    parser.add_argument("--chart-duration", type=float, default=config.chart_duration)
+    parser.add_argument("--score-count", type=int, default=config.score_count)
+    args = parser.parse_args()
+
+    config = FakeOsuConfig(args.latency_ms, args.jitter_ms, args.bandwidth_kbps, args.rate_limit_probability,
+                           diffs_per_set=args.diffs_per_set, chart_duration=args.chart_duration, score_count=args.score_count)
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
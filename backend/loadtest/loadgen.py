@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+# open loop load generator for the backend api
+# requests are fired on schedule regardless of how slow earlier ones are, so queueing shows up in the latencies
+
+SCENARIOS = ["analyze", "list-difficulties", "user-scores"]
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+def build_request(scenario: str, rng: random.Random, set_ids: List[int], tokens: List[str], batch_size: int) -> Tuple[str, dict]:
+    token = rng.choice(tokens)
+    if scenario == "user-scores":
+        return "/user-scores", {"access_token": token}
+
+    beatmap_ids = rng.sample(set_ids, min(batch_size, len(set_ids)))
+    body = {"beatmap_ids": beatmap_ids, "access_token": token, "osu_session_cookie": "loadtest"}
+    if scenario == "analyze":
+        body["rate"] = rng.choice([1.0, 1.0, 1.5, 0.75])
+        return "/analyze", body
+    return "/list-difficulties", body
+
+async def run_load(base_url: str, rps: float, duration: float, mix: Dict[str, float], set_ids: List[int],
+                   tokens: List[str], batch_size: int, timeout: float, seed: int = 0) -> Dict:
+    rng = random.Random(seed)
+    scenarios, weights = zip(*mix.items())
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Counter] = defaultdict(Counter)
+    tasks = []
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        async def fire(scenario: str, path: str, body: dict):
+            started = time.perf_counter()
+            try:
+                async with session.post(f"{base_url}{path}", json=body) as response:
+                    await response.read()
+                    status = str(response.status)
+            except asyncio.TimeoutError:
+                status = "timeout"
+            except aiohttp.ClientError as e:
+                status = type(e).__name__
+            latencies[scenario].append(time.perf_counter() - started)
+            statuses[scenario][status] += 1
+
+        loop_started = time.perf_counter()
+        sent = 0
+        while True:
+            elapsed = time.perf_counter() - loop_started
+            if elapsed >= duration:
+                break
+            due = int(elapsed * rps) + 1
+            while sent < due:
+                scenario = rng.choices(scenarios, weights)[0]
+                path, body = build_request(scenario, rng, set_ids, tokens, batch_size)
+                tasks.append(asyncio.create_task(fire(scenario, path, body)))
+                sent += 1
+            await asyncio.sleep(min(0.01, 1.0 / rps))
+
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - loop_started
+
+    report = {"target_rps": rps, "duration": duration, "wall_time": round(wall, 3), "sent": sent, "scenarios": {}}
+    all_latencies = []
+    total_ok = 0
+    for scenario, values in latencies.items():
+        values.sort()
+        all_latencies.extend(values)
+        ok = statuses[scenario].get("200", 0)
+        total_ok += ok
+        report["scenarios"][scenario] = _summary(values, statuses[scenario], ok, wall)
+
+    all_latencies.sort()
+    report["overall"] = _summary(all_latencies, sum(statuses.values(), Counter()), total_ok, wall)
+    return report
+
+def _summary(sorted_latencies: List[float], statuses: Counter, ok: int, wall: float) -> Dict:
+    return {
+        "requests": len(sorted_latencies),
+        "ok": ok,
+        "statuses": dict(statuses),
+        "throughput_rps": round(ok / wall, 3) if wall > 0 else 0.0,
+        "p50_ms": round(percentile(sorted_latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(sorted_latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(sorted_latencies, 99) * 1000, 2),
+        "max_ms": round((sorted_latencies[-1] if sorted_latencies else 0.0) * 1000, 2),
+    }
+
+def print_report(report: Dict):
+    print(f"\nSent {report['sent']} requests at {report['target_rps']} rps over {report['wall_time']}s")
+    print(f"{'scenario':<20}{'reqs':>7}{'ok':>7}{'rps':>9}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    rows = list(report["scenarios"].items()) + [("overall", report["overall"])]
+    for name, s in rows:
+        print(f"{name:<20}{s['requests']:>7}{s['ok']:>7}{s['throughput_rps']:>9}"
+              f"{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}{s['max_ms']:>10}")
+        non_ok = {k: v for k, v in s["statuses"].items() if k != "200"}
+        if non_ok:
+            print(f"{'':<20}non-200: {non_ok}")
+
+def parse_mix(value: str) -> Dict[str, float]:
+    #"analyze=1,list-difficulties=3"
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name}, expected one of {SCENARIOS}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Drive the backend at a target rps and report latency percentiles")
+    parser.add_argument("--base-url", default="http://127.0.0.1:9731")
+    parser.add_argument("--rps", type=float, default=5.0)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("analyze=1,list-difficulties=2,user-scores=1"))
+    parser.add_argument("--sets", type=int, default=50, help="how many distinct beatmapset ids to spread requests over")
+    parser.add_argument("--users", type=int, default=20, help="how many distinct access tokens to use")
+    parser.add_argument("--batch-size", type=int, default=1, help="beatmap ids per analyze/list request")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="write the report as json")
+    args = parser.parse_args(argv)
+
+    set_ids = list(range(1000, 1000 + args.sets))
+    tokens = [f"loadtest-token-{i}" for i in range(args.users)]
+    report = asyncio.run(run_load(args.base_url, args.rps, args.duration, args.mix, set_ids, tokens, args.batch_size, args.timeout))
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
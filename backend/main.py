@@ -1,5 +1,7 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, FileResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from typing import List, Optional, Dict
 import tempfile
@@ -9,18 +11,50 @@ from datetime import datetime
 import re
 import hashlib
 import json
-
-from osu_to_sm import convert_osu_to_stepmania
-from minacalc_bindings import MinaCalc, parse_sm_file
-from beatmap_downloader import BeatmapDownloader
-from scores import OsuUserScoresScraper, get_user_id_from_token
-
+import math
+import threading
+import asyncio
+import time
+import zipfile
+
+# before the local imports below, several of them read their settings (pool sizes, admission limits,
+# cache compression, OSU_BASE_URL, ...) from the environment at import time
 import dotenv
 dotenv.load_dotenv()
 
+from osu_to_sm import OsuBeatmap, convert_beatmap_to_stepmania, convert_osu_to_stepmania, osu_fingerprint
+from minacalc_bindings import MinaCalc, parse_sm_notes
+from note_cache import NoteCache
+from coordination import LockDir, atomic_write_text
+import compressed_cache
+from beatmap_downloader import BeatmapDownloader, beatmapset_info_cache
+from scores import OsuUserScoresScraper, get_user_id_from_token, user_id_cache
+from executors import admission, run_io, run_io_shielded, run_io_to_completion, run_cpu, run_calc, shutdown_executors, LoopLagMonitor
+from admission import BULK, INTERACTIVE, Overloaded, job_cost, job_scope, owner_key
+from metrics import (registry, stage_timer, timing_scope, rounded_timings, requests_total, request_seconds,
+                     cache_events, inflight, ttl_cache_stats, event_loop_lag)
+from profiling import RequestProfiler
+from tracing import TraceRecorder, TraceStore, tracing, trace_args, span
+from result_store import DEFAULT_SCORE_GOAL, MAX_PAGE_SIZE, RANGE_COLUMNS, SKILLSETS, ResultStore, analysis_row, metadata_from_row, rate_key
+from similarity import SimilarityIndex
+from rating import player_ratings, score_goal_for
+from importer import HEADER_SCAN_BYTES, ImportProgress, is_mania_head, run_import
+from export import FORMATS, default_format, export_analyses, export_scores
+
 OSU_CLIENT_ID = int(os.getenv("OSU_CLIENT_ID", "0"))
 OSU_CLIENT_SECRET = os.getenv("OSU_CLIENT_SECRET", "")
 
+# parallel osu! api lookups per /list-difficulties request
+METADATA_CONCURRENCY = int(os.getenv("METADATA_CONCURRENCY", "8"))
+
+# /analyze-upload limits, whole request body and single .osu inside an archive
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "100")) * 1024 * 1024
+MAX_OSU_BYTES = int(os.getenv("MAX_OSU_MB", "20")) * 1024 * 1024
+MAX_UPLOAD_FILES = int(os.getenv("MAX_UPLOAD_FILES", "20"))
+
+# how often a running analysis checks whether its client is still there
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+
 app = FastAPI(title="Mania Difficulty Analysis API", description="osu!mania to StepMania difficulty analysis")
 
 app.add_middleware(
@@ -35,21 +69,52 @@ app.add_middleware(
 DOWNLOADS_DIR = "downloads"
 OSU_FILES_DIR = os.path.join(DOWNLOADS_DIR, "osu")
 SM_FILES_DIR = os.path.join(DOWNLOADS_DIR, "sm")
+NOTES_DIR = os.path.join(DOWNLOADS_DIR, "notes")
 USER_SCORES_DIR = os.path.join(DOWNLOADS_DIR, "user_scores")
+PROFILES_DIR = os.path.join(DOWNLOADS_DIR, "profiles")
+TRACES_DIR = os.path.join(DOWNLOADS_DIR, "traces")
+RESULTS_DB = os.path.join(DOWNLOADS_DIR, "results.sqlite3")
+LOCKS_DIR = os.path.join(DOWNLOADS_DIR, "locks")
+JOBS_DIR = os.path.join(DOWNLOADS_DIR, "jobs")
 
-for directory in [DOWNLOADS_DIR, OSU_FILES_DIR, SM_FILES_DIR, USER_SCORES_DIR]:
+for directory in [DOWNLOADS_DIR, OSU_FILES_DIR, SM_FILES_DIR, NOTES_DIR, USER_SCORES_DIR, LOCKS_DIR, JOBS_DIR]:
     os.makedirs(directory, exist_ok=True)
 
+# admin endpoints stay disabled unless ADMIN_TOKEN is set
+request_profiler = RequestProfiler(PROFILES_DIR, admin_token=os.getenv("ADMIN_TOKEN") or None)
+trace_store = TraceStore(TRACES_DIR)
+note_cache = NoteCache(NOTES_DIR)
+result_store = ResultStore(RESULTS_DB)
+similarity_index = SimilarityIndex(result_store)
+# shared by every worker process using this downloads/ dir
+chart_locks = LockDir(LOCKS_DIR)
+# one lock per running analysis job id, a cancel can land on any worker
+job_locks = LockDir(JOBS_DIR)
+
 class AnalysisRequest(BaseModel):
     beatmap_ids: List[int]
     difficulty_names: Optional[List[str]] = None
     access_token: str
     rate: Optional[float] = 1.0
     osu_session_cookie: Optional[str] = None
+    debug_timings: Optional[bool] = False
+    trace: Optional[bool] = False
+    # client chosen id (a uuid), lets POST /jobs/{job_id}/cancel stop this request
+    job_id: Optional[str] = None
 
 class UserScoreRequest(BaseModel):
     access_token: str
 
+class ImportRequest(BaseModel):
+    path: str
+    rates: Optional[List[float]] = None
+    workers: Optional[int] = 0
+
+class ProfilingConfig(BaseModel):
+    enabled: Optional[bool] = None
+    sample_rate: Optional[float] = None
+    mode: Optional[str] = None
+
 class DifficultyInfo(BaseModel):
     filename: str
     difficulty_name: str
@@ -86,12 +151,66 @@ class DifficultyAnalysis(BaseModel):
     success: bool
     error_message: Optional[str] = None
     analyzed_at: str
+    timings: Optional[Dict[str, float]] = None
+    fingerprint: Optional[str] = None
 
 class AnalysisResponse(BaseModel):
     results: List[DifficultyAnalysis]
     total_processed: int
     successful: int
     failed: int
+    timings: Optional[Dict[str, float]] = None
+    trace_id: Optional[str] = None
+
+class SearchResponse(BaseModel):
+    results: List[DifficultyAnalysis]
+    total: int
+    limit: int
+    offset: int
+
+class SimilarChart(BaseModel):
+    analysis: DifficultyAnalysis
+    distance: float
+
+class SimilarResponse(BaseModel):
+    query: DifficultyAnalysis
+    results: List[SimilarChart]
+
+class MissingChart(BaseModel):
+    beatmapset_id: int
+    difficulty_name: str
+    rate: float
+
+class UserRatingResponse(BaseModel):
+    user_id: int
+    username: str
+    ratings: Dict[str, float]
+    scores_used: int
+    queued: int
+    missing: List[MissingChart]
+    computed_at: str
+
+class TimelineWindow(BaseModel):
+    start: float
+    end: float
+    notes: int
+    overall: float
+    stream: float
+    jumpstream: float
+    handstream: float
+    stamina: float
+    jackspeed: float
+    chordjack: float
+    technical: float
+
+class TimelineResponse(BaseModel):
+    beatmap_id: int
+    difficulty_name: str
+    rate: float
+    window: float
+    hop: float
+    windows: List[TimelineWindow]
+    cached: bool
 
 class BeatmapsetListResponse(BaseModel):
     beatmapsets: List[BeatmapsetInfo]
@@ -134,29 +253,91 @@ class UserAnalysisData(BaseModel):
     scraped_at: str
 
 minacalc_instance = None
+loop_lag_monitor = LoopLagMonitor()
 
 @app.on_event("startup")
 async def startup_event():
-    #initialize minacalc
+    #initialize minacalc, runs once in every worker process so each has its own native handle
     global minacalc_instance
     try:
         minacalc_instance = MinaCalc()
-        print(f"MinaCalc initialized, version: {minacalc_instance.get_version()}")
+        print(f"MinaCalc initialized in worker {os.getpid()}, version: {minacalc_instance.get_version()}")
     except Exception as e:
         print(f"Failed to initialize MinaCalc: {e}")
 
+    loop_lag_monitor.start()
+
+class RequestMetricsMiddleware:
+    #plain asgi on purpose: behind a BaseHTTPMiddleware (@app.middleware) the endpoint's
+    #request.is_disconnected() never sees http.disconnect, and run_cancellable relies on it
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        with inflight.track(kind="requests"):
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # route template keeps label cardinality bounded, the router sets it on the shared scope
+                route = scope.get("route")
+                path = route.path if route else "unmatched"
+                requests_total.inc(path=path, status=status_code)
+                request_seconds.observe(time.perf_counter() - started, path=path)
+
+app.add_middleware(RequestMetricsMiddleware)
+
+def collect_runtime_metrics():
+    for cache in (user_id_cache, beatmapset_info_cache):
+        stats = cache.stats()
+        for field in ("hits", "misses", "evictions", "size"):
+            ttl_cache_stats.set(stats[field], cache=stats["name"], field=field)
+
+    lag = loop_lag_monitor.stats()
+    event_loop_lag.set(lag["last_lag_ms"] / 1000, kind="last")
+    event_loop_lag.set(lag["max_lag_ms"] / 1000, kind="max")
+
+registry.add_collector(collect_runtime_metrics)
+
 @app.on_event("shutdown")
 async def shutdown_event():
     global minacalc_instance
+    loop_lag_monitor.stop()
+    shutdown_executors()
     if minacalc_instance:
         del minacalc_instance
 
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    #queue full on an acquire outside an admitted request, same answer admit() gives up front
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
+def admit(*pools: str):
+    #turns a full admission queue into a 503 before any work starts
+    try:
+        admission.admit(*pools)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
 def get_file_hash(file_path: str) -> str:
     #sha256 cache
     hash_sha256 = hashlib.sha256()
     try:
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
+        # hash of the .osu content, the same whether the cached copy is compressed or not
+        with compressed_cache.open_binary(file_path) as f:
+            for chunk in iter(lambda: f.read(65536), b""):
                 hash_sha256.update(chunk)
         return hash_sha256.hexdigest()[:12]
     except Exception:
@@ -185,7 +366,7 @@ def cache_osu_file(source_path: str, beatmap_id: int, difficulty_name: str) -> s
     cached_path = os.path.join(OSU_FILES_DIR, cached_filename)
 
     if not os.path.exists(cached_path):
-        shutil.copy2(source_path, cached_path)
+        compressed_cache.write_file(source_path, cached_path)
         print(f"Cached .osu file: {cached_filename}")
 
     return cached_path
@@ -195,7 +376,7 @@ def cache_sm_file(source_path: str, beatmap_id: int, difficulty_name: str, file_
     cached_path = os.path.join(SM_FILES_DIR, cached_filename)
 
     if not os.path.exists(cached_path):
-        shutil.copy2(source_path, cached_path)
+        compressed_cache.write_file(source_path, cached_path)
         print(f"Cached .sm file: {cached_filename}")
 
     return cached_path
@@ -208,8 +389,7 @@ def save_user_scores_to_json(user_data: UserAnalysisData) -> str:
     data_dict = user_data.model_dump()
 
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data_dict, f, indent=2, ensure_ascii=False)
+        atomic_write_text(filepath, json.dumps(data_dict, indent=2, ensure_ascii=False))
         print(f"User scores saved to: {filepath}")
         return filepath
     except Exception as e:
@@ -220,6 +400,10 @@ def save_user_scores_to_json(user_data: UserAnalysisData) -> str:
 async def root():
     return {"message": "Mania Difficulty Analysis API is running"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/user-scores", response_model=UserAnalysisData)
 async def get_user_scores(request: UserScoreRequest):
     if not request.access_token:
@@ -229,11 +413,12 @@ async def get_user_scores(request: UserScoreRequest):
         print("Initializing user score scraper...")
         scraper = OsuUserScoresScraper(request.access_token)
 
+        # the scraper is requests based, keep it off the event loop
         print("Getting user ID from token...")
-        user_id = get_user_id_from_token(request.access_token)
+        user_id = await run_io(get_user_id_from_token, request.access_token)
         print(f"Analyzing scores for user ID: {user_id}")
 
-        user_data = scraper.scrape_user_scores(user_id)
+        user_data = await run_io(scraper.scrape_user_scores, user_id)
 
         if not user_data:
             raise HTTPException(status_code=404, detail="Could not fetch user scores")
@@ -311,7 +496,7 @@ async def get_user_scores(request: UserScoreRequest):
         )
 
         # save to json
-        json_filepath = save_user_scores_to_json(user_analysis_data)
+        json_filepath = await run_io(save_user_scores_to_json, user_analysis_data)
 
         print(f"User: {user_analysis_data.username} (#{user_analysis_data.user_id})\nGlobal Rank: #{user_analysis_data.global_rank}\nPP: {user_analysis_data.user_pp}\nAccuracy: {user_analysis_data.user_accuracy:.2f}%\nPlay Count: {user_analysis_data.play_count}\nBest scores: {len(user_analysis_data.best_scores)}\nRecent scores: {len(user_analysis_data.recent_scores)}\nUnique beatmaps: {user_analysis_data.total_unique_maps}")
 
@@ -337,6 +522,161 @@ async def get_user_scores(request: UserScoreRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# (file_hash, rate, score goal) currently being calculated for /user-rating
+rating_calc_inflight = set()
+rating_calc_tasks = set()
+
+def best_scores_per_chart(scores: List[dict]) -> List[dict]:
+    #etterna style, only the best score on each chart + rate counts
+    best = {}
+    for score in scores:
+        key = (score['beatmapset_id'], score['difficulty_name'], round(score['rate'], 3))
+        if key not in best or score['accuracy'] > best[key]['accuracy']:
+            best[key] = score
+    return list(best.values())
+
+def local_chart_source(row: dict) -> Optional[tuple]:
+    #('notes' | 'sm' | 'osu', path) for a stored chart we can recompute without downloading anything
+    notes_path = note_cache.path_for(row['file_hash'])
+    if os.path.exists(notes_path):
+        return ('notes', notes_path)
+    if not row['beatmap_id']:
+        return None
+    sm_path = get_cached_sm_path(row['beatmap_id'], row['difficulty_name'], row['file_hash'])
+    if sm_path:
+        return ('sm', sm_path)
+    osu_path = get_cached_osu_path(row['beatmap_id'], row['difficulty_name'])
+    if osu_path and get_file_hash(osu_path) == row['file_hash']:
+        return ('osu', osu_path)
+    return None
+
+def lookup_score_ssrs(scores: List[dict]) -> tuple:
+    #splits scores into (ssrs ready to aggregate, charts to calc at new goals, charts never analyzed)
+    #to_calc is grouped per chart so each one is parsed and marshalled once for all its (rate, goal) pairs
+    ready, missing = [], []
+    to_calc: Dict[str, tuple] = {}
+    for score in scores:
+        rate = score['rate']
+        base = result_store.find(score['beatmapset_id'], score['difficulty_name'], rate)
+        if not base:
+            missing.append(MissingChart(beatmapset_id=score['beatmapset_id'], difficulty_name=score['difficulty_name'], rate=rate))
+            continue
+
+        goal = score_goal_for(score['accuracy'])
+        at_goal = base if goal == DEFAULT_SCORE_GOAL else result_store.get(base['file_hash'], rate, goal)
+        if at_goal:
+            ready.append(at_goal)
+            continue
+
+        if base['file_hash'] in to_calc:
+            to_calc[base['file_hash']][2].add((rate, goal))
+            continue
+        source = local_chart_source(base)
+        if source:
+            to_calc[base['file_hash']] = (base, source, {(rate, goal)})
+        else:
+            missing.append(MissingChart(beatmapset_id=score['beatmapset_id'], difficulty_name=score['difficulty_name'], rate=rate))
+    return ready, list(to_calc.values()), missing
+
+async def load_chart_notes(base: dict, source: tuple):
+    #calc input of a stored chart: the binary note cache, else the local .sm (or .osu, caching the .sm on the way)
+    note_data = await run_io(note_cache.get, base['file_hash'])
+    if note_data is not None:
+        return note_data
+
+    kind, path = source
+    if kind == 'notes':
+        raise Exception("Cached note data is unreadable or from an older format")
+    if kind == 'osu':
+        with tempfile.TemporaryDirectory() as temp_dir:
+            sm_path = os.path.join(temp_dir, f"{os.path.basename(path)}.sm")
+            conversion_result = await run_cpu(convert_osu_to_stepmania, path, sm_path)
+            if not conversion_result['success']:
+                raise Exception(f"Conversion failed: {conversion_result.get('error', 'Unknown error')}")
+            path = await run_io(cache_sm_file, sm_path, base['beatmap_id'], base['difficulty_name'], base['file_hash'])
+
+    note_data = await run_cpu(parse_sm_notes, path)
+    if not len(note_data):
+        raise Exception("No note data found in converted SM file")
+    await run_io(note_cache.put, base['file_hash'], note_data, base['key_count'] or 4)
+    return note_data
+
+def missing_goals(file_hash: str, pairs: List[tuple]) -> List[tuple]:
+    return [(rate, goal) for rate, goal in pairs if result_store.get(file_hash, rate, goal) is None]
+
+async def calc_score_goals(base: dict, source: tuple, pairs: List[tuple], owner: str):
+    #rating_calc_inflight dedupes within this worker, the chart lock across workers:
+    #whoever gets it second only calculates what the first didn't store
+    try:
+        async with chart_locks.hold(f"rating_{base['file_hash']}"):
+            todo = await run_io(missing_goals, base['file_hash'], pairs)
+            if not todo:
+                return
+            with job_scope(BULK, owner), job_cost(base['hit_objects']):
+                note_data = await load_chart_notes(base, source)
+                with inflight.track(kind="calc"):
+                    ssrs = await run_calc(minacalc_instance.calculate_ssr_batch, note_data, todo)
+
+            analyzed_at = datetime.now().isoformat()
+            metadata = metadata_from_row(base)
+            await run_io(result_store.put_many, [
+                analysis_row(base['file_hash'], rate, metadata, difficulty_data, analyzed_at, source="rating",
+                             beatmap_id=base['beatmap_id'], score_goal=goal, fingerprint=base['fingerprint'])
+                for (rate, goal), difficulty_data in zip(todo, ssrs)
+            ])
+    except Exception as e:
+        print(f"Rating calc failed for {base['beatmap_id']} [{base['difficulty_name']}]: {e}")
+    finally:
+        for rate, goal in pairs:
+            rating_calc_inflight.discard((base['file_hash'], rate, goal))
+
+@app.post("/user-rating", response_model=UserRatingResponse)
+async def get_user_rating(request: UserScoreRequest):
+    #per skillset player rating from the user's best + recent scores
+    #uses stored SSRs only, charts missing a goal are calculated in the background for the next call
+    if not request.access_token:
+        raise HTTPException(status_code=400, detail="access_token is required")
+
+    try:
+        user_id = await run_io(get_user_id_from_token, request.access_token)
+        scraper = OsuUserScoresScraper(request.access_token)
+        user_data = await run_io(scraper.scrape_user_scores, user_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not user_data:
+        raise HTTPException(status_code=404, detail="Could not fetch user scores")
+
+    scores = best_scores_per_chart(user_data['scores']['best'] + user_data['scores']['recent'])
+    with stage_timer("rating_lookup"):
+        ready, to_calc, missing = await run_io(lookup_score_ssrs, scores)
+
+    queued = 0
+    # background work is best effort, when the queues are full it's picked up by a later call instead
+    busy = admission["cpu"].full or admission["calc"].full
+    if minacalc_instance and not busy:
+        for base, source, pairs in to_calc:
+            queued += len(pairs)
+            new_pairs = [pair for pair in sorted(pairs) if (base['file_hash'], *pair) not in rating_calc_inflight]
+            if not new_pairs:
+                continue
+            rating_calc_inflight.update((base['file_hash'], *pair) for pair in new_pairs)
+            task = asyncio.create_task(calc_score_goals(base, source, new_pairs, owner_key(request.access_token)))
+            rating_calc_tasks.add(task)
+            task.add_done_callback(rating_calc_tasks.discard)
+
+    with stage_timer("rating_aggregate"):
+        ratings = player_ratings(ready)
+
+    return UserRatingResponse(
+        user_id=user_data['user_info']['user_id'],
+        username=user_data['user_info']['username'],
+        ratings=ratings,
+        scores_used=len(ready),
+        queued=queued,
+        missing=missing,
+        computed_at=datetime.now().isoformat()
+    )
+
 @app.post("/list-difficulties", response_model=BeatmapsetListResponse)
 async def list_difficulties(request: AnalysisRequest):
     #listing mania diffs for id
@@ -347,47 +687,126 @@ async def list_difficulties(request: AnalysisRequest):
         request.access_token,
         OSU_CLIENT_ID,
         OSU_CLIENT_SECRET,
-        user_cookie=request.osu_session_cookie
+        user_cookie=request.osu_session_cookie,
+        osu_cache_dir=OSU_FILES_DIR
     )
     beatmapsets = []
     total_found = 0
 
+    # duplicate ids in one request only need one lookup
+    unique_ids = list(dict.fromkeys(request.beatmap_ids))
+    lookups = await downloader.get_beatmapsets_info(unique_ids, max_concurrency=METADATA_CONCURRENCY)
+    infos = dict(zip(unique_ids, lookups))
+
     for beatmap_id in request.beatmap_ids:
-        try:
-            beatmapset_info = await downloader.get_beatmapset_info(beatmap_id)
-            beatmapsets.append(BeatmapsetInfo(
-                beatmapset_id=beatmapset_info['beatmapset_id'],
-                title=beatmapset_info['title'],
-                artist=beatmapset_info['artist'],
-                creator=beatmapset_info['creator'],
-                difficulties=[
-                    DifficultyInfo(
-                        filename=diff['filename'],
-                        difficulty_name=diff['difficulty_name'],
-                        creator=diff['creator'],
-                        key_count=diff['key_count'],
-                        hit_objects=diff['hit_objects'],
-                        star_rating=diff['star_rating']
-                    ) for diff in beatmapset_info['difficulties']
-                ]
-            ))
-            total_found += len(beatmapset_info['difficulties'])
-        except Exception as e:
+        beatmapset_info = infos[beatmap_id]
+        if isinstance(beatmapset_info, Exception):
             beatmapsets.append(BeatmapsetInfo(
                 beatmapset_id=beatmap_id,
-                title=f"Error: {str(e)}",
+                title=f"Error: {str(beatmapset_info)}",
                 artist="Unknown",
                 creator="Unknown",
                 difficulties=[]
             ))
+            continue
+
+        beatmapsets.append(BeatmapsetInfo(
+            beatmapset_id=beatmapset_info['beatmapset_id'],
+            title=beatmapset_info['title'],
+            artist=beatmapset_info['artist'],
+            creator=beatmapset_info['creator'],
+            difficulties=[
+                DifficultyInfo(
+                    filename=diff['filename'],
+                    difficulty_name=diff['difficulty_name'],
+                    creator=diff['creator'],
+                    key_count=diff['key_count'],
+                    hit_objects=diff['hit_objects'],
+                    star_rating=diff['star_rating']
+                ) for diff in beatmapset_info['difficulties']
+            ]
+        ))
+        total_found += len(beatmapset_info['difficulties'])
 
     return BeatmapsetListResponse(
         beatmapsets=beatmapsets,
         total_found=total_found
     )
 
+# job id -> running analysis task, the ones started by this worker
+analysis_jobs: Dict[str, asyncio.Task] = {}
+JOB_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+async def watch_disconnect(http_request: Request, task: asyncio.Task, job_id: Optional[str] = None):
+    while not task.done():
+        if await http_request.is_disconnected():
+            print("Client disconnected, cancelling analysis")
+            task.cancel()
+            return
+        # a cancel sent to another worker
+        if job_id and job_locks.cancel_requested(job_id):
+            print(f"Job {job_id} cancelled")
+            task.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+async def run_cancellable(http_request: Request, job_id: Optional[str], coro):
+    #runs an analysis as its own task so a client disconnect or an explicit cancel stops it:
+    #queued downloads / cpu / calc jobs are dropped, finished cache writes are shielded and still land
+    job_lock = None
+    if job_id:
+        # the id names a lock file
+        if not JOB_ID_PATTERN.match(job_id):
+            coro.close()
+            raise HTTPException(status_code=400, detail="job_id must be 1-64 letters, digits, '-' or '_'")
+        # held for the whole run so a job id is unique across workers, not just in this one
+        job_lock = job_locks.acquire_nowait(job_id)
+        if job_lock is None:
+            coro.close()
+            raise HTTPException(status_code=409, detail=f"Job {job_id} is already running")
+
+    task = asyncio.ensure_future(coro)
+    if job_id:
+        analysis_jobs[job_id] = task
+    watcher = asyncio.create_task(watch_disconnect(http_request, task, job_id))
+    try:
+        return await task
+    except asyncio.CancelledError:
+        # the request itself being cancelled (server shutdown) keeps propagating
+        if asyncio.current_task().cancelling():
+            raise
+        # nginx's "client closed request", nobody reads it after a disconnect anyway
+        raise HTTPException(status_code=499, detail="Analysis cancelled")
+    finally:
+        watcher.cancel()
+        if job_id:
+            analysis_jobs.pop(job_id, None)
+            job_locks.release(job_id, job_lock)
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    task = analysis_jobs.get(job_id)
+    if task is not None:
+        task.cancel()
+    elif JOB_ID_PATTERN.match(job_id) and job_locks.is_held(job_id):
+        # running in another worker, it sees the marker on its next poll
+        await run_io(job_locks.request_cancel, job_id)
+    else:
+        raise HTTPException(status_code=404, detail="No running job with this id")
+    return {"job_id": job_id, "cancelled": True}
+
 @app.post("/analyze", response_model=AnalysisResponse)
-async def analyze_maps(request: AnalysisRequest):
+async def analyze_maps(request: AnalysisRequest, http_request: Request, response: Response):
+    if not request_profiler.should_profile(http_request.headers):
+        return await run_cancellable(http_request, request.job_id, run_analysis(request))
+
+    with request_profiler.profile("analyze") as profile:
+        result = await run_cancellable(http_request, request.job_id, run_analysis(request))
+    if profile is not None:
+        response.headers["X-Profile-Id"] = profile.profile_id
+    return result
+
+async def run_analysis(request: AnalysisRequest) -> AnalysisResponse:
     #difficulty analysis (this was a pain ong)
     if not minacalc_instance:
         raise HTTPException(status_code=500, detail="MinaCalc not initialized")
@@ -398,6 +817,7 @@ async def analyze_maps(request: AnalysisRequest):
     rate = request.rate or 1.0
     if rate <= 0 or rate > 3.0:
         raise HTTPException(status_code=400, detail="Rate must be between 0 and 3.0")
+    admit("download", "cpu", "calc")
 
     downloader = BeatmapDownloader(
         request.access_token,
@@ -409,113 +829,240 @@ async def analyze_maps(request: AnalysisRequest):
     successful = 0
     failed = 0
 
-    for beatmap_id in request.beatmap_ids:
+    recorder = TraceRecorder("analyze") if request.trace else None
+    # one map is someone waiting on the page, more than that is a batch
+    lane = INTERACTIVE if len(request.beatmap_ids) <= 1 else BULK
+    with timing_scope() as request_timings, tracing(recorder), span("analyze", "request"), \
+            job_scope(lane, owner_key(request.access_token)):
+        for beatmap_id in request.beatmap_ids:
+            try:
+                map_results = await process_beatmapset(downloader, beatmap_id, request.difficulty_names, rate, request.debug_timings)
+                for analysis in map_results:
+                    if analysis.success:
+                        successful += 1
+                    else:
+                        failed += 1
+                    results.append(analysis)
+            except Exception as e:
+                failed += 1
+                results.append(failed_analysis(beatmap_id, rate, e))
+
+    trace_id = None
+    if recorder is not None:
         try:
-            map_results = await process_beatmapset(downloader, beatmap_id, request.difficulty_names, rate)
-            for analysis in map_results:
-                if analysis.success:
-                    successful += 1
-                else:
-                    failed += 1
-                results.append(analysis)
+            await run_io(trace_store.save, recorder)
+            trace_id = recorder.trace_id
         except Exception as e:
-            failed += 1
-            results.append(DifficultyAnalysis(
-                beatmap_id=beatmap_id,
-                title="Unknown",
-                artist="Unknown",
-                difficulty_name="Unknown",
-                creator="Unknown",
-                key_count=0,
-                overall=0.0,
-                stream=0.0,
-                jumpstream=0.0,
-                handstream=0.0,
-                stamina=0.0,
-                jackspeed=0.0,
-                chordjack=0.0,
-                technical=0.0,
-                hit_objects=0,
-                star_rating=0.0,
-                rate=rate,
-                success=False,
-                error_message=str(e),
-                analyzed_at=datetime.now().isoformat()
-            ))
+            print(f"Failed to save trace: {e}")
+
+    return AnalysisResponse(
+        results=results,
+        total_processed=len(results),
+        successful=successful,
+        failed=failed,
+        timings=rounded_timings(request_timings) if request.debug_timings else None,
+        trace_id=trace_id
+    )
+
+class UploadTooLarge(Exception):
+    pass
+
+def limited_receive(receive, limit: int):
+    #counts body bytes as they arrive so an oversized upload is cut off before it is fully spooled
+    received = 0
+
+    async def wrapped():
+        nonlocal received
+        message = await receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > limit:
+                raise UploadTooLarge()
+        return message
+
+    return wrapped
+
+def read_upload_charts(upload: UploadFile) -> List[tuple]:
+    #(name, raw bytes) for every mania .osu in the upload, nothing else in the archive is read
+    filename = upload.filename or "upload.osu"
+    upload.file.seek(0)
+
+    if filename.lower().endswith(".osu"):
+        raw = upload.file.read(MAX_OSU_BYTES + 1)
+        if len(raw) > MAX_OSU_BYTES:
+            raise ValueError(f"{filename} is larger than {MAX_OSU_BYTES // (1024 * 1024)}MB")
+        return [(filename, raw)] if is_mania_head(raw[:HEADER_SCAN_BYTES]) else []
+
+    if not filename.lower().endswith(".osz"):
+        raise ValueError(f"{filename} is not an .osz or .osu file")
+
+    charts = []
+    try:
+        with zipfile.ZipFile(upload.file) as z:
+            for info in z.infolist():
+                if not info.filename.lower().endswith(".osu"):
+                    continue
+                if info.file_size > MAX_OSU_BYTES:
+                    raise ValueError(f"{info.filename} is larger than {MAX_OSU_BYTES // (1024 * 1024)}MB")
+                with z.open(info) as f:
+                    if not is_mania_head(f.read(HEADER_SCAN_BYTES)):
+                        continue
+                charts.append((info.filename, z.read(info)))
+    except zipfile.BadZipFile:
+        raise ValueError(f"{filename} is not a valid .osz archive")
+    return charts
+
+def beatmapset_id_from_chart(raw: bytes) -> int:
+    match = re.search(rb'^BeatmapSetID:\s*(-?\d+)', raw, re.MULTILINE)
+    return max(0, int(match.group(1))) if match else 0
+
+def write_upload_charts(charts: List[tuple], directory: str) -> List[tuple]:
+    #(path, parsed chart) pairs, parsed from the bytes already in memory
+    os.makedirs(directory, exist_ok=True)
+    parsed = []
+    for i, (name, raw) in enumerate(charts):
+        # member names come from the client, only keep the basename
+        path = os.path.join(directory, f"{i}_{os.path.basename(name.replace(chr(92), '/')) or 'chart.osu'}")
+        with open(path, 'wb') as f:
+            f.write(raw)
+        parsed.append((path, OsuBeatmap.from_text(raw.decode('utf-8', errors='ignore'))))
+    return parsed
+
+@app.post("/analyze-upload", response_model=AnalysisResponse)
+async def analyze_upload(http_request: Request):
+    #multipart form: files (.osz / .osu, repeatable), rate, difficulty_names (repeatable), debug_timings, job_id
+    #no osu! api, cookie or download involved
+    if not minacalc_instance:
+        raise HTTPException(status_code=500, detail="MinaCalc not initialized")
+
+    declared = http_request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload larger than {MAX_UPLOAD_BYTES // (1024 * 1024)}MB")
+    # before the body is read, a rejected upload costs nothing
+    admit("cpu", "calc")
+
+    capped = Request(http_request.scope, limited_receive(http_request.receive, MAX_UPLOAD_BYTES))
+    try:
+        form = await capped.form(max_files=MAX_UPLOAD_FILES)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail=f"Upload larger than {MAX_UPLOAD_BYTES // (1024 * 1024)}MB")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid multipart body: {e}")
+
+    try:
+        uploads = [f for f in form.getlist("files") if not isinstance(f, str)]
+        if not uploads:
+            raise HTTPException(status_code=400, detail="At least one .osz or .osu file is required in 'files'")
+
+        raw_rate = form.get("rate") or "1.0"
+        try:
+            # a file part named rate isn't a str
+            rate = float(raw_rate) if isinstance(raw_rate, str) else None
+        except (TypeError, ValueError):
+            rate = None
+        if rate is None or not math.isfinite(rate):
+            raise HTTPException(status_code=400, detail="rate must be a number")
+        if rate <= 0 or rate > 3.0:
+            raise HTTPException(status_code=400, detail="Rate must be between 0 and 3.0")
+
+        difficulty_filter = [name for name in form.getlist("difficulty_names") if isinstance(name, str) and name.strip()] or None
+        debug_timings = str(form.get("debug_timings", "")).lower() in ("1", "true", "yes")
+        job_id = form.get("job_id") if isinstance(form.get("job_id"), str) else None
+
+        owner = owner_key(http_request.client.host if http_request.client else "upload")
+        return await run_cancellable(http_request, job_id,
+                                     run_upload_analysis(uploads, difficulty_filter, rate, debug_timings, owner))
+    finally:
+        await form.close()
+
+async def run_upload_analysis(uploads: List[UploadFile], difficulty_filter: Optional[List[str]], rate: float,
+                              debug_timings: bool, owner: str) -> AnalysisResponse:
+    results = []
+
+    lane = INTERACTIVE if len(uploads) <= 1 else BULK
+    with timing_scope() as request_timings, tempfile.TemporaryDirectory() as temp_dir, job_scope(lane, owner):
+        for index, upload in enumerate(uploads):
+            try:
+                with stage_timer("scan"):
+                    charts = await run_io(read_upload_charts, upload)
+                if not charts:
+                    raise Exception(f"No osu!mania maps found in {upload.filename}")
+
+                beatmap_id = beatmapset_id_from_chart(charts[0][1])
+                upload_dir = os.path.join(temp_dir, str(index))
+                mania_charts = await run_io(write_upload_charts, charts, upload_dir)
+
+                with trace_args(beatmap_id=beatmap_id):
+                    results.extend(await process_mania_files(beatmap_id, mania_charts, upload_dir,
+                                                             difficulty_filter, rate, debug_timings, source="upload"))
+            except Exception as e:
+                results.append(failed_analysis(0, rate, e))
 
+    successful = sum(1 for analysis in results if analysis.success)
     return AnalysisResponse(
         results=results,
         total_processed=len(results),
         successful=successful,
-        failed=failed
+        failed=len(results) - successful,
+        timings=rounded_timings(request_timings) if debug_timings else None
     )
 
 def strip_keycount_prefix(s):
     return re.sub(r'^\[\d+K\]\s*', '', s, flags=re.IGNORECASE).strip()
 
-async def process_beatmapset(downloader: BeatmapDownloader, beatmap_id: int, difficulty_filter: Optional[List[str]] = None, rate: float = 1.0) -> List[DifficultyAnalysis]:
+async def process_beatmapset(downloader: BeatmapDownloader, beatmap_id: int, difficulty_filter: Optional[List[str]] = None, rate: float = 1.0, debug_timings: bool = False) -> List[DifficultyAnalysis]:
     #processing difficulties (lowk unoptimized)
-    results = []
-
-    with tempfile.TemporaryDirectory() as temp_dir:
+    with tempfile.TemporaryDirectory() as temp_dir, trace_args(beatmap_id=beatmap_id), span("beatmapset", "beatmapset"):
         try:
             extracted_dir = await downloader.download_and_extract_beatmapset(beatmap_id, temp_dir)
-            mania_files = downloader.find_mania_osu_files(extracted_dir)
+            with stage_timer("scan"):
+                mania_charts = await run_io(downloader.find_mania_charts, extracted_dir)
 
-            if not mania_files:
+            if not mania_charts:
                 raise Exception("No osu!mania maps found in beatmapset")
 
-            for osu_file in mania_files:
-                metadata = None
-                try:
-                    metadata = downloader.parse_osu_metadata(osu_file)
-                    diff_name = metadata.get('version', 'Unknown')
-                    print(f"Checking file: {osu_file}, version: {diff_name}")
-
-                    if difficulty_filter:
-                        filter_lc = [strip_keycount_prefix(f).lower() for f in difficulty_filter]
-                        version_lc = diff_name.strip().lower()
-                        filename_lc = os.path.basename(osu_file).strip().lower()
-                        if not any(f in version_lc or f in filename_lc for f in filter_lc):
-                            print(f"Skipping {diff_name} (not in filter, after keycount strip)")
-                            continue
-
-                    print(f"Processing {osu_file}")
-                    analysis = await process_single_difficulty(beatmap_id, osu_file, temp_dir, metadata, rate)
-                    results.append(analysis)
+            return await process_mania_files(beatmap_id, mania_charts, temp_dir, difficulty_filter, rate, debug_timings)
+
+        except Exception as e:
+            return [failed_analysis(beatmap_id, rate, e)]
 
-                except Exception as e:
-                    results.append(DifficultyAnalysis(
-                        beatmap_id=beatmap_id,
-                        title=metadata.get('title', 'Unknown') if metadata else 'Unknown',
-                        artist=metadata.get('artist', 'Unknown') if metadata else 'Unknown',
-                        difficulty_name=metadata.get('version', 'Unknown') if metadata else 'Unknown',
-                        creator=metadata.get('creator', 'Unknown') if metadata else 'Unknown',
-                        key_count=metadata.get('key_count', 4) if metadata else 4,
-                        overall=0.0,
-                        stream=0.0,
-                        jumpstream=0.0,
-                        handstream=0.0,
-                        stamina=0.0,
-                        jackspeed=0.0,
-                        chordjack=0.0,
-                        technical=0.0,
-                        hit_objects=metadata.get('hit_objects', 0) if metadata else 0,
-                        star_rating=metadata.get('star_rating', 0.0) if metadata else 0.0,
-                        rate=rate,
-                        success=False,
-                        error_message=str(e),
-                        analyzed_at=datetime.now().isoformat()
-                    ))
+async def process_mania_files(beatmap_id: int, mania_charts: List[tuple], temp_dir: str,
+                              difficulty_filter: Optional[List[str]] = None, rate: float = 1.0, debug_timings: bool = False,
+                              source: str = "analyze") -> List[DifficultyAnalysis]:
+    #shared by downloaded sets and uploads, mania_charts are (path, parsed OsuBeatmap) pairs
+    results = []
+
+    for osu_file, beatmap in mania_charts:
+        metadata = None
+        try:
+            metadata = beatmap.metadata_dict()
+            diff_name = metadata.get('version', 'Unknown')
+            print(f"Checking file: {osu_file}, version: {diff_name}")
+
+            if difficulty_filter:
+                filter_lc = [strip_keycount_prefix(f).lower() for f in difficulty_filter]
+                version_lc = diff_name.strip().lower()
+                filename_lc = os.path.basename(osu_file).strip().lower()
+                if not any(f in version_lc or f in filename_lc for f in filter_lc):
+                    print(f"Skipping {diff_name} (not in filter, after keycount strip)")
+                    continue
+
+            print(f"Processing {osu_file}")
+            with timing_scope() as difficulty_timings, trace_args(difficulty=diff_name), span("difficulty", "difficulty"), \
+                    job_cost(metadata.get('hit_objects', 0)):
+                analysis = await process_single_difficulty(beatmap_id, osu_file, temp_dir, metadata, rate, source, beatmap)
+            if debug_timings:
+                analysis.timings = rounded_timings(difficulty_timings)
+            results.append(analysis)
 
         except Exception as e:
             results.append(DifficultyAnalysis(
                 beatmap_id=beatmap_id,
-                title="Unknown",
-                artist="Unknown",
-                difficulty_name="Unknown",
-                creator="Unknown",
-                key_count=0,
+                title=metadata.get('title', 'Unknown') if metadata else 'Unknown',
+                artist=metadata.get('artist', 'Unknown') if metadata else 'Unknown',
+                difficulty_name=metadata.get('version', 'Unknown') if metadata else 'Unknown',
+                creator=metadata.get('creator', 'Unknown') if metadata else 'Unknown',
+                key_count=metadata.get('key_count', 4) if metadata else 4,
                 overall=0.0,
                 stream=0.0,
                 jumpstream=0.0,
@@ -524,8 +1071,8 @@ async def process_beatmapset(downloader: BeatmapDownloader, beatmap_id: int, dif
                 jackspeed=0.0,
                 chordjack=0.0,
                 technical=0.0,
-                hit_objects=0,
-                star_rating=0.0,
+                hit_objects=metadata.get('hit_objects', 0) if metadata else 0,
+                star_rating=metadata.get('star_rating', 0.0) if metadata else 0.0,
                 rate=rate,
                 success=False,
                 error_message=str(e),
@@ -534,7 +1081,56 @@ async def process_beatmapset(downloader: BeatmapDownloader, beatmap_id: int, dif
 
     return results
 
-async def process_single_difficulty(beatmap_id: int, osu_file: str, temp_dir: str, metadata: dict, rate: float = 1.0) -> DifficultyAnalysis:
+def failed_analysis(beatmap_id: int, rate: float, error: Exception) -> DifficultyAnalysis:
+    return DifficultyAnalysis(
+        beatmap_id=beatmap_id,
+        title="Unknown",
+        artist="Unknown",
+        difficulty_name="Unknown",
+        creator="Unknown",
+        key_count=0,
+        overall=0.0,
+        stream=0.0,
+        jumpstream=0.0,
+        handstream=0.0,
+        stamina=0.0,
+        jackspeed=0.0,
+        chordjack=0.0,
+        technical=0.0,
+        hit_objects=0,
+        star_rating=0.0,
+        rate=rate,
+        success=False,
+        error_message=str(error),
+        analyzed_at=datetime.now().isoformat()
+    )
+
+def analysis_from_row(beatmap_id: int, row: dict, metadata: dict) -> DifficultyAnalysis:
+    return DifficultyAnalysis(
+        beatmap_id=beatmap_id,
+        title=metadata.get('title', row['title']),
+        artist=metadata.get('artist', row['artist']),
+        difficulty_name=metadata.get('version', row['difficulty_name']),
+        creator=metadata.get('creator', row['creator']),
+        key_count=metadata.get('key_count', row['key_count']),
+        overall=row['overall'],
+        stream=row['stream'],
+        jumpstream=row['jumpstream'],
+        handstream=row['handstream'],
+        stamina=row['stamina'],
+        jackspeed=row['jackspeed'],
+        chordjack=row['chordjack'],
+        technical=row['technical'],
+        hit_objects=metadata.get('hit_objects', row['hit_objects']),
+        star_rating=metadata.get('star_rating', row['star_rating']),
+        rate=row['rate'],
+        success=True,
+        analyzed_at=row['analyzed_at'],
+        fingerprint=row.get('fingerprint')
+    )
+
+async def process_single_difficulty(beatmap_id: int, osu_file: str, temp_dir: str, metadata: dict, rate: float = 1.0,
+                                    source: str = "analyze", beatmap: Optional[OsuBeatmap] = None) -> DifficultyAnalysis:
     #single diff process
     global minacalc_instance
 
@@ -544,55 +1140,124 @@ async def process_single_difficulty(beatmap_id: int, osu_file: str, temp_dir: st
     try:
         diff_name = metadata.get('version', 'Unknown')
 
-        # Check if we have cached files
-        cached_osu_path = get_cached_osu_path(beatmap_id, diff_name)
+        # uploads can be edited copies of ranked sets, their BeatmapSetID is whatever the file says.
+        # they're stored without a set id so set id + name lookups (/user-rating, /similar, /timeline) never hit them
+        stored_beatmap_id = None if source == "upload" else (beatmap_id or None)
 
-        if cached_osu_path:
-            print(f"Using cached .osu file: {os.path.basename(cached_osu_path)}")
-            file_hash = get_file_hash(cached_osu_path)
-            cached_sm_path = get_cached_sm_path(beatmap_id, diff_name, file_hash)
-
-            if cached_sm_path:
-                print(f"Using cached .sm file: {os.path.basename(cached_sm_path)}")
-                sm_path = cached_sm_path
+        if source == "upload":
+            # uploads never go into (or come out of) the name based .osu cache either.
+            # everything below is keyed by content hash so that part is safe to share
+            cached_osu_path = osu_file
+            file_hash = await run_io(get_file_hash, osu_file)
+            parsed_is_current = beatmap is not None
+        else:
+            # Check if we have cached files
+            with stage_timer("osu_cache"):
+                cached_osu_path = await run_io(get_cached_osu_path, beatmap_id, diff_name)
+                osu_cache_hit = cached_osu_path is not None
+                if not osu_cache_hit:
+                    # No cached files, cache the .osu file first
+                    cached_osu_path = await run_io_to_completion(cache_osu_file, osu_file, beatmap_id, diff_name)
+                file_hash = await run_io(get_file_hash, cached_osu_path)
+            # a cache miss copies osu_file, so the chart parsed during the scan is exactly what gets analyzed
+            parsed_is_current = beatmap is not None and not osu_cache_hit
+
+            if osu_cache_hit:
+                cache_events.inc(cache="osu", result="hit")
+                print(f"Using cached .osu file: {os.path.basename(cached_osu_path)}")
             else:
-                # Convert and cache the SM file
-                sm_filename = f"{os.path.basename(osu_file)}.sm"
-                sm_path = os.path.join(temp_dir, sm_filename)
-                conversion_result = convert_osu_to_stepmania(cached_osu_path, sm_path)
-
-                if not conversion_result['success']:
-                    raise Exception(f"Conversion failed: {conversion_result.get('error', 'Unknown error')}")
+                cache_events.inc(cache="osu", result="miss")
+                print(f"No cached files found, processing fresh")
+
+        # same .osu content at the same rate was already analyzed (here or by an import)
+        with stage_timer("result_cache"):
+            stored = await run_io(result_store.get, file_hash, rate)
+        if stored:
+            cache_events.inc(cache="result", result="hit")
+            if stored['source'] == "upload" and source != "upload":
+                # the same bytes were uploaded before this chart was downloaded, the content is the real chart
+                # so the result holds, it just takes over the row with its set id
+                stored = analysis_row(file_hash, rate, metadata, stored, stored['analyzed_at'], source=source,
+                                      beatmap_id=stored_beatmap_id, fingerprint=stored['fingerprint'])
+                await run_io_shielded(result_store.put, stored)
+            return analysis_from_row(beatmap_id, stored, metadata)
+        cache_events.inc(cache="result", result="miss")
+
+        # another worker (or request) may be on the same chart right now, only one of them does the work
+        # and the rest pick its result up from the store once the lock is free
+        async with chart_locks.hold(f"{file_hash}_{rate_key(rate)}"):
+            stored = await run_io(result_store.get, file_hash, rate)
+            if stored:
+                cache_events.inc(cache="result", result="shared")
+                return analysis_from_row(beatmap_id, stored, metadata)
+
+            # same notes already analyzed under another file (reupload, copied difficulty, re-ranked set)
+            with stage_timer("fingerprint"):
+                if parsed_is_current:
+                    fingerprint = await run_io(beatmap.fingerprint)
+                else:
+                    # a known chart at a new rate: the fingerprint is on its other rows, only parse if it isn't
+                    fingerprint = await run_io(result_store.fingerprint_for, file_hash)
+                    if fingerprint is None:
+                        fingerprint = await run_cpu(osu_fingerprint, cached_osu_path)
+                duplicate = await run_io(result_store.find_by_fingerprint, fingerprint, rate)
+            if duplicate:
+                cache_events.inc(cache="fingerprint", result="hit")
+                print(f"Same chart as {duplicate['beatmap_id']} [{duplicate['difficulty_name']}], reusing its result")
+                row = analysis_row(file_hash, rate, metadata, duplicate, duplicate['analyzed_at'], source="dedupe",
+                                   beatmap_id=stored_beatmap_id, fingerprint=fingerprint)
+                await run_io_shielded(result_store.put, row)
+                return analysis_from_row(beatmap_id, row, metadata)
+            cache_events.inc(cache="fingerprint", result="miss")
+
+            # parsed calc input from an earlier run, skips .sm conversion and parsing
+            with stage_timer("notes_cache"):
+                note_data = await run_io(note_cache.get, file_hash)
+
+            if note_data is not None:
+                cache_events.inc(cache="notes", result="hit")
+            else:
+                cache_events.inc(cache="notes", result="miss")
+                with stage_timer("sm_cache"):
+                    sm_path = await run_io(get_cached_sm_path, beatmap_id, diff_name, file_hash)
 
-                # Cache the converted SM file
-                sm_path = cache_sm_file(sm_path, beatmap_id, diff_name, file_hash)
-        else:
-            # No cached files, do full process and cache
-            print(f"No cached files found, processing fresh")
+                if sm_path:
+                    cache_events.inc(cache="sm", result="hit")
+                    print(f"Using cached .sm file: {os.path.basename(sm_path)}")
+                else:
+                    cache_events.inc(cache="sm", result="miss")
+                    # Convert and cache the SM file
+                    sm_filename = f"{os.path.basename(osu_file)}.sm"
+                    sm_path = os.path.join(temp_dir, sm_filename)
+                    with stage_timer("convert"):
+                        if parsed_is_current:
+                            conversion_result = await run_cpu(convert_beatmap_to_stepmania, beatmap, sm_path)
+                        else:
+                            conversion_result = await run_cpu(convert_osu_to_stepmania, cached_osu_path, sm_path)
 
-            # Cache the .osu file first
-            cached_osu_path = cache_osu_file(osu_file, beatmap_id, diff_name)
-            file_hash = get_file_hash(cached_osu_path)
+                    if not conversion_result['success']:
+                        raise Exception(f"Conversion failed: {conversion_result.get('error', 'Unknown error')}")
 
-            # Convert to SM
-            sm_filename = f"{os.path.basename(osu_file)}.sm"
-            sm_path = os.path.join(temp_dir, sm_filename)
-            conversion_result = convert_osu_to_stepmania(osu_file, sm_path)
+                    with stage_timer("sm_cache"):
+                        sm_path = await run_io_to_completion(cache_sm_file, sm_path, beatmap_id, diff_name, file_hash)
 
-            if not conversion_result['success']:
-                raise Exception(f"Conversion failed: {conversion_result.get('error', 'Unknown error')}")
+                # Parse SM file
+                with stage_timer("parse"):
+                    note_data = await run_cpu(parse_sm_notes, sm_path)
 
-            # Cache the SM file
-            sm_path = cache_sm_file(sm_path, beatmap_id, diff_name, file_hash)
+                if not len(note_data):
+                    raise Exception("No note data found in converted SM file")
 
-        # Parse SM file
-        note_data = parse_sm_file(sm_path)
+                with stage_timer("notes_cache"):
+                    await run_io_shielded(note_cache.put, file_hash, note_data, metadata.get('key_count', 4))
 
-        if not note_data:
-            raise Exception("No note data found in converted SM file")
+            # Use SSR calculation with the specified rate
+            with inflight.track(kind="calc"), stage_timer("calc"):
+                difficulty_data = await run_calc(minacalc_instance.calculate_ssr, note_data, rate, DEFAULT_SCORE_GOAL)
 
-        # Use SSR calculation with the specified rate
-        difficulty_data = minacalc_instance.calculate_ssr(note_data, music_rate=rate, score_goal=0.93)
+            analyzed_at = datetime.now().isoformat()
+            await run_io_shielded(result_store.put, analysis_row(file_hash, rate, metadata, difficulty_data, analyzed_at, source=source,
+                                                                 beatmap_id=stored_beatmap_id, fingerprint=fingerprint))
 
         return DifficultyAnalysis(
             beatmap_id=beatmap_id,
@@ -613,7 +1278,8 @@ async def process_single_difficulty(beatmap_id: int, osu_file: str, temp_dir: st
             star_rating=metadata.get('star_rating', 0.0),
             rate=rate,
             success=True,
-            analyzed_at=datetime.now().isoformat()
+            analyzed_at=analyzed_at,
+            fingerprint=fingerprint
         )
 
     except Exception as e:
@@ -640,6 +1306,245 @@ async def process_single_difficulty(beatmap_id: int, osu_file: str, temp_dir: st
             analyzed_at=datetime.now().isoformat()
         )
 
+def require_admin(http_request: Request):
+    if not request_profiler.is_admin(http_request.headers):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.get("/admin/profiling")
+async def get_profiling(http_request: Request):
+    require_admin(http_request)
+    return request_profiler.status()
+
+@app.post("/admin/profiling")
+async def configure_profiling(config: ProfilingConfig, http_request: Request):
+    require_admin(http_request)
+    try:
+        request_profiler.configure(config.enabled, config.sample_rate, config.mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return request_profiler.status()
+
+@app.get("/admin/profiles")
+async def list_profiles(http_request: Request):
+    require_admin(http_request)
+    return await run_io(request_profiler.list_profiles)
+
+@app.get("/admin/profiles/{profile_id}")
+async def download_profile(profile_id: str, http_request: Request):
+    require_admin(http_request)
+    path = await run_io(request_profiler.profile_path, profile_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=os.path.basename(path), media_type="application/octet-stream")
+
+import_progress: Optional[ImportProgress] = None
+# one import at a time across all workers, they'd share the checkpoint file
+IMPORT_LOCK = "import"
+IMPORT_CANCEL_POLL = 1.0
+
+@app.post("/admin/import")
+async def start_import(request: ImportRequest, http_request: Request):
+    #bulk offline import of a local folder, runs in the background with its own process pool
+    global import_progress
+    require_admin(http_request)
+
+    if not os.path.isdir(request.path):
+        raise HTTPException(status_code=400, detail="path must be a directory on the server")
+
+    rates = request.rates or [1.0]
+    if any(rate <= 0 or rate > 3.0 for rate in rates):
+        raise HTTPException(status_code=400, detail="Rate must be between 0 and 3.0")
+
+    import_lock = chart_locks.acquire_nowait(IMPORT_LOCK)
+    if import_lock is None:
+        raise HTTPException(status_code=409, detail="An import is already running")
+
+    checkpoint_path = f"{RESULTS_DB}.import-{hashlib.sha256(os.path.abspath(request.path).encode()).hexdigest()[:12]}.jsonl"
+    import_progress = ImportProgress()
+    progress = import_progress
+    finished = threading.Event()
+
+    def watch_cancel():
+        # DELETE /admin/import may have landed on another worker
+        while not finished.wait(IMPORT_CANCEL_POLL):
+            if chart_locks.cancel_requested(IMPORT_LOCK):
+                progress.cancel_event.set()
+                return
+
+    def run():
+        try:
+            run_import(request.path, ResultStore(RESULTS_DB), checkpoint_path, rates, request.workers or 0, progress=progress)
+        except Exception as e:
+            print(f"❌ Import failed: {e}")
+        finally:
+            finished.set()
+            chart_locks.release(IMPORT_LOCK, import_lock)
+
+    threading.Thread(target=watch_cancel, name="import-cancel", daemon=True).start()
+    threading.Thread(target=run, name="import", daemon=True).start()
+    return {"started": True, "checkpoint": checkpoint_path}
+
+def import_elsewhere() -> bool:
+    #running, but started by another worker (progress lives in that worker)
+    return not (import_progress and import_progress.running) and chart_locks.is_held(IMPORT_LOCK)
+
+@app.get("/admin/import")
+async def import_status(http_request: Request):
+    require_admin(http_request)
+    if import_elsewhere():
+        return {"running": True, "detail": "started by another worker, progress is only available there"}
+    return import_progress.snapshot() if import_progress else {"running": False}
+
+@app.delete("/admin/import")
+async def cancel_import(http_request: Request):
+    require_admin(http_request)
+    if import_progress and import_progress.running:
+        import_progress.cancel_event.set()
+    elif import_elsewhere():
+        await run_io(chart_locks.request_cancel, IMPORT_LOCK)
+    else:
+        raise HTTPException(status_code=404, detail="No import running")
+    return {"cancelling": True}
+
+@app.get("/admin/export")
+async def export_dataset(http_request: Request, dataset: str = "analyses", format: Optional[str] = None,
+                         rate: Optional[float] = None, key_count: Optional[int] = None, score_goal: Optional[float] = None,
+                         since: Optional[str] = None, until: Optional[str] = None):
+    #columnar dump of stored analyses or saved user scores, see export.py. since inclusive, until exclusive (iso)
+    require_admin(http_request)
+    if dataset not in ("analyses", "scores"):
+        raise HTTPException(status_code=400, detail="dataset must be analyses or scores")
+    fmt = format or default_format()
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {list(FORMATS)}")
+    if fmt == "parquet" and default_format() != "parquet":
+        raise HTTPException(status_code=400, detail="parquet export needs pyarrow on the server, use format=npz")
+    for value in (since, until):
+        if value:
+            try:
+                datetime.fromisoformat(value.replace("Z", "+00:00"))
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"{value} is not an iso date")
+
+    export_dir = tempfile.mkdtemp(prefix="export-")
+    filename = f"{dataset}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    path = os.path.join(export_dir, filename)
+    try:
+        with stage_timer("export"):
+            if dataset == "analyses":
+                rows = await run_io(export_analyses, result_store, path, fmt, rate, key_count, score_goal, since, until)
+            else:
+                rows = await run_io(export_scores, USER_SCORES_DIR, path, fmt, rate, key_count, since, until)
+    except Exception as e:
+        shutil.rmtree(export_dir, ignore_errors=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return FileResponse(path, filename=filename, media_type="application/octet-stream",
+                        headers={"X-Export-Rows": str(rows)},
+                        background=BackgroundTask(shutil.rmtree, export_dir, ignore_errors=True))
+
+@app.get("/search", response_model=SearchResponse)
+async def search_analyses(http_request: Request, key_count: Optional[int] = None, rate: Optional[float] = None,
+                          sort: str = "overall", order: str = "desc", limit: int = 50, offset: int = 0,
+                          include_uploads: bool = False):
+    #everything ever analyzed (or imported), ranges as <column>_min / <column>_max. uploads only on request
+    #e.g. /search?key_count=4&rate=1.1&chordjack_min=24&chordjack_max=26&sort=chordjack
+    ranges = {}
+    for column in RANGE_COLUMNS:
+        try:
+            low = http_request.query_params.get(f"{column}_min")
+            high = http_request.query_params.get(f"{column}_max")
+            if low is not None or high is not None:
+                ranges[column] = (float(low) if low is not None else None, float(high) if high is not None else None)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"{column}_min / {column}_max must be numbers")
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    try:
+        rows, total = await run_io(result_store.search, ranges, key_count, rate, DEFAULT_SCORE_GOAL,
+                                   sort, order.lower() != "asc", limit, offset, include_uploads)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return SearchResponse(
+        results=[analysis_from_row(row['beatmap_id'] or 0, row, {}) for row in rows],
+        total=total,
+        limit=limit,
+        offset=offset
+    )
+
+@app.get("/similar", response_model=SimilarResponse)
+async def similar_charts(beatmap_id: int, difficulty_name: str, rate: float = 1.0, k: int = 10,
+                         key_count: Optional[int] = None, candidate_rate: Optional[float] = None):
+    #charts with the closest skillset vector to one that was already analyzed
+    #key_count / candidate_rate restrict the candidates, both default to anything
+    query_row = await run_io(result_store.find, beatmap_id, difficulty_name, rate)
+    if not query_row:
+        raise HTTPException(status_code=404, detail="Chart not analyzed at this rate yet, run /analyze first")
+
+    k = max(1, min(k, 100))
+    vector = [query_row[name] or 0.0 for name in SKILLSETS]
+    neighbours = await run_io(similarity_index.nearest, vector, k, key_count, candidate_rate, query_row['file_hash'],
+                              query_row['fingerprint'])
+
+    results = []
+    for distance, file_hash, neighbour_rate in neighbours:
+        row = await run_io(result_store.get, file_hash, neighbour_rate)
+        if row:
+            results.append(SimilarChart(analysis=analysis_from_row(row['beatmap_id'] or 0, row, {}), distance=round(distance, 4)))
+
+    return SimilarResponse(query=analysis_from_row(beatmap_id, query_row, {}), results=results)
+
+@app.get("/timeline", response_model=TimelineResponse)
+async def difficulty_timeline(http_request: Request, beatmap_id: int, difficulty_name: str, rate: float = 1.0,
+                              window: float = 10.0, hop: float = 2.0):
+    #skillset difficulty over sliding windows of an analyzed chart, stored next to its result
+    if not minacalc_instance:
+        raise HTTPException(status_code=500, detail="MinaCalc not initialized")
+    if rate <= 0 or rate > 3.0:
+        raise HTTPException(status_code=400, detail="Rate must be between 0 and 3.0")
+    if not 2.0 <= window <= 60.0 or not 0.5 <= hop <= window:
+        raise HTTPException(status_code=400, detail="window must be 2-60s and hop between 0.5s and the window")
+
+    base = await run_io(result_store.find, beatmap_id, difficulty_name, rate)
+    if not base:
+        raise HTTPException(status_code=404, detail="Chart not analyzed at this rate yet, run /analyze first")
+
+    timeline = await run_io(result_store.get_timeline, base['file_hash'], rate, window, hop)
+    cached = timeline is not None
+    if not cached:
+        source = await run_io(local_chart_source, base)
+        if not source:
+            raise HTTPException(status_code=404, detail="Chart file is not cached locally, run /analyze first")
+        admit("cpu", "calc")
+        owner = owner_key(http_request.client.host if http_request.client else "timeline")
+        try:
+            with job_scope(INTERACTIVE, owner), job_cost(base['hit_objects']):
+                note_data = await load_chart_notes(base, source)
+                with inflight.track(kind="calc"), stage_timer("timeline"):
+                    timeline = await run_calc(minacalc_instance.calculate_timeline, note_data, window, hop, rate, DEFAULT_SCORE_GOAL)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        await run_io(result_store.put_timeline, base['file_hash'], rate, window, hop, timeline, datetime.now().isoformat())
+
+    return TimelineResponse(
+        beatmap_id=beatmap_id,
+        difficulty_name=base['difficulty_name'],
+        rate=rate,
+        window=window,
+        hop=hop,
+        windows=timeline,
+        cached=cached
+    )
+
+@app.get("/traces/{trace_id}")
+async def download_trace(trace_id: str, http_request: Request):
+    require_admin(http_request)
+    path = trace_store.path_for(trace_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return FileResponse(path, filename=f"{trace_id}.json", media_type="application/json")
+
 @app.get("/health")
 async def health_check():
     #health check
@@ -658,8 +1563,28 @@ async def health_check():
             status["minacalc_error"] = str(e)
             status["status"] = "unhealthy"
 
+    status["caches"] = [cache.stats() for cache in (user_id_cache, beatmapset_info_cache)]
+    status["similarity_index"] = similarity_index.stats()
+    status["event_loop"] = loop_lag_monitor.stats()
+    status["admission"] = admission.stats()
+    status["worker"] = chart_locks.stats()
+
     return status
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=9731)
+
+    parser = argparse.ArgumentParser(description="Mania Difficulty Analysis API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=9731)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")),
+                        help="uvicorn worker processes, each gets its own MinaCalc handle and executors")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # workers re-import main, the env var is how they learn how many siblings share the cpus
+        os.environ["WEB_CONCURRENCY"] = str(args.workers)
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
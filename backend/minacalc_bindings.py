@@ -1,10 +1,14 @@
 import ctypes
 import os
 import re
-from typing import List, Tuple, Optional
+from typing import Iterable, List, Tuple, Optional, Union
 from pathlib import Path
 import traceback
 
+import numpy as np
+
+from compressed_cache import open_text
+
 # c structure definition
 class NoteInfo(ctypes.Structure):
     _fields_ = [
@@ -12,6 +16,26 @@ class NoteInfo(ctypes.Structure):
         ("rowTime", ctypes.c_float)
     ]
 
+# same memory layout as NoteInfo, lets a numpy array go straight to the calc
+NOTE_DTYPE = np.dtype([("notes", "<i4"), ("rowTime", "<f4")], align=True)
+assert NOTE_DTYPE.itemsize == ctypes.sizeof(NoteInfo)
+
+SKILLSET_NAMES = ['overall', 'stream', 'jumpstream', 'handstream', 'stamina', 'jackspeed', 'chordjack', 'technical']
+
+def marshal_notes(note_data: Union[List[Tuple[int, float]], np.ndarray]) -> np.ndarray:
+    #drops negative note masks and clamps negative times, like the per call loop used to
+    if isinstance(note_data, np.ndarray) and note_data.dtype == NOTE_DTYPE:
+        return note_data
+    if not len(note_data):
+        return np.empty(0, dtype=NOTE_DTYPE)
+
+    raw = np.asarray(note_data, dtype=np.float64)
+    raw = raw[raw[:, 0] >= 0]
+    notes = np.empty(len(raw), dtype=NOTE_DTYPE)
+    notes["notes"] = raw[:, 0]
+    notes["rowTime"] = np.maximum(raw[:, 1], 0.0)
+    return np.ascontiguousarray(notes)
+
 class Ssr(ctypes.Structure):
     _fields_ = [
         ("overall", ctypes.c_float),
@@ -113,43 +137,58 @@ class MinaCalc:
 
     def calculate_ssr(self, note_data: List[Tuple[int, float]], music_rate: float = 1.0, score_goal: float = 0.93) -> dict:
         #would make score_goal 1.0 but i dont trust myself
-        if not note_data:
-            return {k: 0.0 for k in ['overall', 'stream', 'jumpstream', 'handstream',
-                                     'stamina', 'jackspeed', 'chordjack', 'technical']}
-
-        valid_note_data = []
-        for i, (notes, row_time) in enumerate(note_data):
-            if notes < 0:
-                print(f"Warning: Invalid notes value at index {i}: notes={notes}, skipping")
-                continue
-            if row_time < 0:
-                print(f"Warning: Negative row_time at index {i}: row_time={row_time}, adjusting to 0.0")
-                row_time = max(0.0, row_time)
-            valid_note_data.append((notes, row_time))
-
-        if not valid_note_data:
-            print("Warning: No valid note data after filtering")
-            return {k: 0.0 for k in ['overall', 'stream', 'jumpstream', 'handstream',
-                                     'stamina', 'jackspeed', 'chordjack', 'technical']}
-
-        note_array = (NoteInfo * len(valid_note_data))()
-        for i, (notes, row_time) in enumerate(valid_note_data):
-            note_array[i].notes = notes
-            note_array[i].rowTime = ctypes.c_float(row_time)
-
-        result = self.lib.calc_ssr(self.calc_handle, note_array, len(valid_note_data),
-                                  ctypes.c_float(music_rate), ctypes.c_float(score_goal))
-
-        return {
-            'overall': result.overall,
-            'stream': result.stream,
-            'jumpstream': result.jumpstream,
-            'handstream': result.handstream,
-            'stamina': result.stamina,
-            'jackspeed': result.jackspeed,
-            'chordjack': result.chordjack,
-            'technical': result.technical
-        }
+        return self.calculate_ssr_batch(note_data, [(music_rate, score_goal)])[0]
+
+    def calculate_ssr_batch(self, note_data: Union[List[Tuple[int, float]], np.ndarray],
+                            pairs: Iterable[Tuple[float, float]]) -> List[dict]:
+        #one chart, many (rate, score_goal) pairs. the note buffer is marshalled once and reused for every call
+        pairs = list(pairs)
+        notes = marshal_notes(note_data)
+        if not len(notes):
+            return [{k: 0.0 for k in SKILLSET_NAMES} for _ in pairs]
+
+        pointer = notes.ctypes.data_as(ctypes.POINTER(NoteInfo))
+        computed = {}
+        results = []
+        for music_rate, score_goal in pairs:
+            key = (round(float(music_rate), 3), round(float(score_goal), 3))
+            if key not in computed:
+                result = self.lib.calc_ssr(self.calc_handle, pointer, len(notes),
+                                           ctypes.c_float(music_rate), ctypes.c_float(score_goal))
+                computed[key] = {name: getattr(result, name) for name in SKILLSET_NAMES}
+            results.append(dict(computed[key]))
+        return results
+
+    def calculate_timeline(self, note_data: Union[List[Tuple[int, float]], np.ndarray], window: float = 10.0,
+                           hop: float = 2.0, music_rate: float = 1.0, score_goal: float = 0.93) -> List[dict]:
+        #ssr over sliding windows. the chart is marshalled once, each window is copied into one reused buffer
+        #and shifted to start at 0 so the calc doesn't see a long empty lead-in. still one native call per window,
+        #calc_ssr has no way to evaluate several ranges in one go
+        notes = marshal_notes(note_data)
+        if not len(notes):
+            return []
+
+        times = notes["rowTime"]
+        starts = np.arange(float(times[0]), max(float(times[-1]) - window, float(times[0])) + hop, hop)
+        lows = np.searchsorted(times, starts, side="left")
+        highs = np.searchsorted(times, starts + window, side="left")
+
+        buffer = np.empty(int((highs - lows).max()), dtype=NOTE_DTYPE)
+        pointer = buffer.ctypes.data_as(ctypes.POINTER(NoteInfo))
+
+        timeline = []
+        for start, low, high in zip(starts, lows, highs):
+            count = int(high - low)
+            entry = {"start": round(float(start), 3), "end": round(float(start + window), 3), "notes": count}
+            if count == 0:
+                entry.update({k: 0.0 for k in SKILLSET_NAMES})
+            else:
+                buffer[:count] = notes[low:high]
+                buffer["rowTime"][:count] -= start
+                result = self.lib.calc_ssr(self.calc_handle, pointer, count, ctypes.c_float(music_rate), ctypes.c_float(score_goal))
+                entry.update({name: getattr(result, name) for name in SKILLSET_NAMES})
+            timeline.append(entry)
+        return timeline
 
     def __del__(self):
         if hasattr(self, 'calc_handle') and self.calc_handle:
@@ -159,7 +198,7 @@ def parse_sm_file(sm_file_path: str) -> List[Tuple[int, float]]:
     note_data = []
 
     try:
-        with open(sm_file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        with open_text(sm_file_path) as f:
             content = f.read()
 
         sections = re.split(r'#([A-Z]+):', content)
@@ -337,6 +376,10 @@ def parse_sm_file(sm_file_path: str) -> List[Tuple[int, float]]:
         traceback.print_exc()
         return []
 
+def parse_sm_notes(sm_file_path: str) -> np.ndarray:
+    #parse_sm_file straight into the calc's input layout
+    return marshal_notes(parse_sm_file(sm_file_path))
+
 def get_bpm_at_beat(beat: float, sorted_bpms: List[Tuple[float, float]]) -> float:
     current_bpm = sorted_bpms[0][1]
     for bpm_beat, bpm_value in sorted_bpms:
@@ -0,0 +1,73 @@
+import os
+import struct
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+from minacalc_bindings import NOTE_DTYPE
+
+# final calc input per chart, so a warm hit skips sm conversion and parsing entirely
+# <file_hash>.notes = 32 byte header + count fixed width NoteInfo records (int32 notes, float32 rowTime)
+# reads are memory mapped, the array goes to the calc as is
+MAGIC = b"MNTS"
+# bump when the converter / sm parser change what ends up in the array, old files then read as misses
+FORMAT_VERSION = 1
+
+# magic, version, key count, note count, file hash (ascii, zero padded)
+HEADER = struct.Struct("<4sHHI16s")
+HEADER_SIZE = 32
+
+
+class NoteCache:
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def path_for(self, file_hash: str) -> str:
+        return os.path.join(self.cache_dir, f"{file_hash}.notes")
+
+    def get(self, file_hash: str) -> Optional[np.ndarray]:
+        path = self.path_for(file_hash)
+        try:
+            with open(path, "rb") as f:
+                header = f.read(HEADER_SIZE)
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+
+        if len(header) < HEADER_SIZE:
+            return None
+        magic, version, _, count, stored_hash = HEADER.unpack_from(header)
+        if magic != MAGIC or version != FORMAT_VERSION or stored_hash.rstrip(b"\0").decode("ascii", "ignore") != file_hash:
+            return None
+        if size != HEADER_SIZE + count * NOTE_DTYPE.itemsize or count == 0:
+            return None
+
+        return np.memmap(path, dtype=NOTE_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+    def key_count(self, file_hash: str) -> Optional[int]:
+        try:
+            with open(self.path_for(file_hash), "rb") as f:
+                return HEADER.unpack_from(f.read(HEADER_SIZE))[2]
+        except (OSError, struct.error):
+            return None
+
+    def put(self, file_hash: str, notes: np.ndarray, key_count: int) -> str:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        notes = np.ascontiguousarray(notes, dtype=NOTE_DTYPE)
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, key_count, len(notes), file_hash.encode("ascii")[:16])
+
+        # temp file + rename, a reader never maps a half written file
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(header.ljust(HEADER_SIZE, b"\0"))
+                f.write(notes.tobytes())
+            os.replace(temp_path, self.path_for(file_hash))
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        return self.path_for(file_hash)
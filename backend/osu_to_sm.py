@@ -1,9 +1,23 @@
 import os
 import math
-from typing import List, Dict, Optional, Tuple
+import hashlib
+from typing import Iterable, List, Dict, Optional, Tuple
 from dataclasses import dataclass
 from collections import defaultdict
 
+from compressed_cache import open_text
+
+
+# bump when fingerprint() changes what it hashes
+FINGERPRINT_VERSION = 1
+
+
+def x_to_column(x: int, key_count: int) -> int:
+    x_normalized = max(0, min(511, x)) / 512.0
+    column = int(x_normalized * key_count)
+
+    return max(0, min(key_count - 1, column))
+
 
 @dataclass
 class TimingPoint:
@@ -39,24 +53,32 @@ class Metadata:
     version: str = "Unknown"
     audio_filename: str = "audio.mp3"
     preview_time: int = -1
+    beatmapset_id: int = -1
 
 
 class OsuBeatmap:
     def __init__(self):
         self.metadata = Metadata()
         self.circle_size: float = 4.0
+        self.overall_difficulty: float = 0.0
         self.timing_points: List[TimingPoint] = []
         self.hit_objects: List[HitObject] = []
         self.mode: int = 0
 
     @classmethod
-    def from_file(cls, filepath: str) -> 'OsuBeatmap':
-        beatmap = cls()
+    def from_file(cls, filepath: str, mania_only: bool = False) -> 'OsuBeatmap':
+        # cached charts may be stored compressed
+        with open_text(filepath) as f:
+            return cls.from_lines(f, mania_only)
 
-        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read()
+    @classmethod
+    def from_text(cls, content: str, mania_only: bool = False) -> 'OsuBeatmap':
+        return cls.from_lines(content.splitlines(), mania_only)
 
-        lines = content.splitlines()
+    @classmethod
+    def from_lines(cls, lines: Iterable[str], mania_only: bool = False) -> 'OsuBeatmap':
+        #mania_only stops right after [General] for anything that isn't mania, nothing past it is read
+        beatmap = cls()
         current_section = None
 
         for line in lines:
@@ -65,6 +87,8 @@ class OsuBeatmap:
                 continue
 
             if line.startswith('[') and line.endswith(']'):
+                if mania_only and current_section == 'general' and not beatmap.is_mania:
+                    return beatmap
                 current_section = line[1:-1].lower()
                 continue
 
@@ -81,6 +105,18 @@ class OsuBeatmap:
 
         return beatmap
 
+    def metadata_dict(self) -> Dict:
+        #the metadata dict the api / result store side works with
+        return {
+            'title': self.metadata.title,
+            'artist': self.metadata.artist,
+            'creator': self.metadata.creator,
+            'version': self.metadata.version,
+            'key_count': int(self.circle_size),
+            'hit_objects': len(self.hit_objects),
+            'star_rating': self.overall_difficulty,
+        }
+
     def _parse_general(self, line: str):
         if ':' not in line:
             return
@@ -114,6 +150,11 @@ class OsuBeatmap:
             self.metadata.creator = value
         elif key == 'Version':
             self.metadata.version = value
+        elif key == 'BeatmapSetID':
+            try:
+                self.metadata.beatmapset_id = int(value)
+            except ValueError:
+                pass
 
     def _parse_difficulty(self, line: str):
         if ':' not in line:
@@ -126,6 +167,11 @@ class OsuBeatmap:
                 self.circle_size = float(value)
             except ValueError:
                 pass
+        elif key == 'OverallDifficulty':
+            try:
+                self.overall_difficulty = float(value)
+            except ValueError:
+                pass
 
     def _parse_timing_point(self, line: str):
         parts = line.split(',')
@@ -195,6 +241,25 @@ class OsuBeatmap:
         except (ValueError, IndexError):
             pass
 
+    def fingerprint(self) -> str:
+        #identity of the playable chart: key count, bpm sections and notes (start, column, ln end), all relative
+        #to the first note so an offset shifted reupload still matches. metadata and filenames never count
+        key_count = self.key_count
+        origin = min((obj.time for obj in self.hit_objects), default=0.0)
+        digest = hashlib.sha256(f"{FINGERPRINT_VERSION}:{key_count}:".encode())
+
+        for point in sorted((tp for tp in self.timing_points if tp.uninherited and tp.beat_length > 0), key=lambda tp: tp.time):
+            digest.update(f"t{round(point.time - origin)},{point.beat_length:.4f};".encode())
+
+        notes = sorted(
+            (round(obj.time - origin), x_to_column(obj.x, key_count),
+             round(obj.end_time - origin) if obj.is_hold and obj.end_time else -1)
+            for obj in self.hit_objects
+        )
+        for start, column, end in notes:
+            digest.update(f"{start},{column},{end};".encode())
+        return digest.hexdigest()[:16]
+
     @property
     def is_mania(self) -> bool:
         return self.mode == 3
@@ -420,10 +485,7 @@ class StepManiaConverter:
         return measure * self.quantization + row_in_measure
 
     def _x_to_column(self, x: int, key_count: int) -> int:
-        x_normalized = max(0, min(511, x)) / 512.0
-        column = int(x_normalized * key_count)
-
-        return max(0, min(key_count - 1, column))
+        return x_to_column(x, key_count)
 
 
 def convert_osu_to_stepmania(osu_file: str, sm_file: str, quantization: int = 192) -> Dict:
@@ -433,10 +495,21 @@ def convert_osu_to_stepmania(osu_file: str, sm_file: str, quantization: int = 19
 
     try:
         beatmap = OsuBeatmap.from_file(osu_file)
-        converter = StepManiaConverter(quantization=quantization)
-        result = converter.convert(beatmap, sm_file)
+    except Exception as e:
+        return {'success': False, 'error': f'Conversion error: {str(e)}'}
+
+    return convert_beatmap_to_stepmania(beatmap, sm_file, quantization)
+
+
+def osu_fingerprint(osu_file: str) -> str:
+    return OsuBeatmap.from_file(osu_file).fingerprint()
 
-        return result
+
+def convert_beatmap_to_stepmania(beatmap: OsuBeatmap, sm_file: str, quantization: int = 192) -> Dict:
+    #for callers that already parsed the .osu
+    try:
+        converter = StepManiaConverter(quantization=quantization)
+        return converter.convert(beatmap, sm_file)
 
     except Exception as e:
         return {'success': False, 'error': f'Conversion error: {str(e)}'}
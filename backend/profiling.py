@@ -0,0 +1,178 @@
+import cProfile
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Mapping, Optional
+
+# opt-in request profiling, nothing here runs unless a request is picked for profiling
+#   cprofile - deterministic, event loop thread only (.prof, open with snakeviz / pstats)
+#   sampling - stack samples of every thread incl. executor workers (collapsed stacks, feed to flamegraph.pl / speedscope)
+PROFILE_MODES = ("cprofile", "sampling")
+
+
+class _StackSampler(threading.Thread):
+    def __init__(self, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class ProfileSession:
+    def __init__(self, profile_id: str, label: str, mode: str):
+        self.profile_id = profile_id
+        self.label = label
+        self.mode = mode
+        self.path: Optional[str] = None
+        self.duration = 0.0
+
+
+class RequestProfiler:
+    def __init__(self, profile_dir: str, admin_token: Optional[str] = None, max_profiles: int = 50):
+        self.profile_dir = profile_dir
+        self.admin_token = admin_token
+        self.max_profiles = max_profiles
+
+        # admin toggle, off by default
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.mode = "cprofile"
+        self.sampling_interval = 0.005
+
+        # cProfile can't nest, one profiled request at a time
+        self._active = threading.Lock()
+
+    def is_admin(self, headers: Mapping[str, str]) -> bool:
+        token = headers.get("x-admin-token")
+        if not self.admin_token or not token:
+            return False
+        return hmac.compare_digest(token, self.admin_token)
+
+    def should_profile(self, headers: Mapping[str, str]) -> bool:
+        if headers.get("x-profile") and self.is_admin(headers):
+            return True
+        return self.enabled and random.random() < self.sample_rate
+
+    def configure(self, enabled: Optional[bool] = None, sample_rate: Optional[float] = None, mode: Optional[str] = None):
+        if mode is not None:
+            if mode not in PROFILE_MODES:
+                raise ValueError(f"mode must be one of {PROFILE_MODES}")
+            self.mode = mode
+        if sample_rate is not None:
+            self.sample_rate = max(0.0, min(1.0, sample_rate))
+        if enabled is not None:
+            self.enabled = enabled
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "mode": self.mode,
+            "admin_configured": bool(self.admin_token),
+            "stored_profiles": len(self.list_profiles()),
+        }
+
+    @contextmanager
+    def profile(self, label: str, mode: Optional[str] = None):
+        #yields None when another request is already being profiled
+        if not self._active.acquire(blocking=False):
+            yield None
+            return
+
+        mode = mode or self.mode
+        session = ProfileSession(f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{label}-{uuid.uuid4().hex[:8]}", label, mode)
+        started = time.perf_counter()
+        profiler = sampler = None
+        try:
+            if mode == "sampling":
+                sampler = _StackSampler(self.sampling_interval)
+                sampler.start()
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+
+            yield session
+
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            if sampler is not None:
+                sampler.stop()
+            session.duration = time.perf_counter() - started
+
+            try:
+                session.path = self._save(session, profiler, sampler)
+                print(f"Saved {mode} profile {session.profile_id} ({session.duration:.2f}s)")
+            except Exception as e:
+                print(f"Failed to save profile {session.profile_id}: {e}")
+            finally:
+                self._active.release()
+
+    def _save(self, session: ProfileSession, profiler: Optional[cProfile.Profile], sampler: Optional[_StackSampler]) -> str:
+        os.makedirs(self.profile_dir, exist_ok=True)
+        if profiler is not None:
+            path = os.path.join(self.profile_dir, f"{session.profile_id}.prof")
+            profiler.dump_stats(path)
+        else:
+            path = os.path.join(self.profile_dir, f"{session.profile_id}.collapsed.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in sampler.samples.most_common():
+                    f.write(f"{stack} {count}\n")
+
+        self._prune()
+        return path
+
+    def _prune(self):
+        profiles = self.list_profiles()
+        for stale in profiles[self.max_profiles:]:
+            try:
+                os.remove(os.path.join(self.profile_dir, stale["filename"]))
+            except OSError:
+                pass
+
+    def list_profiles(self) -> List[Dict]:
+        if not os.path.isdir(self.profile_dir):
+            return []
+        profiles = []
+        for filename in os.listdir(self.profile_dir):
+            if not (filename.endswith(".prof") or filename.endswith(".collapsed.txt")):
+                continue
+            full_path = os.path.join(self.profile_dir, filename)
+            profiles.append({
+                "profile_id": filename.split(".")[0],
+                "filename": filename,
+                "size": os.path.getsize(full_path),
+                "created_at": datetime.fromtimestamp(os.path.getmtime(full_path)).isoformat(),
+            })
+        profiles.sort(key=lambda p: p["created_at"], reverse=True)
+        return profiles
+
+    def profile_path(self, profile_id: str) -> Optional[str]:
+        for profile in self.list_profiles():
+            if profile["profile_id"] == profile_id:
+                return os.path.join(self.profile_dir, profile["filename"])
+        return None
@@ -0,0 +1,59 @@
+from typing import Dict, List
+
+import numpy as np
+
+from result_store import SKILLSETS
+
+# player rating from per score SSRs, same idea as etterna's AggregateScores:
+# a skillset rating is the point where 2^(rating/10) outgrows the sum of 2/erfc(0.1 * (ssr - rating)) - 2,
+# found here with one vectorized bisection for all skillsets at once instead of the recursive grid search
+RATING_SKILLSETS = SKILLSETS[1:]
+
+# calc doesn't distinguish goals above this, keeps the number of distinct cached goals down too
+MAX_SCORE_GOAL = 0.965
+MIN_SCORE_GOAL = 0.5
+
+BISECT_STEPS = 24
+RATING_CEILING = 100.0
+
+
+def score_goal_for(accuracy: float) -> float:
+    #osu accuracy is a percentage
+    return round(min(MAX_SCORE_GOAL, max(MIN_SCORE_GOAL, accuracy / 100.0)), 3)
+
+def erfc(x: np.ndarray) -> np.ndarray:
+    #numerical recipes erfcc, fractional error < 1.2e-7, numpy has no erfc and scipy is optional
+    z = np.abs(x)
+    t = 1.0 / (1.0 + 0.5 * z)
+    poly = -z * z - 1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 + t * (-0.18628806 + t * (
+        0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (-0.82215223 + t * 0.17087277))))))))
+    result = t * np.exp(poly)
+    return np.where(x >= 0, result, 2.0 - result)
+
+def aggregate(ssrs: np.ndarray) -> np.ndarray:
+    #ssrs: (skillsets, scores), 0 for padding. returns one rating per row
+    ssrs = np.atleast_2d(np.asarray(ssrs, dtype=np.float64))
+    low = np.zeros(ssrs.shape[0])
+    high = np.full(ssrs.shape[0], RATING_CEILING)
+    if ssrs.shape[1] == 0:
+        return low
+
+    for _ in range(BISECT_STEPS):
+        mid = (low + high) / 2
+        with np.errstate(divide='ignore', over='ignore'):
+            contributions = np.maximum(0.0, 2.0 / erfc(0.1 * (ssrs - mid[:, None])) - 2.0)
+        done = np.power(2.0, 0.1 * mid) >= contributions.sum(axis=1)
+        high = np.where(done, mid, high)
+        low = np.where(done, low, mid)
+    return high
+
+def player_ratings(score_ssrs: List[Dict[str, float]]) -> Dict[str, float]:
+    #one dict of skillset -> ssr per score (best score per chart + rate), overall is the mean of the rest
+    if not score_ssrs:
+        return {name: 0.0 for name in SKILLSETS}
+
+    matrix = np.array([[score.get(name) or 0.0 for score in score_ssrs] for name in RATING_SKILLSETS], dtype=np.float64)
+    ratings = aggregate(matrix)
+    result = {name: round(float(value), 2) for name, value in zip(RATING_SKILLSETS, ratings)}
+    result['overall'] = round(float(ratings.mean()), 2)
+    return {name: result[name] for name in SKILLSETS}
@@ -0,0 +1,292 @@
+import json
+import sqlite3
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# persistent cache of analysis results, keyed by .osu content hash so renames/reuploads of the same file hit
+SKILLSETS = ['overall', 'stream', 'jumpstream', 'handstream', 'stamina', 'jackspeed', 'chordjack', 'technical']
+
+DEFAULT_SCORE_GOAL = 0.93
+
+COLUMNS = [
+    'file_hash', 'rate', 'score_goal', 'beatmap_id', 'title', 'artist', 'difficulty_name', 'creator',
+    'key_count', *SKILLSETS, 'hit_objects', 'star_rating', 'source', 'analyzed_at', 'fingerprint'
+]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS analyses (
+    file_hash TEXT NOT NULL,
+    rate REAL NOT NULL,
+    score_goal REAL NOT NULL,
+    beatmap_id INTEGER,
+    title TEXT,
+    artist TEXT,
+    difficulty_name TEXT,
+    creator TEXT,
+    key_count INTEGER,
+    {", ".join(f"{name} REAL" for name in SKILLSETS)},
+    hit_objects INTEGER,
+    star_rating REAL,
+    source TEXT,
+    analyzed_at TEXT,
+    fingerprint TEXT,
+    PRIMARY KEY (file_hash, rate, score_goal)
+)
+"""
+
+TIMELINE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS timelines (
+    file_hash TEXT NOT NULL,
+    rate REAL NOT NULL,
+    score_goal REAL NOT NULL,
+    window REAL NOT NULL,
+    hop REAL NOT NULL,
+    data TEXT NOT NULL,
+    computed_at TEXT,
+    PRIMARY KEY (file_hash, rate, score_goal, window, hop)
+)
+"""
+
+# searches almost always pin key count + rate and range over one skillset
+INDEXES = [
+    f"CREATE INDEX IF NOT EXISTS idx_analyses_{name} ON analyses (key_count, rate, {name})"
+    for name in SKILLSETS
+] + [
+    "CREATE INDEX IF NOT EXISTS idx_analyses_beatmap ON analyses (beatmap_id, difficulty_name)",
+    "CREATE INDEX IF NOT EXISTS idx_analyses_fingerprint ON analyses (fingerprint, rate, score_goal)",
+]
+
+RANGE_COLUMNS = [*SKILLSETS, 'hit_objects', 'star_rating']
+SORT_COLUMNS = [*RANGE_COLUMNS, 'rate', 'analyzed_at']
+MAX_PAGE_SIZE = 500
+
+
+def rate_key(rate: float) -> float:
+    # 1.1 and 1.1000000001 are the same rate
+    return round(float(rate), 3)
+
+
+class ResultStore:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connection() as conn:
+            # WAL lets every uvicorn worker (and the importer) read while one of them writes,
+            # the mode is stored in the db file so this sticks for all later connections
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(SCHEMA)
+            conn.execute(TIMELINE_SCHEMA)
+            # stores created before fingerprints existed
+            existing = {row['name'] for row in conn.execute("PRAGMA table_info(analyses)")}
+            if 'fingerprint' not in existing:
+                conn.execute("ALTER TABLE analyses ADD COLUMN fingerprint TEXT")
+            for index in INDEXES:
+                conn.execute(index)
+
+    def _connection(self) -> sqlite3.Connection:
+        #one connection per thread, sqlite connections don't like being shared
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            # a crash can lose the last commits but never corrupts the db, fine for a cache
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, file_hash: str, rate: float, score_goal: float = DEFAULT_SCORE_GOAL) -> Optional[Dict]:
+        row = self._connection().execute(
+            "SELECT * FROM analyses WHERE file_hash = ? AND rate = ? AND score_goal = ?",
+            (file_hash, rate_key(rate), rate_key(score_goal))
+        ).fetchone()
+        return dict(row) if row else None
+
+    def put(self, row: Dict):
+        self.put_many([row])
+
+    def put_many(self, rows: Iterable[Dict]):
+        values = []
+        for row in rows:
+            row = {**row, 'rate': rate_key(row['rate']), 'score_goal': rate_key(row.get('score_goal', DEFAULT_SCORE_GOAL))}
+            values.append(tuple(row.get(column) for column in COLUMNS))
+        if not values:
+            return
+
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        with self._connection() as conn:
+            conn.executemany(f"INSERT OR REPLACE INTO analyses ({', '.join(COLUMNS)}) VALUES ({placeholders})", values)
+
+    def find_by_fingerprint(self, fingerprint: str, rate: float, score_goal: float = DEFAULT_SCORE_GOAL) -> Optional[Dict]:
+        #same notes under another file (reupload, copied diff), any of them will do
+        row = self._connection().execute(
+            "SELECT * FROM analyses WHERE fingerprint = ? AND rate = ? AND score_goal = ? LIMIT 1",
+            (fingerprint, rate_key(rate), rate_key(score_goal))
+        ).fetchone()
+        return dict(row) if row else None
+
+    def fingerprint_for(self, file_hash: str) -> Optional[str]:
+        #fingerprint stored with this file at any rate / goal, spares a reparse of the .osu
+        row = self._connection().execute(
+            "SELECT fingerprint FROM analyses WHERE file_hash = ? AND fingerprint IS NOT NULL LIMIT 1", (file_hash,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def find(self, beatmap_id: int, difficulty_name: str, rate: float, score_goal: float = DEFAULT_SCORE_GOAL,
+             include_uploads: bool = False) -> Optional[Dict]:
+        #newest analysis of a difficulty, for callers that only know the set id + name.
+        #uploads are skipped by default, their set id comes from a file anyone can edit
+        uploads = "" if include_uploads else "AND source IS NOT 'upload' "
+        row = self._connection().execute(
+            "SELECT * FROM analyses WHERE beatmap_id = ? AND difficulty_name = ? AND rate = ? AND score_goal = ? "
+            f"{uploads}ORDER BY analyzed_at DESC LIMIT 1",
+            (beatmap_id, difficulty_name, rate_key(rate), rate_key(score_goal))
+        ).fetchone()
+        return dict(row) if row else None
+
+    def rows_since(self, rowid: int, score_goal: float = DEFAULT_SCORE_GOAL, include_uploads: bool = False) -> Iterator[Dict]:
+        #rowids only grow (INSERT OR REPLACE included), so this is an append log for incremental consumers.
+        #uploads are left out like in find / search, an upload taken over by a download comes back with a new rowid
+        uploads = "" if include_uploads else "AND source IS NOT 'upload' "
+        cursor = self._connection().execute(
+            f"SELECT rowid, file_hash, rate, key_count, fingerprint, {', '.join(SKILLSETS)} FROM analyses "
+            f"WHERE rowid > ? AND score_goal = ? {uploads}ORDER BY rowid",
+            (rowid, rate_key(score_goal))
+        )
+        for row in cursor:
+            yield dict(row)
+
+    def search(self, ranges: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None,
+               key_count: Optional[int] = None, rate: Optional[float] = None, score_goal: float = DEFAULT_SCORE_GOAL,
+               sort_by: str = 'overall', descending: bool = True, limit: int = 50, offset: int = 0,
+               include_uploads: bool = False) -> Tuple[List[Dict], int]:
+        #ranges: column -> (min, max), either end can be None. returns (page, total matches)
+        if sort_by not in SORT_COLUMNS:
+            raise ValueError(f"sort_by must be one of {SORT_COLUMNS}")
+
+        clauses = ["score_goal = ?"]
+        params: List = [rate_key(score_goal)]
+        if not include_uploads:
+            clauses.append("source IS NOT 'upload'")
+        if key_count is not None:
+            clauses.append("key_count = ?")
+            params.append(key_count)
+        if rate is not None:
+            clauses.append("rate = ?")
+            params.append(rate_key(rate))
+        for column, (low, high) in (ranges or {}).items():
+            # column names end up in the sql, only ever take them from the whitelist
+            if column not in RANGE_COLUMNS:
+                raise ValueError(f"can't filter on {column}, use one of {RANGE_COLUMNS}")
+            if low is not None:
+                clauses.append(f"{column} >= ?")
+                params.append(low)
+            if high is not None:
+                clauses.append(f"{column} <= ?")
+                params.append(high)
+
+        where = " AND ".join(clauses)
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        conn = self._connection()
+        total = conn.execute(f"SELECT COUNT(*) FROM analyses WHERE {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT * FROM analyses WHERE {where} ORDER BY {sort_by} {'DESC' if descending else 'ASC'}, file_hash LIMIT ? OFFSET ?",
+            [*params, limit, max(0, offset)]
+        ).fetchall()
+        return [dict(row) for row in rows], total
+
+    def export_batches(self, rate: Optional[float] = None, key_count: Optional[int] = None, score_goal: Optional[float] = None,
+                       since: Optional[str] = None, until: Optional[str] = None,
+                       batch_size: int = 50000) -> Iterator[List[Tuple]]:
+        #every matching row as plain tuples in COLUMNS order, batch_size at a time.
+        #one statement, so the whole export reads a single consistent snapshot. since / until compare
+        #against the iso analyzed_at, until is exclusive
+        clauses, params = [], []
+        if rate is not None:
+            clauses.append("rate = ?")
+            params.append(rate_key(rate))
+        if key_count is not None:
+            clauses.append("key_count = ?")
+            params.append(key_count)
+        if score_goal is not None:
+            clauses.append("score_goal = ?")
+            params.append(rate_key(score_goal))
+        if since:
+            clauses.append("analyzed_at >= ?")
+            params.append(since)
+        if until:
+            clauses.append("analyzed_at < ?")
+            params.append(until)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        # a cursor of its own without the Row factory, tuples are a lot cheaper in bulk
+        cursor = self._connection().cursor()
+        cursor.row_factory = None
+        cursor.execute(f"SELECT {', '.join(COLUMNS)} FROM analyses {where} ORDER BY rowid", params)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            cursor.close()
+
+    def get_timeline(self, file_hash: str, rate: float, window: float, hop: float,
+                     score_goal: float = DEFAULT_SCORE_GOAL) -> Optional[List[Dict]]:
+        row = self._connection().execute(
+            "SELECT data FROM timelines WHERE file_hash = ? AND rate = ? AND score_goal = ? AND window = ? AND hop = ?",
+            (file_hash, rate_key(rate), rate_key(score_goal), rate_key(window), rate_key(hop))
+        ).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def put_timeline(self, file_hash: str, rate: float, window: float, hop: float, timeline: List[Dict],
+                     computed_at: str, score_goal: float = DEFAULT_SCORE_GOAL):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO timelines (file_hash, rate, score_goal, window, hop, data, computed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (file_hash, rate_key(rate), rate_key(score_goal), rate_key(window), rate_key(hop), json.dumps(timeline), computed_at)
+            )
+
+    def count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+def analysis_row(file_hash: str, rate: float, metadata: Dict, difficulty_data: Dict, analyzed_at: str,
+                 source: str = "analyze", beatmap_id: Optional[int] = None, score_goal: float = DEFAULT_SCORE_GOAL,
+                 fingerprint: Optional[str] = None) -> Dict:
+    row = {
+        'file_hash': file_hash,
+        'rate': rate,
+        'score_goal': score_goal,
+        'beatmap_id': beatmap_id,
+        'title': metadata.get('title', 'Unknown'),
+        'artist': metadata.get('artist', 'Unknown'),
+        'difficulty_name': metadata.get('version', 'Unknown'),
+        'creator': metadata.get('creator', 'Unknown'),
+        'key_count': metadata.get('key_count', 4),
+        'hit_objects': metadata.get('hit_objects', 0),
+        'star_rating': metadata.get('star_rating', 0.0),
+        'source': source,
+        'analyzed_at': analyzed_at,
+        'fingerprint': fingerprint,
+    }
+    for skillset in SKILLSETS:
+        row[skillset] = difficulty_data.get(skillset, 0.0)
+    return row
+
+def metadata_from_row(row: Dict) -> Dict:
+    #inverse of analysis_row, for recomputing a stored chart at another rate / goal
+    return {
+        'title': row['title'],
+        'artist': row['artist'],
+        'version': row['difficulty_name'],
+        'creator': row['creator'],
+        'key_count': row['key_count'],
+        'hit_objects': row['hit_objects'],
+        'star_rating': row['star_rating'],
+    }
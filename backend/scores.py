@@ -6,10 +6,17 @@ from datetime import datetime
 import os
 import pickle
 
+from ttl_cache import TTLCache, token_key
+
+OSU_BASE_URL = os.getenv("OSU_BASE_URL", "https://osu.ppy.sh").rstrip("/")
+
+# token -> user id, tokens are long lived so this saves a /me per dashboard load
+user_id_cache = TTLCache("user_id", ttl=float(os.getenv("USER_CACHE_TTL", "600")), max_size=4096)
+
 class OsuUserScoresScraper:
     def __init__(self, access_token: str):
         self.access_token = access_token
-        self.base_url = "https://osu.ppy.sh/api/v2"
+        self.base_url = f"{OSU_BASE_URL}/api/v2"
         self.session = requests.Session()
 
 
@@ -224,13 +231,16 @@ class OsuUserScoresScraper:
 
 def get_user_id_from_token(access_token: str) -> int:
     """Get the user ID from the access token by fetching /me endpoint"""
+    return user_id_cache.get_or_compute(token_key(access_token), lambda: _fetch_user_id(access_token))
+
+def _fetch_user_id(access_token: str) -> int:
     headers = {
         'Authorization': f'Bearer {access_token}',
         'Content-Type': 'application/json',
         'Accept': 'application/json'
     }
 
-    response = requests.get("https://osu.ppy.sh/api/v2/me", headers=headers)
+    response = requests.get(f"{OSU_BASE_URL}/api/v2/me", headers=headers)
     response.raise_for_status()
     user_data = response.json()
     return user_data['id']
@@ -0,0 +1,143 @@
+import heapq
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+from result_store import DEFAULT_SCORE_GOAL, SKILLSETS, ResultStore, rate_key
+
+# k-nn over the 8 skillset vectors in the result store
+# one partition per (key count, rate) so constraints never need post filtering,
+# kd-tree per partition when scipy is around, plain numpy distances otherwise
+# new rows are picked up by rowid on every query and sit in a small brute force tail until the next rebuild
+# charts are compared by their note fingerprint as well as their file hash: fingerprint dedupe rows are the
+# same chart under another name, so results hold one row per fingerprint and never the query's own
+
+# (distance, file_hash, rate)
+Neighbour = Tuple[float, str, float]
+
+
+class _Partition:
+    def __init__(self):
+        self.hashes: List[str] = []
+        # parallel to hashes, None for rows stored before fingerprints existed
+        self.fingerprints: List[Optional[str]] = []
+        self.vectors = np.empty((0, len(SKILLSETS)), dtype=np.float32)
+        self.tree = None
+        self.pending_hashes: List[str] = []
+        self.pending_fingerprints: List[Optional[str]] = []
+        self.pending_vectors: List[List[float]] = []
+
+    def add(self, file_hash: str, fingerprint: Optional[str], vector: List[float]):
+        self.pending_hashes.append(file_hash)
+        self.pending_fingerprints.append(fingerprint)
+        self.pending_vectors.append(vector)
+
+    def compact(self, use_tree: bool):
+        if self.pending_vectors:
+            self.vectors = np.vstack([self.vectors, np.asarray(self.pending_vectors, dtype=np.float32)])
+            self.hashes.extend(self.pending_hashes)
+            self.fingerprints.extend(self.pending_fingerprints)
+            self.pending_hashes, self.pending_fingerprints, self.pending_vectors = [], [], []
+        self.tree = cKDTree(self.vectors) if use_tree and len(self.hashes) else None
+
+    def nearest(self, query: np.ndarray, k: int) -> List[Tuple[float, str, Optional[str]]]:
+        found = []
+        if self.tree is not None:
+            distances, indexes = self.tree.query(query, k=min(k, len(self.hashes)))
+            found = [(float(d), self.hashes[i], self.fingerprints[i])
+                     for d, i in zip(np.atleast_1d(distances), np.atleast_1d(indexes))]
+        elif self.hashes:
+            found = _brute_force(self.vectors, self.hashes, self.fingerprints, query, k)
+        if self.pending_vectors:
+            found += _brute_force(np.asarray(self.pending_vectors, dtype=np.float32), self.pending_hashes,
+                                  self.pending_fingerprints, query, k)
+        return found
+
+    def __len__(self):
+        return len(self.hashes) + len(self.pending_hashes)
+
+
+def _brute_force(vectors: np.ndarray, hashes: List[str], fingerprints: List[Optional[str]], query: np.ndarray,
+                 k: int) -> List[Tuple[float, str, Optional[str]]]:
+    distances = np.sqrt(((vectors - query) ** 2).sum(axis=1))
+    if len(distances) > k:
+        top = np.argpartition(distances, k)[:k]
+    else:
+        top = np.arange(len(distances))
+    return [(float(distances[i]), hashes[i], fingerprints[i]) for i in top]
+
+
+class SimilarityIndex:
+    def __init__(self, store: ResultStore, rebuild_threshold: int = 2048):
+        self.store = store
+        self.rebuild_threshold = rebuild_threshold
+        self.use_tree = cKDTree is not None
+        self._partitions: Dict[Tuple[int, float], _Partition] = {}
+        self._known = set()
+        self._last_rowid = 0
+        self._lock = threading.Lock()
+
+    def refresh(self) -> int:
+        #pulls in rows written since the last call (by this process, the importer, anyone)
+        with self._lock:
+            added = 0
+            for row in self.store.rows_since(self._last_rowid, DEFAULT_SCORE_GOAL):
+                self._last_rowid = max(self._last_rowid, row['rowid'])
+                # INSERT OR REPLACE gives a rewritten row a new rowid, the vector itself doesn't change
+                key = (row['file_hash'], row['rate'])
+                if key in self._known:
+                    continue
+                self._known.add(key)
+                partition = self._partitions.setdefault((row['key_count'], row['rate']), _Partition())
+                partition.add(row['file_hash'], row['fingerprint'], [row[name] or 0.0 for name in SKILLSETS])
+                added += 1
+
+            for partition in self._partitions.values():
+                if len(partition.pending_hashes) >= self.rebuild_threshold or (partition.pending_hashes and not partition.hashes):
+                    partition.compact(self.use_tree)
+            return added
+
+    def nearest(self, vector: List[float], k: int = 10, key_count: Optional[int] = None, rate: Optional[float] = None,
+                exclude: Optional[str] = None, exclude_fingerprint: Optional[str] = None) -> List[Neighbour]:
+        self.refresh()
+        query = np.asarray(vector, dtype=np.float32)
+        rate = rate_key(rate) if rate is not None else None
+
+        with self._lock:
+            partitions = [
+                (partition_rate, partition) for (partition_keys, partition_rate), partition in self._partitions.items()
+                if (key_count is None or partition_keys == key_count) and (rate is None or partition_rate == rate)
+            ]
+            # one extra so excluding the query chart still leaves k, more when copies of one chart
+            # (same fingerprint) take up several of the nearest slots
+            fetch = k + 1
+            while True:
+                # one result per chart and rate
+                closest: Dict[Tuple[str, float], Neighbour] = {}
+                for partition_rate, partition in partitions:
+                    for distance, file_hash, fingerprint in partition.nearest(query, fetch):
+                        if file_hash == exclude or (fingerprint and fingerprint == exclude_fingerprint):
+                            continue
+                        chart = (fingerprint or file_hash, partition_rate)
+                        if chart not in closest or distance < closest[chart][0]:
+                            closest[chart] = (distance, file_hash, partition_rate)
+                if len(closest) >= k or all(fetch >= len(partition) for _, partition in partitions):
+                    break
+                fetch *= 2
+
+        return heapq.nsmallest(k, closest.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "kdtree" if self.use_tree else "numpy",
+                "partitions": len(self._partitions),
+                "vectors": sum(len(p) for p in self._partitions.values()),
+                "pending": sum(len(p.pending_hashes) for p in self._partitions.values()),
+            }
@@ -0,0 +1,19 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture(scope="session")
+def main_module(tmp_path_factory):
+    #main creates downloads/ and opens the result store relative to the cwd on import
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("app"))
+    try:
+        yield importlib.import_module("main")
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+import admission
+from admission import BULK, INTERACTIVE, AdmissionController, AdmissionPool, Overloaded, job_cost, job_scope
+
+
+async def slot_order(pool, jobs, holder_owner="holder"):
+    #the holder takes the only slot, jobs (name, lane, owner, cost) queue behind it in list order,
+    #returns the order they were granted the slot in once the holder lets go
+    order = []
+    release = asyncio.Event()
+
+    async def holder():
+        with job_scope(INTERACTIVE, holder_owner):
+            async with pool.slot():
+                await release.wait()
+
+    async def job(name, lane, owner, cost):
+        with job_scope(lane, owner), job_cost(cost):
+            async with pool.slot():
+                order.append(name)
+
+    tasks = [asyncio.create_task(holder())]
+    await asyncio.sleep(0)
+    for spec in jobs:
+        tasks.append(asyncio.create_task(job(*spec)))
+        await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_interactive_lane_goes_first():
+    pool = AdmissionPool("cpu", 1, 10)
+    jobs = [("bulk", BULK, "a", 0), ("interactive", INTERACTIVE, "a", 0)]
+    assert asyncio.run(slot_order(pool, jobs)) == ["interactive", "bulk"]
+
+
+def test_cheapest_job_first_within_an_owner():
+    pool = AdmissionPool("cpu", 1, 10)
+    jobs = [("300", INTERACTIVE, "a", 300), ("100", INTERACTIVE, "a", 100), ("200", INTERACTIVE, "a", 200)]
+    assert asyncio.run(slot_order(pool, jobs)) == ["100", "200", "300"]
+
+
+def test_owners_take_turns():
+    # a holds the slot and queues three more, b joins last and still gets the second slot
+    pool = AdmissionPool("cpu", 1, 10)
+    jobs = [("a1", INTERACTIVE, "a", 0), ("a2", INTERACTIVE, "a", 0), ("a3", INTERACTIVE, "a", 0), ("b1", INTERACTIVE, "b", 0)]
+    assert asyncio.run(slot_order(pool, jobs, holder_owner="a")) == ["a1", "b1", "a2", "a3"]
+
+
+def test_old_bulk_jobs_are_promoted(monkeypatch):
+    monkeypatch.setattr(admission, "BULK_PROMOTE_AFTER", 0.02)
+    pool = AdmissionPool("cpu", 1, 10)
+
+    async def scenario():
+        order = []
+        release = asyncio.Event()
+
+        async def holder():
+            async with pool.slot():
+                await release.wait()
+
+        async def job(name, lane):
+            with job_scope(lane, "a"):
+                async with pool.slot():
+                    order.append(name)
+
+        tasks = [asyncio.create_task(holder())]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(job("bulk", BULK)))
+        # older than BULK_PROMOTE_AFTER by the time the slot frees up
+        await asyncio.sleep(0.05)
+        tasks.append(asyncio.create_task(job("interactive", INTERACTIVE)))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["bulk", "interactive"]
+
+
+def test_queue_bound_rejects_unadmitted_work_but_not_admitted_work():
+    controller = AdmissionController([AdmissionPool("cpu", 1, 1)])
+    pool = controller["cpu"]
+
+    async def scenario():
+        release = asyncio.Event()
+        results = {}
+
+        async def holder():
+            async with pool.slot():
+                await release.wait()
+
+        async def unadmitted(name):
+            try:
+                async with pool.slot():
+                    results[name] = "ran"
+            except Overloaded as e:
+                results[name] = e.retry_after
+
+        async def admitted_batch():
+            controller.admit("cpu")
+            await asyncio.sleep(0.01)
+            for _ in range(3):
+                async with pool.slot():
+                    pass
+            results["batch"] = "ran"
+
+        tasks = [asyncio.create_task(holder()), asyncio.create_task(admitted_batch())]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(unadmitted("queued")))
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(unadmitted("over_bound")))
+        await asyncio.sleep(0.02)
+        with pytest.raises(Overloaded):
+            controller.admit("cpu")
+        release.set()
+        await asyncio.gather(*tasks)
+        return results
+
+    results = asyncio.run(scenario())
+    assert results["queued"] == "ran"
+    assert results["batch"] == "ran"
+    assert isinstance(results["over_bound"], int)
+    assert pool.stats()["rejected"] == 2
+    assert pool.active == 0 and pool.waiting == 0
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import time
+
+
+async def call_app(app, method, path, body=b"", disconnect_after=None):
+    #drives the asgi app directly, the client goes away disconnect_after seconds after sending the body
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"test"), (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 1234), "server": ("test", 80),
+    }
+    sent_body = False
+    response = {}
+    # a real server answers every receive() after the client left with http.disconnect right away
+    gone_at = None if disconnect_after is None else time.monotonic() + disconnect_after
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        if gone_at is None:
+            await asyncio.Event().wait()
+        if time.monotonic() < gone_at:
+            await asyncio.sleep(gone_at - time.monotonic())
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+
+    await app(scope, receive, send)
+    return response
+
+
+def test_client_disconnect_cancels_analysis(main_module, monkeypatch):
+    state = {"cancelled": False}
+
+    async def slow_analysis(request):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    monkeypatch.setattr(main_module, "run_analysis", slow_analysis)
+    monkeypatch.setattr(main_module, "DISCONNECT_POLL_INTERVAL", 0.05)
+
+    body = json.dumps({"beatmap_ids": [1], "access_token": "x"}).encode()
+    started = time.perf_counter()
+    response = asyncio.run(call_app(main_module.app, "POST", "/analyze", body, disconnect_after=0.2))
+
+    assert state["cancelled"]
+    assert time.perf_counter() - started < 2
+    assert response["status"] == 499
+
+
+def test_cancel_reaches_job_running_in_another_worker(main_module, monkeypatch):
+    state = {"cancelled": False}
+
+    async def slow_analysis(request):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    monkeypatch.setattr(main_module, "run_analysis", slow_analysis)
+    monkeypatch.setattr(main_module, "DISCONNECT_POLL_INTERVAL", 0.05)
+    # a second worker sees the same downloads/jobs dir through its own LockDir
+    other_worker = main_module.LockDir(main_module.JOBS_DIR)
+
+    async def scenario():
+        body = json.dumps({"beatmap_ids": [1], "access_token": "x", "job_id": "job-1"}).encode()
+        analysis = asyncio.create_task(call_app(main_module.app, "POST", "/analyze", body))
+        await asyncio.sleep(0.2)
+        assert other_worker.is_held("job-1")
+        assert other_worker.acquire_nowait("job-1") is None
+        other_worker.request_cancel("job-1")
+        return await asyncio.wait_for(analysis, 2)
+
+    response = asyncio.run(scenario())
+
+    assert state["cancelled"]
+    assert response["status"] == 499
+    assert not other_worker.is_held("job-1")
+    assert not other_worker.cancel_requested("job-1")
@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+import compressed_cache
+from compressed_cache import MAGIC, open_binary, open_text, train_dictionary, write_file
+
+CHART = "osu file format v14\n\n[General]\nMode: 3\n\n[Metadata]\nTitle:Song ü\nVersion:{version}\n\n[HitObjects]\n" + \
+        "".join(f"{64 + 128 * (i % 4)},192,{i * 125},1,0,0:0:0:0:\n" for i in range(400))
+
+CODECS = ["zlib"] + (["zstd"] if compressed_cache.zstandard is not None else [])
+
+
+def write_plain(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def fresh_dictionaries(monkeypatch):
+    monkeypatch.setattr(compressed_cache, "_dictionaries", {})
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_round_trip(tmp_path, monkeypatch, codec):
+    monkeypatch.setattr(compressed_cache, "COMPRESSION", codec)
+    source = write_plain(tmp_path / "source.osu", CHART.format(version="Hard"))
+    target = str(tmp_path / "cached.osu")
+
+    write_file(source, target)
+
+    with open(target, "rb") as f:
+        assert f.read(len(MAGIC)) == MAGIC
+    assert os.path.getsize(target) < os.path.getsize(source)
+    with open_binary(target) as f:
+        assert f.read() == open(source, "rb").read()
+    with open_text(target) as f:
+        assert f.read() == CHART.format(version="Hard")
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_round_trip_with_a_dictionary(tmp_path, monkeypatch, codec):
+    monkeypatch.setattr(compressed_cache, "COMPRESSION", codec)
+    cache_dir = tmp_path / "sm"
+    cache_dir.mkdir()
+    for i in range(20):
+        write_plain(cache_dir / f"{i}.osu", CHART.format(version=f"Diff {i}"))
+
+    dict_id = train_dictionary(str(cache_dir), size=16 * 1024)
+    source = write_plain(tmp_path / "new.osu", CHART.format(version="New"))
+    target = str(cache_dir / "new.osu")
+    write_file(source, target)
+
+    with open(target, "rb") as f:
+        header = compressed_cache.HEADER.unpack(f.read(compressed_cache.HEADER.size))
+    assert header[2].rstrip(b"\0").decode() == dict_id
+    # the dictionary is read back from disk, not from this process' cache
+    compressed_cache._dictionaries.clear()
+    with open_text(target) as f:
+        assert f.read() == CHART.format(version="New")
+
+
+def test_plain_files_read_as_they_are(tmp_path):
+    path = write_plain(tmp_path / "plain.osu", CHART.format(version="Plain"))
+    with open_binary(path) as f:
+        assert f.read() == open(path, "rb").read()
+    with open_text(path) as f:
+        assert f.read() == CHART.format(version="Plain")
+
+
+def test_compression_none_writes_plain_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(compressed_cache, "COMPRESSION", "none")
+    source = write_plain(tmp_path / "source.osu", CHART.format(version="Hard"))
+    target = str(tmp_path / "cached.osu")
+    write_file(source, target)
+    assert open(target, "rb").read() == open(source, "rb").read()
+
+
+def test_compact_rewrites_in_place(tmp_path, monkeypatch):
+    monkeypatch.setattr(compressed_cache, "COMPRESSION", "zlib")
+    path = write_plain(tmp_path / "a.osu", CHART.format(version="A"))
+    stats = compressed_cache.compact(str(tmp_path))
+    assert stats["files"] == 1 and stats["bytes_after"] < stats["bytes_before"]
+    with open_text(path) as f:
+        assert f.read() == CHART.format(version="A")
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
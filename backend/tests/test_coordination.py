@@ -0,0 +1,66 @@
+import asyncio
+import os
+
+from coordination import LockDir
+
+
+def test_hold_lets_one_holder_in_at_a_time(tmp_path):
+    locks = LockDir(str(tmp_path / "locks"))
+    state = {"inside": 0, "most": 0, "runs": 0}
+
+    async def work():
+        async with locks.hold("chart_1.0"):
+            state["inside"] += 1
+            state["most"] = max(state["most"], state["inside"])
+            await asyncio.sleep(0.01)
+            state["runs"] += 1
+            state["inside"] -= 1
+
+    async def scenario():
+        await asyncio.gather(*(work() for _ in range(5)))
+
+    asyncio.run(scenario())
+    assert state == {"inside": 0, "most": 1, "runs": 5}
+    # lock files only exist while held
+    assert os.listdir(tmp_path / "locks") == []
+
+
+def test_separate_instances_share_the_lock(tmp_path):
+    # two LockDirs on one directory stand in for two workers
+    worker_a, worker_b = LockDir(str(tmp_path)), LockDir(str(tmp_path))
+    handle = worker_a.acquire_nowait("job-1")
+    assert handle is not None
+    assert worker_b.acquire_nowait("job-1") is None
+    assert worker_b.is_held("job-1")
+
+    worker_a.release("job-1", handle)
+    assert not worker_b.is_held("job-1")
+    handle = worker_b.acquire_nowait("job-1")
+    assert handle is not None
+    worker_b.release("job-1", handle)
+
+
+def test_cancel_markers(tmp_path):
+    worker_a, worker_b = LockDir(str(tmp_path)), LockDir(str(tmp_path))
+    handle = worker_a.acquire_nowait("job-1")
+    assert not worker_a.cancel_requested("job-1")
+
+    worker_b.request_cancel("job-1")
+    assert worker_a.cancel_requested("job-1")
+
+    worker_a.release("job-1", handle)
+    assert not worker_b.cancel_requested("job-1")
+    assert os.listdir(tmp_path) == []
+
+
+def test_leftovers_of_a_killed_holder_dont_count(tmp_path):
+    locks = LockDir(str(tmp_path))
+    # lock file and cancel marker of a process that died holding the key
+    open(locks.path_for("import"), "w").close()
+    locks.request_cancel("import")
+
+    assert not locks.is_held("import")
+    handle = locks.acquire_nowait("import")
+    assert handle is not None
+    assert not locks.cancel_requested("import")
+    locks.release("import", handle)
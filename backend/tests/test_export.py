@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+import export
+from export import ANALYSIS_FIELDS, SCORE_FIELDS, export_analyses, export_scores, to_columns
+from result_store import ResultStore, analysis_row
+
+METADATA = {'title': 'Song', 'artist': 'Artist', 'creator': 'Mapper', 'version': 'Hard', 'key_count': 4,
+            'hit_objects': 1000, 'star_rating': 4.2}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultStore(str(tmp_path / "results.sqlite3"))
+    store.put_many([
+        analysis_row("aaa", 1.0, METADATA, {'overall': 20.5, 'stream': 19.0}, "2026-03-01T10:00:00.123456",
+                     beatmap_id=123, fingerprint="fp"),
+        # no set id, no fingerprint, a skillset stored as NULL and a much longer title
+        {**analysis_row("bbb", 1.1, {**METADATA, 'title': 'A much longer title'}, {}, "2026-04-01T10:00:00"),
+         'chordjack': None},
+    ])
+    return store
+
+
+def test_npz_dtypes_and_missing_values(store, tmp_path, monkeypatch):
+    # one row per batch, so string widths have to be widened when the columns are stitched together
+    monkeypatch.setattr(export, "BATCH_SIZE", 1)
+    path = str(tmp_path / "analyses.npz")
+
+    assert export_analyses(store, path, "npz") == 2
+
+    data = np.load(path)
+    assert set(data.files) == {name for name, _ in ANALYSIS_FIELDS}
+    assert data['beatmap_id'].dtype == np.int64 and data['beatmap_id'].tolist() == [123, -1]
+    assert data['overall'].dtype == np.float64 and data['overall'][0] == 20.5
+    assert np.isnan(data['chordjack'][1])
+    assert data['title'].dtype.kind == 'U' and data['title'].tolist() == ['Song', 'A much longer title']
+    assert data['fingerprint'].tolist() == ['fp', '']
+    assert data['analyzed_at'].dtype == np.dtype('datetime64[us]')
+    assert str(data['analyzed_at'][0]) == '2026-03-01T10:00:00.123456'
+
+
+def test_filters_and_empty_exports(store, tmp_path):
+    path = str(tmp_path / "filtered.npz")
+    assert export_analyses(store, path, "npz", rate=1.1, since="2026-03-15") == 1
+    assert np.load(path)['file_hash'].tolist() == ['bbb']
+
+    empty = str(tmp_path / "empty.npz")
+    assert export_analyses(store, empty, "npz", key_count=7) == 0
+    data = np.load(empty)
+    assert data['overall'].shape == (0,) and data['analyzed_at'].dtype == np.dtype('datetime64[us]')
+
+
+def test_missing_values_per_kind():
+    fields = [('i', 'int'), ('f', 'float'), ('s', 'str'), ('b', 'bool'), ('t', 'datetime')]
+    columns = to_columns([(None, None, None, None, None), (1, 2.5, 'x', True, '2026-01-02T03:04:05Z')], fields)
+    assert columns['i'].tolist() == [-1, 1]
+    assert np.isnan(columns['f'][0])
+    assert columns['s'].tolist() == ['', 'x']
+    assert columns['b'].tolist() == [False, True]
+    assert np.isnat(columns['t'][0]) and str(columns['t'][1]) == '2026-01-02T03:04:05.000000'
+
+
+def test_score_export(tmp_path):
+    import json
+    scores_dir = tmp_path / "user_scores"
+    scores_dir.mkdir()
+    score = {'beatmap_id': 1, 'beatmapset_id': 9, 'rate': 1.5, 'pp': 100.0, 'accuracy': 96.5, 'perfect': False,
+             'created_at': '2026-01-02T03:04:05Z', 'statistics': {'great': 10}}
+    (scores_dir / "user_scores_x_5.json").write_text(json.dumps(
+        {'user_id': 5, 'username': 'x', 'best_scores': [score], 'recent_scores': [{**score, 'rate': 1.0}]}))
+
+    path = str(tmp_path / "scores.npz")
+    assert export_scores(str(scores_dir), path, "npz", rate=1.5) == 1
+    data = np.load(path)
+    assert set(data.files) == {name for name, _ in SCORE_FIELDS}
+    assert data['list'].tolist() == ['best']
+    assert data['key_count'].tolist() == [-1]
+    assert data['statistics'].tolist() == ['{"great": 10}']
+
+
+def test_parquet_matches_npz(store, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "analyses.parquet")
+    assert export_analyses(store, path, "parquet") == 2
+    table = pq.read_table(path)
+    assert table.column('beatmap_id').to_pylist() == [123, -1]
+    assert table.column('fingerprint').to_pylist() == ['fp', '']
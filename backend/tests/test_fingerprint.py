@@ -0,0 +1,42 @@
+from osu_to_sm import OsuBeatmap
+
+
+def chart(offset=0, title="Song", version="Hard", notes=None, bpm_ms=500.0):
+    #a small 4k chart, every time shifted by offset
+    notes = notes or [(i * 250, i % 4) for i in range(32)] + [(8000, 0, 8500)]
+    hit_objects = []
+    for note in notes:
+        time, column = note[0] + offset, note[1]
+        x = int((column + 0.5) * 512 / 4)
+        if len(note) == 3:
+            hit_objects.append(f"{x},192,{time},128,0,{note[2] + offset}:0:0:0:0:")
+        else:
+            hit_objects.append(f"{x},192,{time},1,0,0:0:0:0:")
+    return "\n".join([
+        "osu file format v14", "", "[General]", "Mode: 3", "",
+        "[Metadata]", f"Title:{title}", "Artist:Artist", "Creator:Mapper", f"Version:{version}", "BeatmapSetID:1", "",
+        "[Difficulty]", "CircleSize:4", "OverallDifficulty:8", "",
+        "[TimingPoints]", f"{offset},{bpm_ms},4,2,0,100,1,0", f"{4000 + offset},-50,4,2,0,100,0,0", "",
+        "[HitObjects]", *hit_objects, "",
+    ])
+
+
+def fingerprint(text):
+    return OsuBeatmap.from_text(text).fingerprint()
+
+
+def test_stable_across_an_offset_shift():
+    assert fingerprint(chart()) == fingerprint(chart(offset=137))
+
+
+def test_metadata_doesnt_count():
+    assert fingerprint(chart()) == fingerprint(chart(title="Renamed (reupload)", version="Copy 4K stream"))
+
+
+def test_notes_and_timing_do_count():
+    base = fingerprint(chart())
+    moved = [(i * 250, (i + 1) % 4) for i in range(32)] + [(8000, 0, 8500)]
+    assert fingerprint(chart(notes=moved)) != base
+    assert fingerprint(chart(bpm_ms=400.0)) != base
+    # a hold's length is part of the chart
+    assert fingerprint(chart(notes=[(i * 250, i % 4) for i in range(32)] + [(8000, 0, 8600)])) != base
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from ttl_cache import TTLCache
+
+
+def test_waiter_takes_over_when_the_fetching_caller_is_cancelled():
+    cache = TTLCache("test", ttl=60)
+    calls = []
+
+    async def fetch():
+        calls.append(len(calls))
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def scenario():
+        first = asyncio.create_task(cache.get_or_fetch("key", fetch))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.get_or_fetch("key", fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == "value"
+    assert len(calls) == 2
+    assert cache.get("key") == "value"
+
+
+def test_concurrent_misses_share_one_fetch():
+    cache = TTLCache("test", ttl=60)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_fetch("key", fetch) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == [1] * 5
+    assert len(calls) == 1
+
+
+def test_cancelled_waiter_does_not_cancel_the_fetch():
+    cache = TTLCache("test", ttl=60)
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def scenario():
+        first = asyncio.create_task(cache.get_or_fetch("key", fetch))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.get_or_fetch("key", fetch))
+        await asyncio.sleep(0.01)
+        second.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        return await first
+
+    assert asyncio.run(scenario()) == "value"
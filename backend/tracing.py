@@ -0,0 +1,136 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+# chrome trace event format (open in perfetto / chrome://tracing)
+# only requests that asked for a trace pay for any of this
+
+
+class TraceRecorder:
+    def __init__(self, label: str):
+        self.trace_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{label}-{uuid.uuid4().hex[:8]}"
+        self.label = label
+        self.events: List[dict] = []
+        self.thread_names: Dict[Tuple[int, int], str] = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, started: float, finished: float, category: str = "stage",
+                 pid: Optional[int] = None, tid: Optional[int] = None, thread_name: Optional[str] = None,
+                 args: Optional[dict] = None):
+        #started/finished are time.time() values so spans from worker processes line up
+        if pid is None:
+            pid = os.getpid()
+        if tid is None:
+            tid = threading.get_ident()
+            thread_name = thread_name or threading.current_thread().name
+
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": started * 1_000_000,
+            "dur": max(0.0, finished - started) * 1_000_000,
+            "pid": pid,
+            "tid": tid,
+            "args": args or {},
+        }
+        with self._lock:
+            self.events.append(event)
+            if thread_name and (pid, tid) not in self.thread_names:
+                self.thread_names[(pid, tid)] = thread_name
+
+    def to_chrome(self) -> dict:
+        with self._lock:
+            events = list(self.events)
+            names = dict(self.thread_names)
+
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for (pid, tid), name in names.items()
+        ]
+        metadata += [
+            {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "api" if pid == os.getpid() else f"worker {pid}"}}
+            for pid in sorted({pid for pid, _ in names})
+        ]
+        return {"traceEvents": metadata + sorted(events, key=lambda e: e["ts"]), "displayTimeUnit": "ms",
+                "otherData": {"trace_id": self.trace_id, "label": self.label}}
+
+
+_current_trace: contextvars.ContextVar[Optional[TraceRecorder]] = contextvars.ContextVar("current_trace", default=None)
+_trace_args: contextvars.ContextVar[dict] = contextvars.ContextVar("trace_args", default={})
+
+def current_trace() -> Optional[TraceRecorder]:
+    return _current_trace.get()
+
+@contextmanager
+def tracing(recorder: TraceRecorder):
+    token = _current_trace.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current_trace.reset(token)
+
+@contextmanager
+def trace_args(**args):
+    #tags every span inside with e.g. beatmap id / difficulty
+    token = _trace_args.set({**_trace_args.get(), **args})
+    try:
+        yield
+    finally:
+        _trace_args.reset(token)
+
+def record_span(name: str, started: float, finished: float, category: str = "stage", **kwargs):
+    recorder = _current_trace.get()
+    if recorder is None:
+        return
+    recorder.add_span(name, started, finished, category, args=dict(_trace_args.get()), **kwargs)
+
+@contextmanager
+def span(name: str, category: str = "stage"):
+    if _current_trace.get() is None:
+        yield
+        return
+    started = time.time()
+    try:
+        yield
+    finally:
+        record_span(name, started, time.time(), category)
+
+
+class TraceStore:
+    def __init__(self, trace_dir: str, max_traces: int = 100):
+        self.trace_dir = trace_dir
+        self.max_traces = max_traces
+
+    def save(self, recorder: TraceRecorder) -> str:
+        os.makedirs(self.trace_dir, exist_ok=True)
+        path = os.path.join(self.trace_dir, f"{recorder.trace_id}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(recorder.to_chrome(), f)
+        self._prune()
+        return path
+
+    def _prune(self):
+        traces = sorted(
+            (os.path.join(self.trace_dir, name) for name in os.listdir(self.trace_dir) if name.endswith(".json")),
+            key=os.path.getmtime,
+            reverse=True,
+        )
+        for stale in traces[self.max_traces:]:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+    def path_for(self, trace_id: str) -> Optional[str]:
+        # ids come from the url, never let them walk out of the trace dir
+        if not trace_id or os.path.basename(trace_id) != trace_id:
+            return None
+        path = os.path.join(self.trace_dir, f"{trace_id}.json")
+        return path if os.path.exists(path) else None
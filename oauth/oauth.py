@@ -1,15 +1,36 @@
+import asyncio
+import hmac
 import os
+import sys
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import requests
+from typing import Optional
+import aiohttp
+
+# shared cache layer lives with the backend
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from ttl_cache import TTLCache, token_key
 
 load_dotenv()
 
 CLIENT_ID = os.getenv("CLIENT_ID")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 REDIRECT_URI = os.getenv("REDIRECT_URI")
+# /cache-stats stays disabled unless ADMIN_TOKEN is set, same as the backend's admin endpoints
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") or None
+
+OSU_BASE_URL = os.getenv("OSU_BASE_URL", "https://osu.ppy.sh").rstrip("/")
+TOKEN_URL = f"{OSU_BASE_URL}/oauth/token"
+API_URL = f"{OSU_BASE_URL}/api/v2"
+
+# /me + /me/mania per token, short ttl so pp/rank stay reasonably fresh
+user_cache = TTLCache("oauth_user", ttl=float(os.getenv("OAUTH_USER_CACHE_TTL", "120")), max_size=4096)
+
+# refresh tokens are single use, retries of the same refresh share one upstream call
+# and get its answer back for a few seconds afterwards
+refresh_cache = TTLCache("oauth_refresh", ttl=float(os.getenv("OAUTH_REFRESH_DEDUPE_TTL", "10")), max_size=1024)
 
 app = FastAPI()
 
@@ -25,12 +46,45 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+http_session: aiohttp.ClientSession = None
+
+@app.on_event("startup")
+async def startup_event():
+    #one pooled client for the whole app
+    global http_session
+    http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=int(os.getenv("OAUTH_HTTP_POOL_SIZE", "100")), keepalive_timeout=30),
+        timeout=aiohttp.ClientTimeout(total=float(os.getenv("OAUTH_HTTP_TIMEOUT", "15")))
+    )
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if http_session:
+        await http_session.close()
+
 class RefreshTokenRequest(BaseModel):
     refresh_token: str
 
+async def post_token(payload: dict) -> dict:
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    try:
+        async with http_session.post(TOKEN_URL, data=payload, headers=headers) as response:
+            print(f"Token {payload['grant_type']} response status: {response.status}")
+
+            if response.status != 200:
+                raise HTTPException(status_code=response.status, detail=await response.text())
+
+            return await response.json()
+
+    except asyncio.TimeoutError:
+        print("Token request timed out")
+        raise HTTPException(status_code=504, detail="osu! token endpoint timed out")
+    except aiohttp.ClientError as e:
+        print(f"Token request failed: {e}")
+        raise HTTPException(status_code=502, detail="Failed to reach osu! token endpoint")
+
 @app.get("/callback")
 async def auth_callback(code: str):
-    token_url = "https://osu.ppy.sh/oauth/token"
     payload = {
         "client_id": CLIENT_ID,
         "client_secret": CLIENT_SECRET,
@@ -39,19 +93,10 @@ async def auth_callback(code: str):
         "redirect_uri": REDIRECT_URI
     }
 
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    response = requests.post(token_url, data=payload, headers=headers)
-
-    print(f"Token exchange response status: {response.status_code}")
-
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=response.text)
-
-    return response.json()
+    return await post_token(payload)
 
 @app.post("/refresh")
 async def refresh_token(request: RefreshTokenRequest):
-    token_url = "https://osu.ppy.sh/oauth/token"
     payload = {
         "client_id": CLIENT_ID,
         "client_secret": CLIENT_SECRET,
@@ -59,15 +104,7 @@ async def refresh_token(request: RefreshTokenRequest):
         "grant_type": "refresh_token"
     }
 
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    response = requests.post(token_url, data=payload, headers=headers)
-
-    print(f"Token refresh response status: {response.status_code}")
-
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=response.text)
-
-    return response.json()
+    return await refresh_cache.get_or_fetch(token_key(request.refresh_token), lambda: post_token(payload))
 
 @app.get("/user")
 async def get_user(authorization: str = Header()):
@@ -75,35 +112,49 @@ async def get_user(authorization: str = Header()):
         raise HTTPException(status_code=401, detail="Invalid authorization header")
 
     token = authorization.replace("Bearer ", "")
+    return await user_cache.get_or_fetch(token_key(token), lambda: fetch_user(token))
 
+async def fetch_user(token: str) -> dict:
     headers = {
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
     }
 
+    async def get_json(endpoint: str):
+        async with http_session.get(f"{API_URL}{endpoint}", headers=headers) as response:
+            if response.status != 200:
+                return response.status, await response.text()
+            return response.status, await response.json()
+
     try:
-        response = requests.get("https://osu.ppy.sh/api/v2/me", headers=headers)
+        # both calls only need the token, no reason to wait on /me first
+        (status, user_data), (mania_status, mania_data) = await asyncio.gather(get_json("/me"), get_json("/me/mania"))
 
-        if response.status_code == 401:
+        if status == 401:
             raise HTTPException(status_code=401, detail="Invalid or expired token")
-        elif response.status_code != 200:
-            print(f"API Error: {response.status_code} - {response.text}")
-            raise HTTPException(status_code=response.status_code, detail=response.text)
+        elif status != 200:
+            print(f"API Error: {status} - {user_data}")
+            raise HTTPException(status_code=status, detail=user_data)
 
-        user_data = response.json()
         print(f"Got user data for: {user_data.get('username', 'unknown')}")
 
-        mania_response = requests.get("https://osu.ppy.sh/api/v2/me/mania", headers=headers)
-
-        if mania_response.status_code == 200:
-            mania_data = mania_response.json()
+        if mania_status == 200:
             print(f"Got mania stats - PP: {mania_data.get('statistics', {}).get('pp', 'N/A')}")
             user_data["statistics"] = mania_data.get("statistics", {})
         else:
-            print(f"Mania stats failed: {mania_response.status_code}")
+            print(f"Mania stats failed: {mania_status}")
 
         return user_data
 
-    except requests.RequestException as e:
+    except asyncio.TimeoutError:
+        print("User request timed out")
+        raise HTTPException(status_code=504, detail="osu! api timed out")
+    except aiohttp.ClientError as e:
         print(f"Request failed: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch user data")
+        raise HTTPException(status_code=502, detail="Failed to fetch user data")
+
+@app.get("/cache-stats")
+async def cache_stats(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    return [user_cache.stats(), refresh_cache.stats()]